@@ -7,9 +7,7 @@ from craft_utils import *
 def neprofile (necube, dkpc, theta, phi, cenpx, radius):
 	#	Calculate radial electron density profiles along theta, phi	
 	
-	nepro	=	np.zeros(len(radius), dtype=float)
-	for i in range(0, len(radius)):
-		nepro[i]= necube[ int(cenpx[0]+radius[i] * np.cos(theta) * np.cos(phi)), int(cenpx[1]+radius[i] * np.cos(theta) * np.sin(phi)), int(cenpx[2] + radius[i] * np.sin(theta))]
+	nepro	=	neprofiles(necube, dkpc, np.array([theta], dtype=float), np.array([phi], dtype=float), cenpx, radius)[0].astype(float)
 	
 	return (nepro)
 #	------------------------------------------------------------------------------------------------------
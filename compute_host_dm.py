@@ -100,13 +100,17 @@ def find_los_in_range(df_snap, inc_range, impf_range, args):
     combined_df = pd.DataFrame()
     
     for i, snap in df_snap.iterrows():
-        thisfile = args.los_dir / f'{snap["snap"]}_{snap["halo"]}_FRB_El_number_density_upto{args.rangekpc}kpc_res{args.reskpc}kpc_150.npy'
-        if os.path.exists(thisfile):
+        file_prefix = args.los_dir / f'{snap["snap"]}_{snap["halo"]}_FRB_El_number_density_upto{args.rangekpc}kpc_res{args.reskpc}kpc'
+        atlasfile = Path(f'{file_prefix}_dmatlas.h5')
+        thisfile = Path(f'{file_prefix}_150.npy')
+        if use_dm_atlas(file_prefix, args):
+            this_df = read_dm_atlas(atlasfile, inc_range, impf_range=impf_range)
+        elif os.path.exists(thisfile):
             dm_arr	= np.load(thisfile)
+            this_df = pd.DataFrame(dm_arr, columns=['inc', 'impf', 'distmaj', 'losdm'])
+            this_df = this_df[(this_df['inc'].between(inc_range[0], inc_range[1])) & (this_df['impf'].between(impf_range[0], impf_range[1]))]
         else:
             continue
-        this_df = pd.DataFrame(dm_arr, columns=['inc', 'impf', 'distmaj', 'losdm'])
-        this_df = this_df[(this_df['inc'].between(inc_range[0], inc_range[1])) & (this_df['impf'].between(impf_range[0], impf_range[1]))]
         combined_df = pd.concat([combined_df, this_df], ignore_index=True)
         
     print(f"Total number of LoS = {len(combined_df)}, within inclination range {inc_range}, impact factor range {impf_range}")	
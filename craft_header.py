@@ -10,9 +10,13 @@
 import os, sys, argparse, re, subprocess, time, math, glob
 import numpy as np
 import multiprocessing as mproc
+from multiprocessing import shared_memory
+import multiprocessing.util
 from datetime import timedelta, datetime
 
 import pickle as pkl
+import zipfile, struct
+import hashlib
 from collections import namedtuple
 from itertools import combinations
 
@@ -40,10 +44,13 @@ from scipy.interpolate import interp1d
 from scipy.special import erf
 from scipy.optimize import curve_fit, fminbound
 from scipy.ndimage import gaussian_filter
+from scipy.ndimage import affine_transform
 from scipy.stats import binned_statistic
 from scipy.stats import binned_statistic_2d
 from scipy.stats import median_abs_deviation
 
+import h5py
+
 from astropy.io import ascii, fits
 from astropy.table import Table
 from astropy.stats import gaussian_fwhm_to_sigma as gf2s
@@ -16,9 +16,7 @@ from globalpars import *
 def neprofile (necube, dkpc, theta, phi, cenpx, radius):
 	#	Calculate radial electron density profiles along theta, phi	
 	
-	nepro	=	np.zeros(len(radius), dtype=float)
-	for i in range(0, len(radius)):
-		nepro[i]= necube[ int(cenpx[0]+radius[i] * np.cos(theta) * np.cos(phi)), int(cenpx[1]+radius[i] * np.cos(theta) * np.sin(phi)), int(cenpx[2] + radius[i] * np.sin(theta))]
+	nepro	=	neprofiles(necube, dkpc, np.array([theta], dtype=float), np.array([phi], dtype=float), cenpx, radius)[0].astype(float)
 	
 	return (nepro)
 
@@ -139,6 +137,66 @@ def distfrmajorax (theta0, phi0, pt1, pt2):
 	
 	return (mindist)
 
+#	------------------------------------------------------------------------------------------------------
+def inclinvecs (vecomps, theta0, phi0):
+#   Return inclinations (in degrees) of many vectors w.r.t. z axis; vectorised version of inclinvec
+#	Arguments:	An (N,3) array of vectors, orientation of the galaxy
+
+	normvec	= np.array([np.sin(theta0) * np.cos(phi0), np.sin(theta0) * np.sin(phi0), np.cos(theta0)])
+	dotpabs	= np.abs(vecomps @ normvec)
+
+	inclin  = np.rad2deg(np.arccos(dotpabs / np.sqrt(np.sum(vecomps**2, axis=1))))
+
+	return (inclin)
+
+#	------------------------------------------------------------------------------------------------------
+def impactfacs (pt1, pt2):
+#   Return the impact factors for many LoS in units of "pixels"; vectorised version of impactfac
+#	Arguments:	Two (N,3) arrays of fixed points on each LoS
+
+	crosq	= np.sum(np.cross(pt1, pt2)**2, axis=1)
+	modsq	= np.sum((pt1 - pt2)**2, axis=1)
+
+	impactf = np.sqrt(crosq / modsq)
+
+	return (impactf)
+
+#	------------------------------------------------------------------------------------------------------
+def distfrmajoraxs (theta0, phi0, pt1, pt2):
+#   Return the projected distances of many LoS from the apparent major axis; vectorised version of distfrmajorax
+#	Arguments:	Orientation of the galaxy, two (N,3) arrays of fixed points on each LoS
+
+	normvec		= np.array([ np.sin(theta0) * np.cos(phi0), np.sin(theta0) * np.sin(phi0), np.cos(theta0)])
+
+	losvec		= pt2 - pt1
+	majaxvec	= np.cross(losvec, normvec)
+
+	#	Seen face on the apparent major axis is undefined (losvec x normvec = 0), so take a fixed in plane reference direction instead, as viewdirs does
+	faceon		= np.sum(majaxvec**2, axis=1) <= 1e-18 * np.sum(losvec**2, axis=1)
+	if np.any(faceon):
+		refvec		= np.array([0.0, 0.0, 1.0]) if np.abs(normvec[2]) < 0.9 else np.array([1.0, 0.0, 0.0])
+		majaxvec[faceon]	= np.cross(normvec, refvec)
+
+	crpdct		= np.cross(majaxvec, losvec)
+	mindist		= np.abs(np.sum(crpdct * pt1, axis=1)) / np.sqrt(np.sum(crpdct**2, axis=1))
+
+	return (mindist)
+
+#	------------------------------------------------------------------------------------------------------
+def neprofiles (necube, dkpc, thetas, phis, cenpx, radius):
+#	Calculate radial electron density profiles along many (theta, phi) directions in one gather; vectorised version of neprofile
+#	Arguments:	ne cube, cell size in kpc, arrays of directions, centre pixel, radii
+#	Returns a (len(thetas), len(radius)) array of ne; indices are truncated towards zero, as with int() in neprofile
+
+	rcost	= radius[None,:] * np.cos(thetas)[:,None]
+	xidx	= (cenpx[0] + rcost * np.cos(phis)[:,None]).astype(int)
+	yidx	= (cenpx[1] + rcost * np.sin(phis)[:,None]).astype(int)
+	zidx	= (cenpx[2] + radius[None,:] * np.sin(thetas)[:,None]).astype(int)
+
+	nepros	= necube[xidx, yidx, zidx]
+
+	return (nepros)
+
 #	------------------------------------------------------------------------------------------------------
 def linearxy (xy, a, b, c):
 #	Retruns a linear function of two independent variables
@@ -516,6 +574,279 @@ def get_grid_size(n_total):
     
     return nrows, ncols
 
+###################### Following routines are for the DM atlas (see nefns.dmatlas) ######################################
+# --------------------------------------------------------------------------------------------------------------
+def get_file_hash(filename, blocksize=2**24):
+    '''
+    Function to compute the sha1 hash of the contents of a (large) file, reading it in blocks
+    Returns hex digest string
+    '''
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as file_obj:
+        for block in iter(lambda: file_obj.read(blocksize), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+# --------------------------------------------------------------------------------------------------------------
+def is_atlas_current(atlasfile, fitsfile):
+    '''
+    Function to check whether a DM atlas was built from the current contents of the given FITS cube
+    The file size and modification time are checked first, so that the cube is only hashed when those have changed
+    Returns boolean
+    '''
+    if not os.path.exists(atlasfile): return False
+
+    with h5py.File(atlasfile, 'r') as hf:
+        if 'cubehash' not in hf.attrs: return False
+        if hf.attrs['cubesize'] == os.path.getsize(fitsfile) and hf.attrs['cubemtime'] == os.path.getmtime(fitsfile): return True
+        cubehash = hf.attrs['cubehash']
+
+    return get_file_hash(fitsfile) == cubehash
+
+# --------------------------------------------------------------------------------------------------------------
+def use_dm_atlas(file_prefix, args):
+    '''
+    Function to check whether the DM atlas of a given cube (file_prefix in args.los_dir) can be read instead of its LoS DM files, i.e. args.use_atlas is set, the atlas exists,
+    and it was built from the current FITS cube in args.data_dir (if the cube is no longer there, the atlas is taken as it is)
+    Returns boolean
+    '''
+    atlasfile = Path(f'{file_prefix}_dmatlas.h5')
+    if not args.use_atlas or not atlasfile.exists(): return False
+
+    fitsfile = args.data_dir / f'{Path(file_prefix).name}.fits'
+    if fitsfile.exists() and not is_atlas_current(atlasfile, fitsfile):
+        print(f'{atlasfile} is older than {fitsfile}, therefore reading the LoS DM files instead; rerun gethostdm_all.py atlas to rebuild it')
+        return False
+
+    return True
+
+# --------------------------------------------------------------------------------------------------------------
+def read_dm_atlas(atlasfile, inc_range, impf_range=None):
+    '''
+    Function to query a DM atlas for all LoS within given inclination and (optionally) impact factor ranges
+    Only the maps whose viewing inclination falls in inc_range are read from disk
+    Returns dataframe with the same columns as the LoS DM arrays, i.e. inc, impf, distmaj, losdm
+    '''
+    with h5py.File(atlasfile, 'r') as hf:
+        incs = hf['inc'][:]
+        impf = hf['impf'][:]
+        map_indices = np.where((incs >= inc_range[0]) & (incs <= inc_range[1]))[0]
+
+        pix_mask = np.isfinite(impf)
+        if impf_range is not None: pix_mask &= (impf >= impf_range[0]) & (impf <= impf_range[1])
+        npix = np.sum(pix_mask)
+
+        dm_arr = np.zeros((len(map_indices) * npix, 4), dtype=np.float32)
+        for i, index in enumerate(map_indices):
+            rows = slice(i * npix, (i + 1) * npix)
+            dm_arr[rows, 0] = incs[index]
+            dm_arr[rows, 1] = impf[pix_mask]
+            dm_arr[rows, 2] = hf['distmaj'][index][pix_mask]
+            dm_arr[rows, 3] = hf['dm'][index][pix_mask]
+
+    df = pd.DataFrame(dm_arr, columns=['inc', 'impf', 'distmaj', 'losdm'])
+    df = df[np.isfinite(df['losdm'])].reset_index(drop=True)
+
+    return df
+
+###################### Following routines are for the columnar radial profile store ######################################
+# --------------------------------------------------------------------------------------------------------------
+def write_radial_profile(neres, filename, chunk_rows=4096):
+    '''
+    Function to write a neradial profile (see nefns.neprofinc) to a columnar HDF5 file, one dataset per field
+    Rows (radial directions) are sorted by inclination and chunked, so that readers can pull just one inclination range
+    Returns nothing
+    '''
+    order = np.argsort(neres.inclination, kind='stable')
+    tmpfile = str(filename) + '.tmp'
+
+    with h5py.File(tmpfile, 'w') as hf:
+        for field in ['logsm', 'logsfr', 'redshift', 'theta0', 'phi0']: hf.attrs[field] = getattr(neres, field)
+        hf.create_dataset('radkpc', data=neres.radkpc)
+        for field in ['theta', 'phi', 'inclination']: hf.create_dataset(field, data=np.asarray(getattr(neres, field))[order])
+        hf.create_dataset('neincrad', data=neres.neincrad[order], chunks=(min(chunk_rows, max(len(order), 1)), neres.neincrad.shape[1]))
+
+    os.replace(tmpfile, filename)
+
+    return
+
+# --------------------------------------------------------------------------------------------------------------
+def read_radial_profile(filename, inc_ranges=None):
+    '''
+    Function to read a radial profile written by write_radial_profile
+    If inc_ranges (in degrees, inclusive) are given, only the rows within those ranges are read from disk, via the inclination sorted layout
+    Returns neradial namedtuple
+    '''
+    with h5py.File(filename, 'r') as hf:
+        inclination = hf['inclination'][:]
+        if inc_ranges is None:
+            row_slices = [slice(0, len(inclination))]
+        else:
+            row_slices = []
+            for start, stop in sorted([(np.searchsorted(inclination, np.deg2rad(inc_range[0]), side='left'), np.searchsorted(inclination, np.deg2rad(inc_range[1]), side='right')) for inc_range in inc_ranges]):
+                if len(row_slices) > 0 and start <= row_slices[-1].stop: row_slices[-1] = slice(row_slices[-1].start, max(stop, row_slices[-1].stop)) # merge overlapping ranges, so that no row is read twice
+                else: row_slices.append(slice(start, stop))
+        
+        columns = {field: np.concatenate([hf[field][row_slice] for row_slice in row_slices]) for field in ['theta', 'phi', 'inclination', 'neincrad']}
+        neres = neradial(hf.attrs['logsm'], hf.attrs['logsfr'], hf.attrs['redshift'], hf.attrs['theta0'], hf.attrs['phi0'], hf['radkpc'][:], columns['theta'], columns['phi'], columns['inclination'], columns['neincrad'])
+
+    return neres
+
+###################### Following routines are for the streaming ne percentile sketch ######################################
+# --------------------------------------------------------------------------------------------------------------
+def make_ne_sketch(n_inc, n_rad, ne_edges=neskedges):
+    '''
+    Function to initialise a streaming percentile sketch of ne, i.e. fixed edge log histograms per (inclination range, radial bin)
+    The first and last histogram bins hold everything below (including zeros) and above the edges
+    Returns (n_inc, n_rad, len(ne_edges) + 1) array of counts
+    '''
+    sketch = np.zeros((n_inc, n_rad, len(ne_edges) + 1), dtype=np.int64)
+
+    return sketch
+
+# --------------------------------------------------------------------------------------------------------------
+def update_ne_sketch(sketch, cube, inc_ranges, rad_edges, ne_edges=neskedges):
+    '''
+    Function to add one radial profile (neradial namedtuple) to the sketch, with the same inclusive binning as plotfns.plot_nerad
+    Returns the updated sketch
+    '''
+    nhist = sketch.shape[2]
+    for i, inc_range in enumerate(inc_ranges):
+        relinds = np.where((cube.inclination - np.deg2rad(inc_range[0])) * (cube.inclination - np.deg2rad(inc_range[1])) <= 0.0)[0]
+        relne = cube.neincrad[relinds]
+        for k in range(len(rad_edges) - 1):
+            rel2inds = np.where((cube.radkpc - rad_edges[k]) * (cube.radkpc - rad_edges[k + 1]) <= 0.0)[0]
+            values = relne[:, rel2inds].ravel()
+            values = values[np.isfinite(values)]
+            sketch[i, k] += np.bincount(np.searchsorted(ne_edges, values, side='right'), minlength=nhist)
+
+    return sketch
+
+# --------------------------------------------------------------------------------------------------------------
+def merge_ne_sketch(sketch):
+    '''
+    Function to merge (sum) the sketches of all MPI ranks; a no-op on a single rank
+    Returns the merged sketch, on every rank
+    '''
+    comm = MPI.COMM_WORLD
+    if comm.size > 1: comm.Allreduce(MPI.IN_PLACE, sketch, op=MPI.SUM)
+
+    return sketch
+
+# --------------------------------------------------------------------------------------------------------------
+def get_sketch_binned_nes(sketch, rad_edges, percentiles=(16, 25, 50, 75, 84), ne_edges=neskedges):
+    '''
+    Function to read percentiles off the sketch, interpolating in log ne within a histogram bin; the error is bounded by the bin width
+    Returns list of (len(rad_edges)-1, 1 + len(percentiles)) arrays, one per inclination range, as accepted by plotfns.plot_nerad
+    '''
+    log_edges = np.log10(ne_edges)
+    binned_nes = []
+    for i in range(sketch.shape[0]):
+        binned_ne = np.zeros((sketch.shape[1], 1 + len(percentiles)), dtype=np.float32)
+        binned_ne[:, 0] = (np.array(rad_edges[:-1]) + np.array(rad_edges[1:])) / 2.
+        for k in range(sketch.shape[1]):
+            counts = sketch[i, k]
+            cumcounts = np.cumsum(counts)
+            if cumcounts[-1] == 0:
+                binned_ne[k, 1:] = np.nan
+                continue
+            for j, percentile in enumerate(percentiles):
+                rank = (percentile / 100.) * (cumcounts[-1] - 1)
+                hist_bin = np.searchsorted(cumcounts, rank, side='right')
+                if hist_bin == 0: binned_ne[k, j + 1] = 0.
+                elif hist_bin == len(counts) - 1: binned_ne[k, j + 1] = ne_edges[-1]
+                else:
+                    frac = np.clip((rank - (cumcounts[hist_bin] - counts[hist_bin]) + 0.5) / counts[hist_bin], 0., 1.)
+                    binned_ne[k, j + 1] = 10 ** (log_edges[hist_bin - 1] + frac * (log_edges[hist_bin] - log_edges[hist_bin - 1]))
+        binned_nes.append(binned_ne)
+
+    return binned_nes
+
+###################### Following routines are for the voxel index (see nefns.voxindex) ######################################
+# --------------------------------------------------------------------------------------------------------------
+def load_npz_member(filename, key):
+    '''
+    Function to memory map one array of an uncompressed .npz file (as written by np.savez), so that it can be read a slab at a time instead of all at once
+    Falls back to reading the array in to memory if the member is compressed
+    Returns numpy memmap (or array)
+    '''
+    with zipfile.ZipFile(filename) as zip_file:
+        info = zip_file.getinfo(key + '.npy')
+    if info.compress_type != zipfile.ZIP_STORED:
+        with np.load(filename) as npz: return npz[key]
+
+    with open(filename, 'rb') as file_obj:
+        file_obj.seek(info.header_offset)
+        name_len, extra_len = struct.unpack('<HH', file_obj.read(30)[26:30]) # from the zip local file header
+        file_obj.seek(info.header_offset + 30 + name_len + extra_len)
+        version = np.lib.format.read_magic(file_obj)
+        if version == (1, 0): shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file_obj)
+        else: shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file_obj)
+        offset = file_obj.tell()
+
+    member = np.memmap(filename, dtype=dtype, mode='r', shape=shape, offset=offset, order='F' if fortran_order else 'C')
+
+    return member
+
+# --------------------------------------------------------------------------------------------------------------
+def get_radial_bin_luts(rad_vals, rad_edges):
+    '''
+    Function to map each radius to its radial bin(s) with the same inclusive binning as plotfns.plot_nerad, where a radius lying exactly on an inner edge counts in both neighbouring bins
+    Returns two arrays of bin numbers (-1 where none): the bin each radius is in, and the second bin for radii on an edge
+    '''
+    nbins = len(rad_edges) - 1
+    bin_right = np.searchsorted(rad_edges, rad_vals, side='right') - 1 # rad_edges[k] <= r < rad_edges[k+1]
+    bin_left = np.searchsorted(rad_edges, rad_vals, side='left') - 1 # rad_edges[k] < r <= rad_edges[k+1]
+    lut1 = np.where((bin_right >= 0) & (bin_right < nbins), bin_right, -1)
+    lut2 = np.where((bin_left >= 0) & (bin_left < nbins) & (bin_left != bin_right), bin_left, -1)
+    lut1 = np.where(lut1 < 0, lut2, lut1) # e.g. a radius on the outermost edge
+    lut2 = np.where(lut2 == lut1, -1, lut2)
+
+    return lut1, lut2
+
+# --------------------------------------------------------------------------------------------------------------
+def get_voxel_profiles(file_pairs, inc_ranges, rad_edges, percentiles=(16, 25, 50, 75, 84), slabsize=32, ne_edges=neskedges):
+    '''
+    Function to compute radial ne profiles within given inclination ranges from one or more (FITS cube, voxel index) pairs
+    Every voxel is counted in its radial bin(s) (rad_edges in kpc, both edges inclusive as in plotfns.plot_nerad); voxels of all cubes are stacked together
+    Each slab of each cube is reduced straight in to the fixed size ne sketch (see make_ne_sketch), and the voxel index is memory mapped, so memory does not grow with the number or size of the cubes
+    Returns list of (len(rad_edges)-1, 1 + len(percentiles)) arrays, one per inc_range, with the bin centres in the first column (as in plotfns.plot_nerad)
+    '''
+    nbins = len(rad_edges) - 1
+    sketch = make_ne_sketch(len(inc_ranges), nbins, ne_edges=ne_edges)
+    nhist = sketch.shape[2]
+
+    for fitsfile, idxfile in file_pairs:
+        if not os.path.exists(idxfile):
+            print(f'Voxel index {idxfile} not found, so skipping this cube')
+            continue
+        rcode, inccode = load_npz_member(idxfile, 'rcode'), load_npz_member(idxfile, 'inccode')
+        with np.load(idxfile) as voxidx: rres, dinc = float(voxidx['rres']), float(voxidx['dinc'])
+        rad_lut1, rad_lut2 = get_radial_bin_luts((np.arange(np.iinfo(rcode.dtype).max + 1) + 0.5) * rres, rad_edges) # radial bin(s) of each radius code
+        inc_vals = (np.arange(256) + 0.5) * dinc
+
+        with fits.open(fitsfile, memmap=True) as hdul:
+            necube = hdul[0].data
+            for i0 in range(0, necube.shape[0], slabsize):
+                ne_slab = np.asarray(necube[i0 : i0 + slabsize], dtype=np.float32).ravel()
+                rcode_slab = np.asarray(rcode[i0 : i0 + slabsize]).ravel()
+                inc_slab = inc_vals[np.asarray(inccode[i0 : i0 + slabsize]).ravel()]
+                finite = np.isfinite(ne_slab)
+                ne_bin = np.searchsorted(ne_edges, ne_slab, side='right')
+                for rad_lut in [rad_lut1, rad_lut2]:
+                    rbin_slab = rad_lut[rcode_slab]
+                    valid = finite & (rbin_slab >= 0)
+                    if not np.any(valid): continue
+                    for index, inc_range in enumerate(inc_ranges):
+                        selected = valid & (inc_slab >= inc_range[0]) & (inc_slab <= inc_range[1])
+                        sketch[index] += np.bincount(rbin_slab[selected] * nhist + ne_bin[selected], minlength=nbins * nhist).reshape(nbins, nhist)
+        del rcode, inccode
+
+    binned_nes = get_sketch_binned_nes(sketch, rad_edges, percentiles=percentiles, ne_edges=ne_edges)
+
+    return binned_nes
+
 # --------------------------------------------------------------------------------------------------------------
 def parse_args():
     '''
@@ -557,9 +888,13 @@ def parse_args():
     parser.add_argument('--rangekpc', metavar='rangekpc', type=float, action='store', default=-1, help='Range (extent) in kpc; default is -1, i.e. 100 kpc for massive galaxies and 50 kpc for dwarf galaxies')
     parser.add_argument('--reskpc', metavar='reskpc', type=float, action='store', default=0.5, help='Resolution (cell size) in kpc; default is 0.5')
     parser.add_argument('--resfile_prefix', metavar='resfile_prefix', type=str, action='store', default='all_lsm', help='where to save the resulting data? default is defined later')
+    parser.add_argument('--use_axis_los', dest='use_axis_los', action='store_true', default=False, help='Add the axis aligned LoS DMs (from gethostdm_all.py axisdm mode), where available, to the random LoS? Default is no.')
+    parser.add_argument('--use_atlas', dest='use_atlas', action='store_true', default=False, help='Query the per snapshot DM atlas (from gethostdm_all.py atlas mode), where available, instead of the random LoS? Default is no.')
 
     # ------- args added for radialplot.py ------------------------------
     parser.add_argument('--quant', metavar='quant', type=str, action='store', default='electron', help='which quantity to make radial profile of (choose from electron or gas)? default is electron')
+    parser.add_argument('--use_voxel_index', dest='use_voxel_index', action='store_true', default=False, help='Bin every voxel of the cubes via their voxel index (from gethostdm_all.py voxidx mode) instead of the ray sampled profiles? Default is no.')
+    parser.add_argument('--stream_profiles', dest='stream_profiles', action='store_true', default=False, help='Stack the radial profiles one cube at a time into a fixed memory percentile sketch (merged across MPI ranks), instead of holding all of them in memory? Default is no.')
 
     # ------- args added for plots_for_frb_paper.py ------------------------------
     parser.add_argument('--inc_bin_edges', metavar='inc_bin_edges', type=str, action='store', default='0,90', help='Bin edges of inclination angles; Default is 0-90')
@@ -34,6 +34,7 @@ from craft_utils import *
 setup_plot_style()
 import plotfns as pfns
 from plot_sfms import read_snap_list
+from foggie_craft_utils.catalog_writer import append_to_shard, merge_shards
 
 start_time = datetime.now()
 
@@ -58,6 +59,28 @@ def create_tiled_layout(nrows, ncols, fig_size=4):
             
     return fig, all_axes
 
+# -----------------------------------------------------------------------------
+def read_losdm_df(snap, args):
+    '''
+    Function to read the LoS DMs of a given snapshot (as saved by nefns.losdms) into a dataframe
+    If args.use_axis_los, the axis aligned LoS DMs (nefns.axislosdms) are appended, where available
+    If args.use_atlas, the DM atlas (nefns.dmatlas) is queried within args.inc_range instead, where available and built from the current FITS cube
+    Returns dataframe
+    '''
+    file_prefix = args.los_dir / f'{snap["snap"]}_{snap["halo"]}_FRB_El_number_density_upto{args.rangekpc}kpc_res{args.reskpc}kpc'
+    if use_dm_atlas(file_prefix, args):
+        return read_dm_atlas(Path(f'{file_prefix}_dmatlas.h5'), args.inc_range)
+
+    dm_arr = np.load(f'{file_prefix}_150.npy')
+
+    axisfile = Path(f'{file_prefix}_axis.npy')
+    if args.use_axis_los and axisfile.exists():
+        dm_arr = np.vstack([dm_arr, np.load(axisfile)])
+
+    this_df = pd.DataFrame(dm_arr, columns=['inc', 'impf', 'distmaj', 'losdm'])
+
+    return this_df
+
 # -----------------------------------------------------------------------------
 def execute_mode_indi(df_snap, args):
     '''
@@ -76,9 +99,7 @@ def execute_mode_indi(df_snap, args):
         fig.subplots_adjust(left=0.07, bottom=0.07, right=0.98, top=0.98, wspace=0.01, hspace=0.01)
 
     for i, snap in df_snap.iterrows():
-        thisfile = args.los_dir / f'{snap["snap"]}_{snap["halo"]}_FRB_El_number_density_upto{args.rangekpc}kpc_res{args.reskpc}kpc_150.npy'
-        dm_arr	= np.load(thisfile)
-        this_df = pd.DataFrame(dm_arr, columns=['inc', 'impf', 'distmaj', 'losdm'])
+        this_df = read_losdm_df(snap, args)
         print(f'{snap["snap"]}_{snap["halo"]}: Total number of LoS = {len(this_df)}')
         
         print("Plotting DMs within inclination ",args.inc_range[0], args.inc_range[1])
@@ -110,9 +131,10 @@ def execute_mode_indi(df_snap, args):
         combined_row = {**snap.to_dict(), **fit_dict}
         df_out = pd.DataFrame(combined_row, index=[0])
 
-        df_out.to_csv(param_outfile, mode='a', sep='\t', header=not os.path.exists(param_outfile), index=None)
+        append_to_shard(param_outfile, df_out) # merged in to param_outfile at the end
         if len(df_snap) > 10 and not args.multi_panel: plt.close('all')
 
+    merge_shards(param_outfile, key=['halo', 'snap', 'inc_bin'])
     if args.multi_panel: save_fig(fig, args.fig_dir, f'{args.mode}_inc_{args.inc_range[0]}_{args.inc_range[1]}_multipanel_1d.pdf', args)
 
     return
@@ -135,9 +157,7 @@ def execute_mode_halo(df_snap, args):
         fig.subplots_adjust(left=0.07, bottom=0.07, right=0.98, top=0.98, wspace=0.01, hspace=0.01)
 
     for i, snap in df_snap.iterrows():
-        thisfile = args.los_dir / f'{snap["snap"]}_{snap["halo"]}_FRB_El_number_density_upto{args.rangekpc}kpc_res{args.reskpc}kpc_150.npy'
-        dm_arr	= np.load(thisfile)
-        this_df = pd.DataFrame(dm_arr, columns=['inc', 'impf', 'distmaj', 'losdm'])
+        this_df = read_losdm_df(snap, args)
         this_df['distmin'] = np.sqrt(this_df['impf'] ** 2 - this_df['distmaj'] ** 2)
         this_df = this_df[this_df['inc'].between(args.inc_range[0], args.inc_range[1])]
 
@@ -178,9 +198,7 @@ def execute_mode_lsmzsfr(df_snap, args, given_ax=None):
     combined_df = pd.DataFrame()
     
     for i, snap in df_snap.iterrows():
-        thisfile = args.los_dir / f'{snap["snap"]}_{snap["halo"]}_FRB_El_number_density_upto{args.rangekpc}kpc_res{args.reskpc}kpc_150.npy'
-        dm_arr	= np.load(thisfile)
-        this_df = pd.DataFrame(dm_arr, columns=['inc', 'impf', 'distmaj', 'losdm'])
+        this_df = read_losdm_df(snap, args)
         this_df = this_df[this_df['inc'].between(args.inc_range[0], args.inc_range[1])]
         combined_df = pd.concat([combined_df, this_df], ignore_index=True)
         
@@ -236,9 +254,7 @@ def execute_mode_projection(df_snap, args):
     compiled_rows = [] # to store the fitted parameters later in a separate file
 
     for i, snap in df_snap.iterrows():
-        thisfile = args.los_dir / f'{snap["snap"]}_{snap["halo"]}_FRB_El_number_density_upto{args.rangekpc}kpc_res{args.reskpc}kpc_150.npy'
-        dm_arr	= np.load(thisfile)
-        this_df = pd.DataFrame(dm_arr, columns=['inc', 'impf', 'distmaj', 'losdm'])
+        this_df = read_losdm_df(snap, args)
         this_df['distmin'] = np.sqrt(this_df['impf'] ** 2 - this_df['distmaj'] ** 2)
         this_df = this_df[this_df['inc'].between(args.inc_range[0], args.inc_range[1])]
 
@@ -248,7 +248,6 @@ if __name__ == '__main__':
 
     Path(args.output_dir + 'txtfiles/').mkdir(parents=True, exist_ok=True)
     Path(args.output_dir + 'figs/').mkdir(parents=True, exist_ok=True)
-    if not os.path.exists(outfilename): df_full.to_csv(outfilename, sep='\t', index=None) # writing to file, so that invidual processors can read in and append
 
     # -------- reading in SFR info-------
     sfr_filename = args.code_path + 'halo_infos/00' + args.halo + '/' + args.run + '/sfr'
@@ -283,23 +282,13 @@ if __name__ == '__main__':
     print_master('Total number of MPI ranks = ' + str(ncores) + '. Starting at: {:%Y-%m-%d %H:%M:%S}'.format(datetime.now()), args)
     comm.Barrier() # wait till all cores reached here and then resume
 
-    split_at_cpu = total_snaps - ncores * int(total_snaps/ncores)
-    nper_cpu1 = int(total_snaps / ncores)
-    nper_cpu2 = nper_cpu1 + 1
-    if rank < split_at_cpu:
-        core_start = rank * nper_cpu2
-        core_end = (rank+1) * nper_cpu2 - 1
-    else:
-        core_start = split_at_cpu * nper_cpu2 + (rank - split_at_cpu) * nper_cpu1
-        core_end = split_at_cpu * nper_cpu2 + (rank - split_at_cpu + 1) * nper_cpu1 - 1
-
     # -------------loop over snapshots-----------------
-    print_mpi('Operating on snapshots ' + str(core_start + 1) + ' to ' + str(core_end + 1) + ', i.e., ' + str(core_end - core_start + 1) + ' out of ' + str(total_snaps) + ' snapshots', args)
+    print_master('Handing out ' + str(total_snaps) + ' snapshots dynamically across MPI ranks, most expensive first', args)
 
-    for index in range(core_start + args.start_index, core_end + 1):
+    for index in mpi_snapshot_loop(list_of_sims, start_index=args.start_index):
         start_time_this_snapshot = time.time()
         this_sim = list_of_sims[index]
-        print_mpi('Doing snapshot ' + this_sim[1] + ' of halo ' + this_sim[0] + ' which is ' + str(index + 1 - core_start) + ' out of the total ' + str(core_end - core_start + 1) + ' snapshots...', args)
+        print_mpi('Doing snapshot ' + this_sim[1] + ' of halo ' + this_sim[0] + ' which is ' + str(index + 1) + ' out of the total ' + str(total_snaps) + ' snapshots...', args)
 
         # -------loading in snapshot-------------------
         halos_df_name = args.code_path + 'halo_infos/00' + this_sim[0] + '/' + args.run + '/'
@@ -371,7 +360,7 @@ if __name__ == '__main__':
                 # ------update full dataframe and read it from file-----------
                 df_full_row = np.hstack(([args.output, args.current_redshift, args.current_time, sfr, log_mstar], np.hstack([[item.n, item.s] for item in fit_result])))
                 temp_df = pd.DataFrame(dict(zip(columns, df_full_row)), index=[0])
-                temp_df.to_csv(outfilename, mode='a', sep='\t', header=False, index=None)
+                append_to_shard(outfilename, temp_df, rank=rank) # each rank writes to its own shard; merged at the end
 
                 # ------saving fig------------------
                 fig.savefig(figname)
@@ -388,10 +377,8 @@ if __name__ == '__main__':
             print('Skipping snapshot %s as %s already exists. Use --clobber_plot to remake figure.' %(args.output, figname))
             continue
 
-    # -------reading the full dataframe-----------------------
-    df_full = pd.read_table(outfilename, delim_whitespace=True)
-    df_full = df_full.drop_duplicates(subset='output', keep='last')
-    df_full = df_full.sort_values(by='time')
+    # -------merging the shards of all ranks in to the full dataframe-----------------------
+    df_full = merge_shards(outfilename, key='output', sort_by='time', comm=comm)
 
     # -------making animation of all snapshots-----------------------
     if args.do_all_sims: make_movie(args.fig_dir + outfile_rootname, reverse=True, fps=5)
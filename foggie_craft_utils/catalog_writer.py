@@ -0,0 +1,105 @@
+##!/usr/bin/env python3
+
+"""
+
+    Title :      catalog_writer
+    Notes :      Race-free writing of one output catalog (text table) by many MPI ranks: each rank appends its rows to its own binary shard next to the catalog,
+                 and a final collective merge folds all shards (and the existing catalog, if any) in to one deduplicated, typed table, written atomically by rank 0
+                 Shards left over from a crashed run are picked up by the next merge; only one job should write to a given catalog at a time
+    Author :     Ayan Acharyya
+    Started :    Jan 2026
+    Usage :      for index in mpi_snapshot_loop(list_of_sims):
+                     ...
+                     append_to_shard(outfilename, this_df, rank=comm.rank)
+                 df = merge_shards(outfilename, key='output', comm=comm) # must be called by all ranks
+
+"""
+import os
+import glob
+import pandas as pd
+import pickle as pkl
+
+# -----------------------------------------------------------------------------
+def get_shard_name(filename, rank=0):
+    '''
+    Function to get the filename of the shard of a given catalog belonging to a given rank; it is a hidden file next to the catalog
+    Returns filename
+    '''
+    shard_name = os.path.join(os.path.dirname(filename), '.' + os.path.basename(filename) + '.shard%04d.pkl' % rank)
+
+    return shard_name
+
+# -----------------------------------------------------------------------------
+def append_to_shard(filename, df, rank=0):
+    '''
+    Function to append a dataframe (typically one row) to this rank's shard of a given catalog, as one pickled record
+    Only this rank ever writes to its shard, so no locking is needed
+    Returns nothing
+    '''
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    with open(get_shard_name(filename, rank=rank), 'ab') as file:
+        pkl.dump(df, file)
+        file.flush()
+        os.fsync(file.fileno())
+
+    return
+
+# -----------------------------------------------------------------------------
+def read_shard(shard_name):
+    '''
+    Function to read all the complete records of a given shard (a record cut short by a crash is ignored)
+    Returns list of dataframes
+    '''
+    frames = []
+    with open(shard_name, 'rb') as file:
+        while True:
+            try: frames.append(pkl.load(file))
+            except (EOFError, pkl.UnpicklingError): break
+
+    return frames
+
+# -----------------------------------------------------------------------------
+def get_typed_df(df):
+    '''
+    Function to convert the columns that hold only numbers (but were read in or built as strings) to numeric dtypes
+    Returns pandas dataframe
+    '''
+    for col in df.columns:
+        if df[col].dtype == object:
+            converted = pd.to_numeric(df[col], errors='coerce')
+            if converted.notna().sum() == df[col].notna().sum(): df[col] = converted
+
+    return df
+
+# -----------------------------------------------------------------------------
+def merge_shards(filename, key=None, sep='\t', sort_by=None, comm=None):
+    '''
+    Function to merge all shards of a given catalog, along with the existing catalog (if any), in to the catalog, with duplicates (on the key column(s), or on all columns if key is None) dropped, keeping the latest row
+    If comm is given, this is collective: all ranks wait for each other, rank 0 does the merge, and the merged table is broadcast to every rank; otherwise this process does the merge
+    Returns merged pandas dataframe
+    '''
+    if comm is not None: comm.Barrier() # wait till all ranks have finished writing their shards
+
+    df = None
+    if comm is None or comm.rank == 0:
+        shard_names = sorted(glob.glob(glob.escape(get_shard_name(filename, rank=0)[:-len('0000.pkl')]) + '*.pkl')) # shards of all ranks, including any left over from earlier runs
+        frames = [pd.read_csv(filename, sep=sep, comment='#')] if os.path.exists(filename) else []
+        for shard_name in shard_names: frames.extend(read_shard(shard_name))
+        frames = [frame for frame in frames if len(frame) > 0]
+
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 0 else pd.DataFrame()
+        df = get_typed_df(df)
+        if len(df) > 0:
+            df = df.drop_duplicates(subset=key, keep='last')
+            if sort_by is not None: df = df.sort_values(by=sort_by)
+            df = df.reset_index(drop=True)
+
+        if len(shard_names) > 0:
+            df.to_csv(filename + '.tmp%d' % os.getpid(), sep=sep, index=None)
+            os.replace(filename + '.tmp%d' % os.getpid(), filename) # atomic, so that a reader never sees a partial catalog
+            for shard_name in shard_names: os.remove(shard_name)
+            print(f'Merged {len(shard_names)} shards in to {filename}, which now has {len(df)} rows')
+
+    if comm is not None: df = comm.bcast(df, root=0)
+
+    return df
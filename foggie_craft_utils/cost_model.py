@@ -0,0 +1,158 @@
+##!/usr/bin/env python3
+
+"""
+
+    Title :      cost_model
+    Notes :      Ledger of per-snapshot runtimes (and the input sizes they depend on), plus a simple predictor fitted to it,
+                 used for cost-ordered dispatch by mpi_scheduler and for sizing walltime/core requests in submit_jobs.py
+    Author :     Ayan Acharyya
+    Started :    Jan 2026
+    Usage :      record_cost('make_3D_FRB_electron_density', args.halo, args.output, seconds, ncells_sim=..., redshift=..., cube_ncells=...)
+                 for index in mpi_snapshot_loop(list_of_sims, cost_func=get_cost_func('make_3D_FRB_electron_density')): ...
+                 nhours, nranks = estimate_job_resources('make_3D_FRB_electron_density', '8508', ['RD0027', 'RD0042'], max_hours=72)
+
+"""
+import os
+import socket
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from datetime import datetime
+
+default_ledger = str(Path(__file__).resolve().parent.parent / 'cost_ledger.csv') # machine specific, so kept out of version control via .gitignore
+ledger_cols = ['script', 'stage', 'halo', 'output', 'seconds', 'ncells_sim', 'redshift', 'cube_ncells', 'nfixpts', 'ncores', 'host', 'timestamp']
+feature_cols = ['ncells_sim', 'redshift', 'cube_ncells', 'nfixpts']
+log_features = ['ncells_sim', 'cube_ncells', 'nfixpts'] # these enter the fit as log10, redshift as (1 + z)
+
+# -----------------------------------------------------------------------------
+def record_cost(script, halo, output, seconds, stage='total', ledger=default_ledger, ncores=1, **features):
+    '''
+    Function to append the runtime of one stage of one snapshot, along with its input sizes (any of ncells_sim, redshift, cube_ncells, nfixpts), to the cost ledger
+    Each record is written as a single appended line, and the ledger has no header line (the columns are ledger_cols), so that several MPI ranks can record in to the same ledger
+    without racing to write a header
+    Returns nothing
+    '''
+    values = {'script': script, 'stage': stage, 'halo': halo, 'output': output, 'seconds': '%.2f' % seconds, 'ncores': ncores, 'host': socket.gethostname(), 'timestamp': '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now())}
+    for col in feature_cols: values[col] = '%.6g' % features[col] if features.get(col) is not None else ''
+    line = ','.join([str(values[col]) for col in ledger_cols]) + '\n'
+
+    with open(ledger, 'a') as file: file.write(line)
+
+    return
+
+# -----------------------------------------------------------------------------
+def read_cost_ledger(script=None, stage='total', ledger=default_ledger):
+    '''
+    Function to read in the cost ledger, optionally only the rows of a given script and stage
+    Returns pandas dataframe (empty, if there is no ledger yet)
+    '''
+    if not os.path.exists(ledger): return pd.DataFrame(columns=ledger_cols)
+
+    df = pd.read_csv(ledger, names=ledger_cols, header=None, dtype=str)
+    df = df[df['script'] != 'script'] # header lines, as written by earlier versions
+    for col in ['seconds', 'ncores'] + feature_cols: df[col] = pd.to_numeric(df[col], errors='coerce')
+    if script is not None: df = df[df['script'] == script]
+    if stage is not None: df = df[df['stage'] == stage]
+
+    return df.reset_index(drop=True)
+
+# -----------------------------------------------------------------------------
+def get_design_matrix(df, features):
+    '''
+    Function to make the design matrix for the cost fit, from the given feature columns of the dataframe
+    Returns 2D numpy array, with a leading column of ones
+    '''
+    columns = [np.ones(len(df))]
+    for col in features:
+        values = df[col].to_numpy(dtype=float)
+        columns.append(np.log10(values) if col in log_features else np.log10(1 + values))
+
+    return np.column_stack(columns)
+
+# -----------------------------------------------------------------------------
+def fit_cost_model(script, stage='total', ledger=default_ledger):
+    '''
+    Function to fit log10(seconds) as a linear function of the logged input sizes, by least squares, to the ledger entries of a given script and stage
+    Only the features that were recorded for every entry are used, and the fit falls back to the median runtime if there are too few entries
+    Returns dict with the features, coefficients, rms scatter (dex) and number of entries, or None if the ledger has no entries
+    '''
+    df = read_cost_ledger(script=script, stage=stage, ledger=ledger)
+    df = df[df['seconds'] > 0]
+    if len(df) == 0: return None
+
+    features = [col for col in feature_cols if df[col].notna().all() and df[col].nunique() > 1 and (col not in log_features or (df[col] > 0).all())]
+    if len(df) < len(features) + 2: features = [] # not enough entries to constrain the slopes
+
+    X = get_design_matrix(df, features)
+    y = np.log10(df['seconds'].to_numpy(dtype=float))
+    coeffs = np.linalg.lstsq(X, y, rcond=None)[0]
+    scatter = np.sqrt(np.mean((y - X @ coeffs) ** 2))
+    means = {col: df[col].astype(float).mean() for col in features}
+
+    return {'features': features, 'coeffs': coeffs, 'scatter': scatter, 'nentries': len(df), 'means': means}
+
+# -----------------------------------------------------------------------------
+def predict_cost(model, **features):
+    '''
+    Function to predict the runtime for the given input sizes, from a model made by fit_cost_model(); features that are not given are set to their mean in the ledger
+    Returns predicted seconds (nan if there is no model)
+    '''
+    if model is None: return np.nan
+    df = pd.DataFrame([{col: features[col] if features.get(col) is not None else model['means'][col] for col in model['features']}])
+    seconds = 10 ** (get_design_matrix(df, model['features']) @ model['coeffs'])[0]
+
+    return seconds
+
+# -----------------------------------------------------------------------------
+def get_cost_func(script, stage='total', ledger=default_ledger, key_func=None):
+    '''
+    Function to make the cost_func for mpi_snapshot_loop(), from the ledger
+    Snapshots that have been timed before get their (latest) measured runtime; others get the model prediction from whatever input sizes are known for them in the ledger (from any script)
+    Falls back to the default cost guess of mpi_scheduler if the ledger has nothing for this script
+    key_func maps an item of the list of snapshots to (halo, output); default handles (halo, output) tuples
+    Returns function
+    '''
+    from foggie_craft_utils.mpi_scheduler import get_snapshot_cost
+
+    if key_func is None: key_func = lambda item: (str(item[0]), str(item[1]))
+    model = fit_cost_model(script, stage=stage, ledger=ledger)
+    if model is None: return get_snapshot_cost
+
+    df_all = read_cost_ledger(stage=None, ledger=ledger)
+    measured = df_all[(df_all['script'] == script) & (df_all['stage'] == stage)].groupby(['halo', 'output'])['seconds'].last().to_dict()
+    known_features = df_all.groupby(['halo', 'output'])[feature_cols].last().to_dict(orient='index')
+
+    def cost_func(item):
+        key = key_func(item)
+        if key in measured: return measured[key]
+        features = {col: value for col, value in known_features.get(key, {}).items() if pd.notna(value)}
+        return predict_cost(model, **features)
+
+    return cost_func
+
+# -----------------------------------------------------------------------------
+def estimate_job_resources(script, halo, outputs=None, nranks=None, max_hours=120, stage='total', ledger=default_ledger, safety=1.5):
+    '''
+    Function to estimate the walltime and number of MPI ranks needed for running a given script on a set of snapshots of a halo
+    outputs = None means all outputs of this halo that are in the ledger; with the dynamic scheduler one rank only dispatches, so nranks - 1 ranks do the work
+    If nranks is None, the smallest number of ranks that fits within max_hours is chosen
+    Returns (walltime in hours, number of ranks), or (None, nranks) if the ledger cannot tell
+    '''
+    if fit_cost_model(script, stage=stage, ledger=ledger) is None: return None, nranks
+    if outputs is None: outputs = read_cost_ledger(stage=None, ledger=ledger).query('halo == @halo')['output'].unique()
+    if len(outputs) == 0: return None, nranks
+
+    cost_func = get_cost_func(script, stage=stage, ledger=ledger)
+
+    costs = np.sort(np.array([cost_func((halo, output)) for output in outputs]))[::-1] * safety # seconds
+    if nranks is None:
+        nworkers = int(np.clip(np.ceil(costs.sum() / (max_hours * 3600)), 1, len(costs)))
+        nranks = nworkers + 1 if nworkers > 1 else 1
+    nworkers = max(nranks - 1, 1)
+
+    # -------simulating largest-cost-first dispatch, to get the makespan---------
+    busy_until = np.zeros(nworkers)
+    for cost in costs: busy_until[np.argmin(busy_until)] += cost
+    nhours = int(np.ceil(busy_until.max() / 3600))
+
+    return min(max(nhours, 1), max_hours), nranks
@@ -10,6 +10,8 @@ from foggie_craft_utils.get_proper_box_size import get_proper_box_size
 from foggie_craft_utils.get_run_loc_etc import get_run_loc_etc
 from foggie_craft_utils.yt_fields import *
 from foggie_craft_utils.foggie_utils import filter_particles
+from foggie_craft_utils.halo_catalog import get_catalog_row, read_root_indices
+from foggie_craft_utils.mass_profiles import read_snapshot_mass_rows
 import foggie_craft_utils.get_refine_box as grb
 
 def load_sim(args, **kwargs):
@@ -49,15 +51,10 @@ def get_center_from_catalog(ds, halo_c_v_name, snap, center_style='catalog'):
     """This function is a helper function to get the halo center from the halo_c_v catalog file.
     It is used in foggie_load() to determine the halo center."""
     print('Using halo_c_v catalog file: ', halo_c_v_name, ' for center style ', center_style)
-    halo_c_v = Table.read(halo_c_v_name, format='ascii', header_start=0, delimiter='|')
+    row = get_catalog_row(halo_c_v_name, snap)
     print("Pulling halo center from catalog file") 
-    halo_ind = np.where(halo_c_v['name']==snap[-6:])[0][0]
-    halo_center_kpc = ds.arr([float(halo_c_v[halo_ind]['x_c']), \
-                              float(halo_c_v[halo_ind]['y_c']), \
-                              float(halo_c_v[halo_ind]['z_c'])], 'kpc')
-    halo_velocity_kms = ds.arr([float(halo_c_v[halo_ind]['v_x']), \
-                                float(halo_c_v[halo_ind]['v_y']), \
-                                float(halo_c_v[halo_ind]['v_z'])], 'km/s')
+    halo_center_kpc = ds.arr([row['xc'], row['yc'], row['zc']], 'kpc')
+    halo_velocity_kms = ds.arr([row['xv'], row['yv'], row['zv']], 'km/s')
     ds.halo_center_kpc = halo_center_kpc
     ds.halo_center_code = halo_center_kpc.in_units('code_length')
     ds.halo_velocity_kms = halo_velocity_kms
@@ -69,12 +66,9 @@ def get_center_from_smoothed_catalog(ds, halo_c_v_name, snap, center_style='smoo
     """This function is a helper function to get the halo center from the smoothed halo_c_v catalog file.
     It is used in foggie_load() to determine the halo center."""
     print('Using smoothed halo_c_v catalog file: ', halo_c_v_name, ' for center style ', center_style)
-    halo_c_v = Table.read(halo_c_v_name, format='ascii', header_start=0, delimiter='|')
-    if (snap[-6:] in halo_c_v['snap']):
-        halo_ind = np.where(halo_c_v['snap']==snap[-6:])[0][0]
-        halo_center_kpc = ds.arr([float(halo_c_v[halo_ind]['xc']), \
-                                  float(halo_c_v[halo_ind]['yc']), \
-                                  float(halo_c_v[halo_ind]['zc'])], 'kpc')
+    row = get_catalog_row(halo_c_v_name, snap)
+    if row is not None:
+        halo_center_kpc = ds.arr([row['xc'], row['yc'], row['zc']], 'kpc')
         ds.halo_center_kpc = halo_center_kpc
         ds.halo_center_code = halo_center_kpc.in_units('code_length')
         sp = ds.sphere(ds.halo_center_kpc, (3., 'kpc'))
@@ -83,29 +77,36 @@ def get_center_from_smoothed_catalog(ds, halo_c_v_name, snap, center_style='smoo
     
     return ds
 
-def get_center_from_root_catalog(ds, halo_c_v_name, proper_box_size, center_style = 'root_index'):
+root_center_prior = {} # root catalog filename -> halo center (code units) found for the previous snapshot in this process, used as the spatial prior for the next one
+
+def get_center_from_root_catalog(ds, halo_c_v_name, proper_box_size, center_style = 'root_index', center_guess=None, search_radius_code=None, min_root_fraction=0.99):
 
     """This function is a helper function to get the halo center from the root catalog file.
-    It is used in foggie_load() to determine the halo center."""
+    It is used in foggie_load() to determine the halo center.
+    Only the particles within search_radius_code of a prior center are read: the center found for the previous snapshot (in this process), else center_guess (e.g. the track center);
+    the center from that region is used only if at least min_root_fraction of the root particles turn up there (else the halo may extend beyond it), otherwise all particles are read instead.
+    Root particles are matched by a sorted-index lookup against the (cached) sorted root indices."""
     print('Using root catalog file: ', halo_c_v_name, ' for center style ', center_style)
-    root_particles = Table.read(halo_c_v_name, format='ascii', header_start=0, delimiter='|')
-    halo0 = root_particles['root_index']
-
-    ad = ds.all_data() 
-        
-    x_particles = ad['particle_position_x']
-    y_particles = ad['particle_position_y']
-    z_particles = ad['particle_position_z']
-        
-    root_indices = halo0
-    now_indices = ad['particle_index']
-    indices = np.where(np.isin(now_indices, root_indices))[0]
-        
-    center_x  = float(np.mean(x_particles[indices].in_units('code_length'))) 
-    center_y  = float(np.mean(y_particles[indices].in_units('code_length'))) 
-    center_z  = float(np.mean(z_particles[indices].in_units('code_length'))) 
-        
-    halo_center = [center_x, center_y, center_z]
+    root_indices = read_root_indices(halo_c_v_name)
+
+    prior = root_center_prior.get(os.path.abspath(halo_c_v_name), center_guess)
+    regions = [ds.sphere(ds.arr(prior, 'code_length'), ds.quan(search_radius_code, 'code_length')), ds.all_data()] if prior is not None and search_radius_code is not None else [ds.all_data()]
+
+    halo_center = None
+    for region in regions:
+        now_indices = region['particle_index'].v.astype(np.int64)
+        positions = np.searchsorted(root_indices, now_indices)
+        is_root = root_indices[np.clip(positions, 0, len(root_indices) - 1)] == now_indices
+        if region is not regions[-1] and is_root.sum() < min_root_fraction * len(root_indices): continue # the region does not cover (nearly) all root particles, so try the next (bigger) one
+        if not is_root.any(): continue
+
+        halo_center = [float(np.mean(region[f'particle_position_{axis}'][is_root].in_units('code_length'))) for axis in ['x', 'y', 'z']]
+        break
+
+    if halo_center is None: # none of the root particles are in this snapshot
+        print('No root particles found, calculating halo center from track')
+        return get_center_from_calculated(ds, center_guess, proper_box_size)
+    root_center_prior[os.path.abspath(halo_c_v_name)] = halo_center
         
     halo_center_kpc = ds.arr(np.array(halo_center)*proper_box_size, 'kpc')
     sp = ds.sphere(halo_center_kpc, (3., 'kpc'))
@@ -169,23 +170,21 @@ def foggie_load(snap, **kwargs):
         print('Will look for halo_c_v_file: ', halo_c_v_name)
         if os.path.exists(halo_c_v_name):
             print('Found halo_c_v file:', halo_c_v_name)
-            halo_c_v = Table.read(halo_c_v_name, format='ascii', header_start=0, delimiter='|')
-            snap_id = snap[-6:]
             if 'smooth' in halo_c_v_name:
                 center_style = 'smoothed'
-                if snap_id in halo_c_v['snap']:
+                if get_catalog_row(halo_c_v_name, snap) is not None:
                     get_center_from_smoothed_catalog(ds, halo_c_v_name, snap, center_style=center_style)
                 else:
                     get_center_from_calculated(ds, refine_box_center, proper_box_size)
             elif 'halo_c_v' in halo_c_v_name:
                 center_style = 'catalog'
-                if snap_id in halo_c_v['name']:
+                if get_catalog_row(halo_c_v_name, snap) is not None:
                     get_center_from_catalog(ds, halo_c_v_name, snap, center_style=center_style)
                 else:
                     get_center_from_calculated(ds, refine_box_center, proper_box_size)
             elif 'root' in halo_c_v_name:
                 center_style = 'root_index'
-                get_center_from_root_catalog(ds, halo_c_v_name, proper_box_size, center_style=center_style)
+                get_center_from_root_catalog(ds, halo_c_v_name, proper_box_size, center_style=center_style, center_guess=refine_box_center, search_radius_code=refine_width_code)
             else:
                 get_center_from_calculated(ds, refine_box_center, proper_box_size)
         else:
@@ -384,11 +383,10 @@ def foggie_load(snap, **kwargs):
     if (gravity):
         # Interpolate enclosed mass function to get tff
         if (zsnap > 2.):
-            masses = Table.read(masses_dir + 'masses_z-gtr-2.hdf5', path='all_data')
+            masses = read_snapshot_mass_rows(masses_dir + 'masses_z-gtr-2.hdf5', snap[-6:])
         else:
-            masses = Table.read(masses_dir + 'masses_z-less-2.hdf5', path='all_data')
-        snap_ind = masses['snapshot']==snap[-6:]
-        ds.Menc_profile = IUS(np.concatenate(([0],masses['radius'][snap_ind])), np.concatenate(([0],masses['total_mass'][snap_ind])))
+            masses = read_snapshot_mass_rows(masses_dir + 'masses_z-less-2.hdf5', snap[-6:])
+        ds.Menc_profile = IUS(np.concatenate(([0],masses['radius'])), np.concatenate(([0],masses['total_mass'])))
         ds.add_field(('gas', 'tff'), function=t_ff, units='yr', display_name='Free fall time', take_log=True, \
                     force_override=True, sampling_type='cell')
         ds.add_field(('gas', 'vff'), function=v_ff, units='km/s', display_name='Free fall velocity', take_log=False, \
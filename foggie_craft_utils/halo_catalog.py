@@ -0,0 +1,91 @@
+##!/usr/bin/env python3
+
+"""
+
+    Title :      halo_catalog
+    Notes :      Reads the pipe-delimited halo_c_v / halo_cen_smoothed catalogs once per process (and optionally from a binary sidecar, via parse_cache) in to a dict keyed by snapshot name,
+                 with the column names normalised across the two variants: name/snap -> name, x_c/xc -> xc, .., v_x/xv -> xv, ..
+                 Also reads the root_index catalogs (used for root particle centring) once, in to a sorted array of particle indices
+    Author :     Ayan Acharyya
+    Started :    Jan 2026
+    Usage :      row = get_catalog_row(halo_c_v_name, 'RD0042')
+                 halo_center = [row['xc'], row['yc'], row['zc']] # kpc
+
+"""
+import os
+import numpy as np
+from foggie_craft_utils.parse_cache import get_cached_parse
+
+column_aliases = {'snap': 'name', 'x_c': 'xc', 'y_c': 'yc', 'z_c': 'zc', 'v_x': 'xv', 'v_y': 'yv', 'v_z': 'zv'}
+
+# -----------------------------------------------------------------------------
+def parse_halo_catalog(filename):
+    '''
+    Function to parse a pipe-delimited halo catalog file, with normalised column names
+    Returns dict of rows (each a dict of column: value, with values converted to float wherever possible), keyed by snapshot name
+    '''
+    catalog, columns = {}, None
+    with open(filename, 'r') as file:
+        for line in file:
+            if line.strip() == '' or line.lstrip()[0] == '#': continue
+            items = [item.strip() for item in line.strip().strip('|').split('|')]
+            if columns is None:
+                columns = [column_aliases.get(item, item) for item in items]
+                continue
+            row = {}
+            for col, item in zip(columns, items):
+                try: row[col] = float(item)
+                except ValueError: row[col] = item
+            if 'name' in row: catalog[str(row['name'])] = row
+
+    return catalog
+
+# -----------------------------------------------------------------------------
+def read_halo_catalog(filename, persist=True):
+    '''
+    Function to read a halo catalog, parsing the text file only if it has changed since it was last parsed in this process (or saved in the sidecar)
+    If persist is True, the parsed catalog is also saved as a pickled sidecar next to the catalog (if the directory is writable), for other processes to use
+    Returns dict of rows keyed by snapshot name
+    '''
+    catalog = get_cached_parse(filename, parse_halo_catalog, '.pkl', persist=persist)
+
+    return catalog
+
+# -----------------------------------------------------------------------------
+def get_catalog_row(filename, snap):
+    '''
+    Function to look up a given snapshot (only the last 6 characters of snap are used, e.g. RD0042) in a halo catalog
+    Returns dict of normalised column: value, or None if the catalog or the snapshot is not there
+    '''
+    if not os.path.exists(filename): return None
+    row = read_halo_catalog(filename).get(str(snap)[-6:])
+
+    return row
+
+# -----------------------------------------------------------------------------
+def parse_root_indices(filename):
+    '''
+    Function to parse the root_index column of a pipe-delimited root particle catalog
+    Returns sorted numpy array of unique root particle indices
+    '''
+    values, col = [], None
+    with open(filename, 'r') as file:
+        for line in file:
+            if line.strip() == '' or line.lstrip()[0] == '#': continue
+            items = [item.strip() for item in line.strip().strip('|').split('|')]
+            if col is None: col = items.index('root_index')
+            else: values.append(int(items[col]) if items[col].isdigit() else int(float(items[col])))
+    root_indices = np.unique(np.array(values, dtype=np.int64)) # np.unique also sorts
+
+    return root_indices
+
+# -----------------------------------------------------------------------------
+def read_root_indices(filename, persist=True):
+    '''
+    Function to read the root indices of a root particle catalog, parsing the text file only if it has changed since it was last read in this process (or saved in the sidecar)
+    If persist is True, the indices are also saved as a pickled sidecar next to the catalog (if the directory is writable)
+    Returns sorted numpy array of unique root particle indices
+    '''
+    root_indices = get_cached_parse(filename, parse_root_indices, '.root_index.pkl', persist=persist)
+
+    return root_indices
@@ -0,0 +1,105 @@
+##!/usr/bin/env python3
+
+"""
+
+    Title :      mass_profiles
+    Notes :      Indexed access to the multi-snapshot enclosed mass files (halo_infos/00<halo>/<run>/masses_z-less-2.hdf5 and masses_z-gtr-2.hdf5):
+                 each file is scanned once for the row range of every snapshot (kept per process, and in a sidecar next to the file),
+                 so that looking up one snapshot reads only its rows
+    Author :     Ayan Acharyya
+    Started :    Jan 2026
+    Usage :      thisdata = get_snapshot_mass_profile(args) # dataframe of the mass profile of args.output, or None
+
+"""
+import os
+import h5py
+import numpy as np
+import pandas as pd
+from foggie_craft_utils.parse_cache import get_cached_parse
+
+mass_files = ['masses_z-less-2.hdf5', 'masses_z-gtr-2.hdf5'] # in the order in which they are looked up
+
+# -----------------------------------------------------------------------------
+def is_astropy_mass_file(filename):
+    '''
+    Function to check whether a mass file was written by astropy (a single compound dataset at all_data) or by pandas (a group at all_data)
+    Returns boolean
+    '''
+    with h5py.File(filename, 'r') as hf: is_astropy = isinstance(hf['all_data'], h5py.Dataset)
+
+    return is_astropy
+
+# -----------------------------------------------------------------------------
+def read_mass_rows(filename, start=None, stop=None):
+    '''
+    Function to read a range of rows (default all) of a mass file, whichever of astropy or pandas wrote it
+    Returns pandas dataframe
+    '''
+    if is_astropy_mass_file(filename):
+        with h5py.File(filename, 'r') as hf: rows = hf['all_data'][start:stop]
+        df = pd.DataFrame({col: rows[col] for col in rows.dtype.names})
+        for col in df.columns:
+            if df[col].dtype == object: df[col] = df[col].str.decode('utf-8')
+    else:
+        df = pd.read_hdf(filename, key='all_data', start=start, stop=stop)
+
+    return df
+
+# -----------------------------------------------------------------------------
+def index_mass_file(filename):
+    '''
+    Function to scan a mass file for the row range of every snapshot
+    Returns dict of snapshot: (start, stop), with None for a snapshot that is split in more than one block of rows
+    '''
+    print('Indexing mass file', filename)
+    snapshots = read_mass_rows(filename)['snapshot'].astype(str).str.strip().to_numpy()
+    boundaries = np.concatenate([[0], np.where(snapshots[1:] != snapshots[:-1])[0] + 1, [len(snapshots)]])
+    index = {}
+    for start, stop in zip(boundaries[:-1], boundaries[1:]):
+        if snapshots[start] in index: index[snapshots[start]] = None # this snapshot is split in more than one block of rows, so will have to be looked up by value
+        else: index[snapshots[start]] = (int(start), int(stop))
+
+    return index
+
+# -----------------------------------------------------------------------------
+def get_mass_file_index(filename, persist=True):
+    '''
+    Function to get the row range of every snapshot in a mass file, scanning the file only if it has changed since it was last indexed in this process (or saved in the sidecar)
+    If persist is True, the index is also saved as a pickled sidecar next to the file (if the directory is writable)
+    Returns dict of snapshot: (start, stop)
+    '''
+    index = get_cached_parse(filename, index_mass_file, '.index.pkl', persist=persist)
+
+    return index
+
+# -----------------------------------------------------------------------------
+def read_snapshot_mass_rows(mass_filename, output):
+    '''
+    Function to read only the rows of a given snapshot from a given mass file
+    Returns pandas dataframe, or None if the file does not have the snapshot
+    '''
+    if not os.path.exists(mass_filename): return None
+    index = get_mass_file_index(mass_filename)
+    if output not in index: return None
+
+    if index[output] is None:
+        alldata = read_mass_rows(mass_filename)
+        thisdata = alldata[alldata['snapshot'].astype(str).str.strip() == output]
+    else:
+        thisdata = read_mass_rows(mass_filename, start=index[output][0], stop=index[output][1])
+
+    return thisdata.reset_index(drop=True)
+
+# -----------------------------------------------------------------------------
+def get_snapshot_mass_profile(args, output=None):
+    '''
+    Function to get the enclosed mass profile of a given snapshot (args.output, unless output is given) of args.halo, from whichever of the mass files has it
+    Only the rows of that snapshot are read from disk
+    Returns pandas dataframe, or None if neither file has the snapshot
+    '''
+    if output is None: output = args.output
+    for mass_file in mass_files:
+        thisdata = read_snapshot_mass_rows(args.code_path + 'halo_infos/00' + args.halo + '/' + args.run + '/' + mass_file, output)
+        if thisdata is not None: return thisdata
+
+    return None
@@ -0,0 +1,98 @@
+##!/usr/bin/env python3
+
+"""
+
+    Title :      mpi_scheduler
+    Notes :      Dynamic master-worker scheduling of snapshots over MPI ranks, shared by all the scripts that loop over snapshots
+    Author :     Ayan Acharyya
+    Started :    Jan 2026
+    Usage :      for index in mpi_snapshot_loop(list_of_sims, start_index=args.start_index):
+                     this_sim = list_of_sims[index]
+                     ...
+
+"""
+import re
+import time
+import numpy as np
+from collections import deque
+from mpi4py import MPI
+
+TAG_READY, TAG_WORK = 11, 12
+
+# -----------------------------------------------------------------------------
+def get_snapshot_cost(item):
+    '''
+    Function to guess the relative cost of one snapshot, given the item in the list of snapshots (a (halo, output) tuple, or a filename containing the output name)
+    Uses the output number as the proxy, since later (lower redshift) outputs have more refined structure and take longer
+    Returns the cost as a float (0 if no output name could be found)
+    '''
+    matches = re.findall(r'(?:RD|DD)(\d{4})', str(item))
+    cost = float(matches[-1]) if len(matches) > 0 else 0.
+
+    return cost
+
+# -----------------------------------------------------------------------------
+def get_snapshot_order(list_of_sims, start_index=0, cost_func=None):
+    '''
+    Function to order the snapshots (from start_index onwards) by decreasing estimated cost, so that the most expensive ones are handed out first
+    cost_func takes an item of list_of_sims and returns its estimated cost; default is get_snapshot_cost()
+    Returns list of indices in to list_of_sims
+    '''
+    if cost_func is None: cost_func = get_snapshot_cost
+    indices = np.arange(start_index, len(list_of_sims))
+    costs = np.array([cost_func(list_of_sims[index]) for index in indices], dtype=float)
+    order = indices[np.argsort(-costs, kind='stable')] # stable, so that snapshots of equal cost stay in their original order
+
+    return [int(index) for index in order]
+
+# -----------------------------------------------------------------------------
+def mpi_snapshot_loop(list_of_sims, start_index=0, cost_func=None, on_complete=None):
+    '''
+    Generator to loop over the snapshots in list_of_sims, handing them out dynamically across MPI ranks
+    With more than one rank, rank 0 only dispatches: each worker asks it for the next snapshot as soon as it is free, reporting the one it just completed (and how long it took),
+    and is handed the most expensive snapshot still pending; rank 0 yields nothing
+    With a single rank, the snapshots are simply looped over in the same order
+    on_complete, if given, is called on rank 0 (or the single rank) as on_complete(index, seconds) for every completed snapshot
+    Yields index in to list_of_sims
+    '''
+    comm = MPI.COMM_WORLD
+    order = get_snapshot_order(list_of_sims, start_index=start_index, cost_func=cost_func)
+
+    # -------------serial case---------------------
+    if comm.size == 1:
+        for index in order:
+            start_time_this_task = time.time()
+            yield index
+            if on_complete is not None: on_complete(index, time.time() - start_time_this_task)
+        return
+
+    # -------------dispatcher on rank 0---------------------
+    if comm.rank == 0:
+        pending = deque(order)
+        nactive = comm.size - 1
+        status = MPI.Status()
+        while nactive > 0:
+            message = comm.recv(source=MPI.ANY_SOURCE, tag=TAG_READY, status=status) # message is (completed index, seconds, wants more?)
+            worker = status.Get_source()
+            if message[0] is not None and on_complete is not None: on_complete(message[0], message[1])
+            if message[2] and len(pending) > 0:
+                comm.send(pending.popleft(), dest=worker, tag=TAG_WORK)
+            else:
+                if message[2]: comm.send(None, dest=worker, tag=TAG_WORK) # nothing left, tell the worker to stop
+                nactive -= 1
+        return
+
+    # -------------workers---------------------
+    completed, seconds, finished = None, None, False
+    try:
+        while True:
+            comm.send((completed, seconds, True), dest=0, tag=TAG_READY)
+            index = comm.recv(source=0, tag=TAG_WORK)
+            if index is None:
+                finished = True
+                break
+            start_time_this_task = time.time()
+            yield index
+            completed, seconds = index, time.time() - start_time_this_task
+    finally:
+        if not finished: comm.send((completed, seconds, False), dest=0, tag=TAG_READY) # the loop was broken out of, so let the dispatcher know this worker is gone
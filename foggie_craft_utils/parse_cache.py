@@ -0,0 +1,61 @@
+##!/usr/bin/env python3
+
+"""
+
+    Title :      parse_cache
+    Notes :      Parses a (slow to read) text or table file once per process, and optionally once across processes via a pickled hidden sidecar next to the file,
+                 re-parsing only when the file changes, as told by its (mtime, size)
+                 Used by halo_catalog (halo centre and root index catalogs) and mass_profiles (row index of the mass files)
+    Author :     Ayan Acharyya
+    Started :    Jan 2026
+    Usage :      catalog = get_cached_parse(filename, parse_halo_catalog, '.pkl')
+
+"""
+import os
+import pickle as pkl
+
+parse_cache = {} # (filename, sidecar suffix) -> (mtime, size, parsed result), shared by all calls in this process
+
+# -----------------------------------------------------------------------------
+def get_sidecar_name(filename, sidecar_suffix):
+    '''
+    Function to get the filename of the sidecar of a given file; it is a hidden file next to the file
+    Returns filename
+    '''
+    sidecar_name = os.path.join(os.path.dirname(filename), '.' + os.path.basename(filename) + sidecar_suffix)
+
+    return sidecar_name
+
+# -----------------------------------------------------------------------------
+def get_cached_parse(filename, parse_func, sidecar_suffix, persist=True):
+    '''
+    Function to get the result of parse_func(filename), calling it only if the file has changed since it was last parsed in this process (or saved in the sidecar)
+    If persist is True, the result is also saved as a pickled sidecar next to the file (if the directory is writable), for other processes to use
+    Returns the result of parse_func (shared by all callers in this process, so callers should not modify it in place)
+    '''
+    filename = os.path.abspath(filename)
+    stat = os.stat(filename)
+    cache_key = (filename, sidecar_suffix)
+    if cache_key in parse_cache and parse_cache[cache_key][:2] == (stat.st_mtime, stat.st_size): return parse_cache[cache_key][2]
+
+    sidecar_name = get_sidecar_name(filename, sidecar_suffix)
+    result = None
+    if persist and os.path.exists(sidecar_name):
+        try:
+            with open(sidecar_name, 'rb') as file: mtime, size, result = pkl.load(file)
+            if (mtime, size) != (stat.st_mtime, stat.st_size): result = None # the file has been updated since
+        except Exception:
+            result = None
+
+    if result is None:
+        result = parse_func(filename)
+        if persist:
+            try:
+                with open(sidecar_name + '.tmp%d' % os.getpid(), 'wb') as file: pkl.dump((stat.st_mtime, stat.st_size, result), file)
+                os.replace(sidecar_name + '.tmp%d' % os.getpid(), sidecar_name) # atomic, so that other processes never see a partial sidecar
+            except OSError:
+                pass
+
+    parse_cache[cache_key] = (stat.st_mtime, stat.st_size, result)
+
+    return result
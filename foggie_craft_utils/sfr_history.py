@@ -0,0 +1,111 @@
+##!/usr/bin/env python3
+
+"""
+
+    Title :      sfr_history
+    Notes :      Reads the SFR history (halo_infos/00<halo>/<run>/sfr) of a halo once per process, with every requested rolling (over snapshots) smoothing of the SFR precomputed as columns,
+                 and matches SFRs to snapshots by name, or to a whole list of redshifts at once (via searchsorted on the sorted redshifts)
+    Author :     Ayan Acharyya
+    Started :    Jan 2026
+    Usage :      sfr_df = get_sfr_df(args, smooth_over_nsnap_arr=[1, 20]) # has columns output, redshift, sfr, sfr_smooth1, sfr_smooth20
+                 sfr_arr = get_sfr_at_redshifts(sfr_df, redshift_list, col='sfr_smooth20')
+
+"""
+import os
+import numpy as np
+import pandas as pd
+
+sfr_history_cache = {} # filename -> (mtime, size, sfr dataframe), shared by all calls in this process
+
+# -----------------------------------------------------------------------------
+def get_sfr_filename(args, fallback=False):
+    '''
+    Function to get the filename of the SFR history of args.halo
+    If fallback is True, and the file is not there for args.run, the one for the base run (first 14 characters of args.run) is used instead
+    Returns filename
+    '''
+    sfr_filename = args.code_path + 'halo_infos/00' + args.halo + '/' + args.run + '/sfr'
+    if fallback and not os.path.exists(sfr_filename):
+        print(sfr_filename, 'not found')
+        sfr_filename = sfr_filename.replace(args.run, args.run[:14])
+        print('Instead, reading SFR history from', sfr_filename)
+
+    return sfr_filename
+
+# -----------------------------------------------------------------------------
+def read_sfr_history(sfr_filename, smooth_over_nsnap_arr=[]):
+    '''
+    Function to read a SFR history file, parsing the text file only if it has changed since it was last read in this process
+    Each of the given smoothing windows (in number of snapshots) is added as the column sfr_smooth<n> (centred rolling mean), unless it was already computed
+    Returns pandas dataframe (shared by all callers in this process, so callers should not modify it in place)
+    '''
+    sfr_filename = os.path.abspath(sfr_filename)
+    stat = os.stat(sfr_filename)
+    if sfr_filename in sfr_history_cache and sfr_history_cache[sfr_filename][:2] == (stat.st_mtime, stat.st_size):
+        sfr_df = sfr_history_cache[sfr_filename][2]
+    else:
+        sfr_df = pd.read_table(sfr_filename, names=('output', 'redshift', 'sfr'), comment='#', sep=r'\s+')
+        sfr_df['output'] = sfr_df['output'].astype(str)
+        sfr_history_cache[sfr_filename] = (stat.st_mtime, stat.st_size, sfr_df)
+
+    new_cols = {f'sfr_smooth{nsnap}': sfr_df['sfr'].rolling(window=nsnap, center=True).mean() for nsnap in smooth_over_nsnap_arr if f'sfr_smooth{nsnap}' not in sfr_df}
+    if len(new_cols) > 0:
+        sfr_df = pd.concat([sfr_df, pd.DataFrame(new_cols, index=sfr_df.index)], axis=1)
+        sfr_history_cache[sfr_filename] = (stat.st_mtime, stat.st_size, sfr_df)
+
+    return sfr_df
+
+# -----------------------------------------------------------------------------
+def get_sfr_df(args, smooth_over_nsnap_arr=[], fallback=False, print_func=print):
+    '''
+    Function to read in the SFR history of args.halo, with the given smoothing windows (in number of snapshots) as sfr_smooth<n> columns
+    Returns pandas dataframe, which is empty if the file is not there
+    '''
+    sfr_filename = get_sfr_filename(args, fallback=fallback)
+    if os.path.exists(sfr_filename):
+        print_func(f'Reading SFR history from {sfr_filename}')
+        sfr_df = read_sfr_history(sfr_filename, smooth_over_nsnap_arr=smooth_over_nsnap_arr)
+    else:
+        print_func(f'Did not find {sfr_filename}, therefore will not include SFR')
+        sfr_df = pd.DataFrame(columns=['output', 'redshift', 'sfr'] + [f'sfr_smooth{nsnap}' for nsnap in smooth_over_nsnap_arr])
+
+    return sfr_df
+
+# -----------------------------------------------------------------------------
+def get_nearest_index(values, targets):
+    '''
+    Function to find, for each of the target values, the position of the nearest of the given values, in one go (via searchsorted on the sorted values), instead of an argmin for each target
+    Returns numpy array of positions (in to values, which need not be sorted)
+    '''
+    values = np.asarray(values, dtype=float)
+    targets = np.atleast_1d(np.asarray(targets, dtype=float))
+    order = np.argsort(values, kind='stable')
+    sorted_values = values[order]
+
+    right = np.clip(np.searchsorted(sorted_values, targets), 1, len(sorted_values) - 1) if len(sorted_values) > 1 else np.zeros(len(targets), dtype=int)
+    left = np.maximum(right - 1, 0)
+    nearest = np.where(np.abs(sorted_values[right] - targets) < np.abs(targets - sorted_values[left]), right, left) # ties go to the smaller value
+
+    return order[nearest]
+
+# -----------------------------------------------------------------------------
+def get_sfr_at_redshifts(sfr_df, redshift_arr, col='sfr'):
+    '''
+    Function to get the given SFR column at the snapshots nearest in redshift to each of the given redshifts
+    Returns numpy array
+    '''
+    sfr_arr = sfr_df[col].to_numpy()[get_nearest_index(sfr_df['redshift'], redshift_arr)]
+
+    return sfr_arr
+
+# -----------------------------------------------------------------------------
+def get_snapshot_sfr(sfr_df, output, cols=['sfr']):
+    '''
+    Function to look up the given columns of the SFR history for a given snapshot name
+    Returns list of values, or None if the snapshot is not in the SFR history
+    '''
+    rows = np.where(sfr_df['output'].to_numpy() == output)[0]
+    if len(rows) == 0: return None
+    values = [sfr_df[col].to_numpy()[rows[0]] for col in cols]
+
+    return values
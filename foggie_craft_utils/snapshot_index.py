@@ -0,0 +1,105 @@
+##!/usr/bin/env python3
+
+"""
+
+    Title :      snapshot_index
+    Notes :      SQLite index of per-snapshot metadata (redshift, time, halo centre and velocity, refine box, disk AM vector, file path),
+                 so that scripts that only need metadata do not have to yt.load the Enzo outputs; built by make_snapshot_index.py
+    Author :     Ayan Acharyya
+    Started :    Jan 2026
+
+"""
+import os
+import sqlite3
+import numpy as np
+from pathlib import Path
+from datetime import datetime
+
+index_cols = ['halo', 'run', 'output', 'centre_source', 'redshift', 'time_gyr', 'xc', 'yc', 'zc', 'xv', 'yv', 'zv', \
+              'refine_left_x', 'refine_left_y', 'refine_left_z', 'refine_right_x', 'refine_right_y', 'refine_right_z', 'refine_width_kpc', \
+              'Lx', 'Ly', 'Lz', 'snap_path', 'scanned_at']
+
+# -----------------------------------------------------------------------------
+def get_snapshot_index_name(args):
+    '''
+    Function to get the filename of the snapshot metadata index of a given halo and run; it lives next to the halo_c_v catalogs
+    Returns filename
+    '''
+    index_name = args.code_path + 'halo_infos/00' + args.halo + '/' + args.run + '/snapshot_index.db'
+
+    return index_name
+
+# -----------------------------------------------------------------------------
+def get_centre_source(args):
+    '''
+    Function to get the name of the halo centre catalog in use, which is part of the key of the index, since the centre (and hence the refine box and AM vector) depend on it
+    Returns string
+    '''
+    centre_source = 'halo_cen_smoothed' if getattr(args, 'use_cen_smoothed', False) else 'halo_c_v'
+
+    return centre_source
+
+# -----------------------------------------------------------------------------
+def open_snapshot_index(index_name):
+    '''
+    Function to open (and create, if needed) the snapshot metadata index
+    Returns sqlite3 connection
+    '''
+    Path(os.path.dirname(index_name)).mkdir(parents=True, exist_ok=True)  # creating the directory structure, if doesn't exist already
+    conn = sqlite3.connect(index_name, timeout=60)
+    col_defs = ', '.join([f'{col} TEXT' if col in ['halo', 'run', 'output', 'centre_source', 'snap_path', 'scanned_at'] else f'{col} REAL' for col in index_cols])
+    conn.execute(f'CREATE TABLE IF NOT EXISTS snapshots ({col_defs}, PRIMARY KEY (halo, run, output, centre_source))')
+
+    return conn
+
+# -----------------------------------------------------------------------------
+def write_snapshot_meta(args, ds, refine_box, norm_L=None):
+    '''
+    Function to add (or replace) the metadata of one loaded snapshot in the index, given the dataset and refine box as loaded by load_sim()
+    Returns dict of the metadata written
+    '''
+    left_edge = refine_box.left_edge.in_units('kpc').v
+    right_edge = refine_box.right_edge.in_units('kpc').v
+    if norm_L is None: norm_L = [np.nan] * 3
+
+    meta = {'halo': args.halo, 'run': args.run, 'output': args.output, 'centre_source': get_centre_source(args), \
+            'redshift': float(ds.current_redshift), 'time_gyr': float(ds.current_time.in_units('Gyr')), \
+            'refine_width_kpc': float(ds.refine_width) if hasattr(ds, 'refine_width') else np.nan, 'snap_path': str(ds.parameter_filename), 'scanned_at': '{:%Y-%m-%d %H:%M:%S}'.format(datetime.now())}
+    meta.update(zip(['xc', 'yc', 'zc'], np.array(ds.halo_center_kpc, dtype=float))) # foggie_load() sets these in kpc
+    meta.update(zip(['xv', 'yv', 'zv'], np.array(ds.halo_velocity_kms, dtype=float))) # and km/s
+    meta.update(zip(['refine_left_x', 'refine_left_y', 'refine_left_z'], np.array(left_edge, dtype=float)))
+    meta.update(zip(['refine_right_x', 'refine_right_y', 'refine_right_z'], np.array(right_edge, dtype=float)))
+    meta.update(zip(['Lx', 'Ly', 'Lz'], np.array(norm_L, dtype=float)))
+
+    with open_snapshot_index(get_snapshot_index_name(args)) as conn:
+        conn.execute(f'INSERT OR REPLACE INTO snapshots ({", ".join(index_cols)}) VALUES ({", ".join(["?"] * len(index_cols))})', [meta[col] for col in index_cols])
+    conn.close()
+
+    return meta
+
+# -----------------------------------------------------------------------------
+def read_snapshot_meta(args, output=None):
+    '''
+    Function to look up the metadata of a snapshot (args.output, unless output is given) in the index, for the halo centre source in use
+    Returns dict (with the centre, velocity and refine box edges as numpy arrays in kpc and km/s), or None if the index or the snapshot is not there
+    '''
+    index_name = get_snapshot_index_name(args)
+    if not os.path.exists(index_name): return None
+    if output is None: output = args.output
+
+    conn = sqlite3.connect(index_name, timeout=60)
+    try:
+        row = conn.execute(f'SELECT {", ".join(index_cols)} FROM snapshots WHERE halo=? AND run=? AND output=? AND centre_source=?', (args.halo, args.run, output, get_centre_source(args))).fetchone()
+    except sqlite3.OperationalError: # the table has not been made yet
+        row = None
+    conn.close()
+    if row is None: return None
+
+    meta = dict(zip(index_cols, row))
+    meta['halo_center'] = np.array([meta['xc'], meta['yc'], meta['zc']]) # kpc
+    meta['halo_velocity'] = np.array([meta['xv'], meta['yv'], meta['zv']]) # km/s
+    meta['refine_left_edge'] = np.array([meta['refine_left_x'], meta['refine_left_y'], meta['refine_left_z']]) # kpc
+    meta['refine_right_edge'] = np.array([meta['refine_right_x'], meta['refine_right_y'], meta['refine_right_z']]) # kpc
+    meta['norm_L'] = np.array([meta['Lx'], meta['Ly'], meta['Lz']]) if meta['Lx'] is not None and np.isfinite(meta['Lx']) else None
+
+    return meta
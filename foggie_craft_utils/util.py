@@ -9,6 +9,10 @@
 
 """
 from foggie_header import *
+from foggie_craft_utils.snapshot_index import read_snapshot_meta, get_centre_source
+from foggie_craft_utils.halo_catalog import get_catalog_row
+from foggie_craft_utils.mpi_scheduler import mpi_snapshot_loop
+from foggie_craft_utils.mass_profiles import get_snapshot_mass_profile
 
 # ----------------------------------------------------------------
 import fnmatch
@@ -84,6 +88,68 @@ def get_stellar_mass(args, refine_box=None):
 
     return disk_rad_kpc, log_stellar_mass
 
+# -----------------------------------------------------------------------------
+stellar_mass_cache = {} # (halo, run, output, centre source, centre) -> (disk radius, log stellar mass), for this process
+
+def get_stellar_mass_from_particles(args, refine_box=None):
+    '''
+    Computes the extent of stellar disk, by using a threshold of successive fractional increase in stellar mass in radial shells, like get_stellar_mass(), but
+    reading only the star particles in the refine box (instead of imposing the gas density cut, which needs the whole gas density field), and binning them in one go
+    If refine_box is not given, the refine box and halo centre are taken from the snapshot index if it has this snapshot (so the halo centre need not be found again), otherwise (or if the
+    indexed snapshot path cannot be loaded, e.g. an index built on another machine) via load_sim(),
+    in both cases with the halo centre catalog given by get_centre_source(args)
+    Returns disk radius (in kpc), and the cumulative stellar mass up to that shell (in log Msun)
+    '''
+    # ---------------reading in the snapshot-----------------
+    if refine_box is None:
+        meta = read_snapshot_meta(args)
+        if meta is not None:
+            try:
+                print('Taking refine box and halo center of', args.output, 'from the snapshot index')
+                ds = yt.load(meta['snap_path'])
+                refine_box = ds.box(ds.arr(meta['refine_left_edge'], 'kpc'), ds.arr(meta['refine_right_edge'], 'kpc'))
+                halo_center_kpc = meta['halo_center']
+            except Exception as e:
+                print(f'Could not use the snapshot index entry of {args.output} because {e}, therefore loading it afresh')
+                refine_box = None
+        if refine_box is None:
+            halos_df_name = args.code_path + f'halo_infos/00{args.halo}/{args.run}/' + get_centre_source(args)
+            try:
+                ds, refine_box = load_sim(args, region='refine_box', do_filter_particles=False, disk_relative=False, halo_c_v_name=halos_df_name)
+            except Exception as e:
+                print(f'Skipping {args.output} because {e}')
+                return np.nan, np.nan
+            halo_center_kpc = ds.halo_center_kpc.in_units('kpc').v
+    else:
+        halo_center_kpc = refine_box.ds.halo_center_kpc.in_units('kpc').v
+
+    cache_key = (args.halo, args.run, args.output, get_centre_source(args), tuple(np.round(halo_center_kpc, 3)))
+    if cache_key in stellar_mass_cache: return stellar_mass_cache[cache_key]
+
+    # ------------reading only the star particles-----------------
+    is_star = refine_box['all', 'particle_type'].v == 2 # same as the 'stars' particle filter
+    mass = refine_box['all', 'particle_mass'][is_star].in_units('Msun').v
+    position = refine_box['all', 'particle_position'][is_star].in_units('kpc').v
+    radius = np.sqrt(np.sum((position - halo_center_kpc) ** 2, axis=1))
+
+    # ----------binning mass profile--------------
+    shell_width_kpc = 1. # size of radial bins in kpc
+    mass_increase_frac_thresh = 0.001 # fractional increase in stellar mass between successive radial shells, below which we will stop computing mass
+
+    edges = np.arange(0, radius.max() + shell_width_kpc, shell_width_kpc)
+    mass_sums = np.bincount(np.minimum((radius / shell_width_kpc).astype(int), len(edges) - 2), weights=mass, minlength=len(edges) - 1)
+    mass_cum_sums = np.cumsum(mass_sums)
+    mass_increase_frac = np.hstack([np.diff(mass_cum_sums), np.nan]) / mass_cum_sums
+
+    index = np.where(mass_increase_frac <= mass_increase_frac_thresh)[0][0]
+    disk_rad_kpc = edges[index]
+    log_stellar_mass = np.log10(mass_cum_sums[index])
+
+    print(f'Obtained log stellar mass = {log_stellar_mass:.2f} within radius {disk_rad_kpc:.1f} kpc, for snap {args.halo}:{args.output}')
+    stellar_mass_cache[cache_key] = (disk_rad_kpc, log_stellar_mass)
+
+    return disk_rad_kpc, log_stellar_mass
+
 # -----------------------------------------------------------------------------
 def get_gas_disk_rad(args, refine_box=None):
     '''
@@ -238,19 +304,12 @@ def get_disk_stellar_mass(args, quant='stars'):
     mass_filename = args.code_path + 'halo_infos/00' + args.halo + '/' + args.run + '/masses_z-less-2.hdf5'
 
     if os.path.exists(mass_filename):
-        print('Reading in', mass_filename)
-        alldata = pd.read_hdf(mass_filename, key='all_data')
-        thisdata = alldata[alldata['snapshot'] == args.output]
-
-        if len(thisdata) == 0: # snapshot not found in masses less than z=2 file, so try greater than z=2 file
-            mass_filename = mass_filename.replace('less', 'gtr')
-            print('Could not find spanshot in previous file, now reading in', mass_filename)
-            alldata = pd.read_hdf(mass_filename, key='all_data')
-            thisdata = alldata[alldata['snapshot'] == args.output]
-
-            if len(thisdata) == 0: # snapshot still not found in file
-                print('Snapshot not found in either file. Returning bogus mass')
-                return -999
+        print('Reading in mass profile of', args.output, 'from the mass files in', os.path.dirname(mass_filename))
+        thisdata = get_snapshot_mass_profile(args)
+
+        if thisdata is None or len(thisdata) == 0: # snapshot not found in either the less than or greater than z=2 file
+            print('Snapshot not found in either file. Returning bogus mass')
+            return -999
 
         thisshell = thisdata[thisdata['radius'] <= args.diskrad]
         if len(thisshell) == 0: # the smallest shell available in the mass profile is larger than the necessary radius within which we need the stellar mass
@@ -391,6 +450,18 @@ def get_re_from_coldgas(args, gasprofile=None):
 
     return re
 
+# -------------------------------------------------------------------------------
+def get_enclosed_mass(radius, mass, radii):
+    '''
+    Function to compute the mass enclosed within each of the given radii, by sorting the elements by radius once and then looking up the cumulative mass at every radius
+    Returns numpy array of the same length as radii
+    '''
+    order = np.argsort(radius, kind='stable')
+    cumulative_mass = np.concatenate([[0.], np.cumsum(mass[order], dtype=np.float64)])
+    mass_enc = cumulative_mass[np.searchsorted(radius[order], radii, side='right')] # number of elements with radius <= each of radii
+
+    return mass_enc
+
 # -------------------------------------------------------------------------------
 def calc_masses(ds, snap, refine_width_kpc, tablename, get_gas_profile=False):
     """Computes the mass enclosed in spheres centered on the halo center.
@@ -399,43 +470,31 @@ def calc_masses(ds, snap, refine_width_kpc, tablename, get_gas_profile=False):
     and does the calculation, then writes a hdf5 table out to 'tablename'. If 'ions' is True then it
     computes the enclosed mass for various gas-phase ions.
     This is mostly copied from Cassi's get_mass_profile.calc_mass(), but for a shortened set of parameters, to save runtime
+    The enclosed masses at all radii are computed in one go, with get_enclosed_mass()
     """
 
     halo_center_kpc = ds.halo_center_kpc
 
-    # Set up table of everything we want
-    # NOTE: Make sure table units are updated when things are added to this table!
-    if get_gas_profile: data = Table(names=('radius', 'stars_mass', 'gas_mass', 'gas_metal_mass'), dtype=('f8', 'f8', 'f8', 'f8'))
-    else: data = Table(names=('radius', 'stars_mass'), dtype=('f8', 'f8'))
-
     # Define the radii of the spheres where we want to calculate mass enclosed
     radii = refine_width_kpc * np.logspace(-4, 0, 250)
 
     # Initialize first sphere
     print('Loading field arrays for snapshot', snap)
     sphere = ds.sphere(halo_center_kpc, radii[-1])
+    radii = radii.in_units('kpc').v if hasattr(radii, 'in_units') else np.asarray(radii)
 
-    if get_gas_profile:
-        gas_mass = sphere['gas','cell_mass'].in_units('Msun').v
-        gas_metal_mass = sphere['gas','metal_mass'].in_units('Msun').v
-        gas_radius = sphere['gas', 'radius_corrected'].in_units('kpc').v
-
+    # Set up table of everything we want
+    # NOTE: Make sure table units are updated when things are added to this table!
     stars_mass = sphere['stars','particle_mass'].in_units('Msun').v
     stars_radius = sphere['stars','radius_corrected'].in_units('kpc').v
+    columns = {'radius': radii, 'stars_mass': get_enclosed_mass(stars_radius, stars_mass, radii)}
 
-    # Loop over radii
-    for i in range(len(radii)):
-        if (i%10==0): print('Computing radius ' + str(i) + '/' + str(len(radii)-1) + ' for snapshot ' + snap)
-
-        # Cut the data interior to this radius
-        if get_gas_profile:
-            gas_mass_enc = np.sum(gas_mass[gas_radius <= radii[i]])
-            gas_metal_mass_enc = np.sum(gas_metal_mass[gas_radius <= radii[i]])
-        stars_mass_enc = np.sum(stars_mass[stars_radius <= radii[i]])
+    if get_gas_profile:
+        gas_radius = sphere['gas', 'radius_corrected'].in_units('kpc').v
+        columns['gas_mass'] = get_enclosed_mass(gas_radius, sphere['gas','cell_mass'].in_units('Msun').v, radii)
+        columns['gas_metal_mass'] = get_enclosed_mass(gas_radius, sphere['gas','metal_mass'].in_units('Msun').v, radii)
 
-        # Add everything to the table
-        if get_gas_profile: data.add_row([radii[i], stars_mass_enc, gas_mass_enc, gas_metal_mass_enc])
-        else: data.add_row([radii[i], stars_mass_enc])
+    data = Table(list(columns.values()), names=list(columns.keys()), dtype=['f8'] * len(columns))
 
     # Save to file
     table_units = {'radius':'kpc', 'stars_mass':'Msun', 'gas_mass':'Msun', 'gas_metal_mass':'Msun'}
@@ -444,6 +503,50 @@ def calc_masses(ds, snap, refine_width_kpc, tablename, get_gas_profile=False):
     data.write(tablename + '.hdf5', path='all_data', serialize_meta=True, overwrite=True)
     print('Masses have been calculated for snapshot' + snap)
 
+# --------------------------------------------------------------------------------
+def get_mass_profile_tablename(args):
+    '''
+    Function to get the name of the file that stores (or will store) the enclosed mass profile of a given snapshot
+    Returns filename
+    '''
+    foggie_dir, output_dir, run_dir, code_path, trackname, haloname, spectra_dir, infofile = get_run_loc_etc(args)
+    prefix = '/'.join(output_dir.split('/')[:-2]) + '/' + 'mass_profiles/' + args.run + '/'
+    tablename = prefix + args.output + '_masses.hdf5'
+
+    return tablename
+
+# --------------------------------------------------------------------------------
+def calc_masses_for_snapshots(args, list_of_outputs):
+    '''
+    Function to compute the enclosed mass profiles of a list of snapshots of a given halo in one go, skipping the ones that already exist (unless args.clobber)
+    The snapshots are handed out across MPI ranks, if there are more than one; a snapshot that fails to load or compute is skipped, so that it does not stop the rest
+    This is collective (the filenames are gathered from all ranks), so must be called by all ranks
+    Returns list of the mass profile filenames of all the snapshots (including skipped ones), in the order of list_of_outputs, on every rank
+    '''
+    tablenames = {} # index in to list_of_outputs -> filename, for the snapshots handed to this rank
+    for index in mpi_snapshot_loop(list_of_outputs):
+        args.output = list_of_outputs[index]
+        tablename = get_mass_profile_tablename(args)
+        tablenames[index] = tablename
+        if os.path.exists(tablename) and not args.clobber:
+            print('Skipping mass profile of', args.output, 'because', tablename, 'already exists')
+            continue
+
+        Path(os.path.dirname(tablename)).mkdir(parents=True, exist_ok=True)  # creating the directory structure, if doesn't exist already
+        halos_df_name = args.code_path + 'halo_infos/00' + args.halo + '/' + args.run + '/'
+        halos_df_name += 'halo_cen_smoothed' if args.use_cen_smoothed else 'halo_c_v'
+        try:
+            ds, refine_box = load_sim(args, region='refine_box', do_filter_particles=True, disk_relative=False, halo_c_v_name=halos_df_name)
+            calc_masses(ds, args.output, ds.quan(ds.refine_width, 'kpc'), os.path.splitext(tablename)[0], get_gas_profile=args.get_gasmass)
+        except Exception as e:
+            print(f'Skipping {args.output} because {e}')
+            continue
+
+    tablenames = {index: tablename for rank_tablenames in MPI.COMM_WORLD.allgather(tablenames) for index, tablename in rank_tablenames.items()}
+    tablenames = [tablenames[index] for index in sorted(tablenames)]
+
+    return tablenames
+
 # --------------------------------------------------------------------------------
 def get_re_from_stars(ds, args):
     '''
@@ -451,15 +554,13 @@ def get_re_from_stars(ds, args):
     Returns the effective radius in kpc
     '''
     re_hmr_factor = 2.0 # from the Illustris group (?)
-    foggie_dir, output_dir, run_dir, code_path, trackname, haloname, spectra_dir, infofile = get_run_loc_etc(args)
-    prefix = '/'.join(output_dir.split('/')[:-2]) + '/' + 'mass_profiles/' + args.run + '/'
-    tablename = prefix + args.output + '_masses.hdf5'
+    tablename = get_mass_profile_tablename(args)
 
     if os.path.exists(tablename):
         print('Reading mass profile file', tablename)
     else:
         print('File not found:', tablename, '\n', 'Therefore computing mass profile now..')
-        Path(prefix).mkdir(parents=True, exist_ok=True)  # creating the directory structure, if doesn't exist already
+        Path(os.path.dirname(tablename)).mkdir(parents=True, exist_ok=True)  # creating the directory structure, if doesn't exist already
         refine_width_kpc = ds.quan(ds.refine_width, 'kpc')
         calc_masses(ds, args.output, refine_width_kpc, os.path.splitext(tablename)[0], get_gas_profile=args.get_gasmass)
 
@@ -472,6 +573,50 @@ def get_re_from_stars(ds, args):
     print('\nStellar-profile: Half mass radius for halo ' + args.halo + ' output ' + args.output + ' (z=%.1F' %(args.current_redshift) + ') is %.2F kpc' %(re))
     return re
 
+# -----------------------------------------------------------------------------
+def get_AM_vector(ds, radius_kpc=15., use_particles='young_stars', args=None):
+    '''
+    Computes the orientation vector of angular momentum of the disk, in the given dataset, considering young star particles (or gas, if use_particles is 'gas' or False)
+    If args is given, looks up the vector in a per-run cache file in halo_infos first, keyed by halo, output, radius, particle type and halo centre (which identifies the centre source used),
+    and appends it to the cache if not found, so that reruns do not have to read the particles again
+    Based on foggie_load()
+    Returns the unit vector as a numpy array
+    '''
+    ptype = 'gas' if use_particles == 'gas' or use_particles == False else use_particles
+    centre = '_'.join(['%.3f' % item for item in ds.halo_center_kpc.in_units('kpc').v])
+    cache_cols = ['halo', 'output', 'radius_kpc', 'ptype', 'centre', 'Lx', 'Ly', 'Lz']
+
+    if args is not None:
+        cache_filename = args.code_path + 'halo_infos/00' + args.halo + '/' + args.run + '/AM_vectors'
+        if os.path.exists(cache_filename):
+            cache_df = pd.read_table(cache_filename, names=cache_cols, comment='#', delim_whitespace=True, dtype={'halo': str, 'output': str, 'ptype': str, 'centre': str})
+            cache_df = cache_df[(cache_df['halo'] == args.halo) & (cache_df['output'] == args.output) & np.isclose(cache_df['radius_kpc'], radius_kpc) & (cache_df['ptype'] == ptype) & (cache_df['centre'] == centre)]
+            if len(cache_df) > 0:
+                norm_L = cache_df[['Lx', 'Ly', 'Lz']].iloc[-1].to_numpy(dtype=float)
+                print('Read angular momentum vector', norm_L, 'from', cache_filename)
+                return norm_L
+
+    start_time = time.time()
+
+    print('Starting to derive angular momentum vector. This can take a while..')
+    sphere = ds.sphere(ds.halo_center_kpc, (radius_kpc, 'kpc'))
+    if ptype == 'gas':
+        L = sphere.quantities.angular_momentum_vector(use_gas=True, use_particles=False)
+    else:
+        L = sphere.quantities.angular_momentum_vector(use_gas=False, use_particles=True, particle_type=ptype)
+    print('Completed deriving angular momentum vector, in %s mins' % ((time.time() - start_time) / 60))
+    norm_L = L / np.sqrt((L ** 2).sum())
+    norm_L = np.array(norm_L.value)
+
+    if args is not None:
+        Path(os.path.dirname(cache_filename)).mkdir(parents=True, exist_ok=True)  # creating the directory structure, if doesn't exist already
+        line = '%s %s %.3f %s %s %.8f %.8f %.8f\n' % (args.halo, args.output, radius_kpc, ptype, centre, *norm_L)
+        if not os.path.exists(cache_filename): line = '# ' + ' '.join(cache_cols) + '\n' + line
+        with open(cache_filename, 'a') as file: file.write(line) # a single appended line, so that concurrent ranks do not clobber each other
+        print('Saved angular momentum vector in', cache_filename)
+
+    return norm_L
+
 # ---------------------------------------------------------------------------
 def get_kpc_from_arc_at_redshift(arcseconds, redshift):
     '''
@@ -1442,15 +1587,15 @@ def get_output_range(output_range):
 # ---------------------------------------------------------------------------------------------
 def pull_halo_redshift(args):
     '''
-    Function to pull the current redshift of the halo (WITHOUT having to load the simulation), by matching with the corresponding halo_c_v file
+    Function to pull the current redshift of the halo (WITHOUT having to load the simulation), from the snapshot index if it is there, otherwise by matching with the corresponding halo_c_v file
     '''
+    meta = read_snapshot_meta(args)
+    if meta is not None: return meta['redshift']
+
     halo_cat_file = args.code_path + 'halo_infos/00' + args.halo + '/nref11c_nref9f/halo_c_v'
-    #df = pd.read_csv(halo_cat_file, comment='#', sep='\s+|')
-    #try: z = df.loc[df['name']==args.output, 'redshift'].values[0]
-    # shifted from pandas to astropy because pandas runs in to weird error on pleiades
-    df = Table.read(halo_cat_file, format='ascii')
-    try: z = float(df['col2'][np.where(df['col3']==args.output)[0][0]])
-    except IndexError: # if this snapshot is not yet there in halo_c_v file
+    row = get_catalog_row(halo_cat_file, args.output)
+    if row is not None: z = float(row['redshift'])
+    else: # if this snapshot is not yet there in halo_c_v file
         if args.halo == '4123' and args.output == 'RD0038': z = 0.15
         else: z = -99
     return z
@@ -1458,33 +1603,25 @@ def pull_halo_redshift(args):
 # ----------------------------------------------------------------------------------------------
 def pull_halo_center(args, fast=False):
     '''
-    Function to pull halo center from halo catalogue, if exists, otherwise compute halo center
+    Function to pull halo center from the snapshot index or halo catalogue, if exists, otherwise compute halo center
     Adapted from utils.foggie_load()
     '''
+    meta = read_snapshot_meta(args)
+    if meta is not None:
+        myprint('Pulling halo center from snapshot index', args)
+        args.halo_center = meta['halo_center'] # in kpc units
+        args.halo_velocity = meta['halo_velocity'] # in km/s units
+        return args
 
     halos_df_name = args.code_path + 'halo_infos/00' + args.halo + '/' + args.run + '/'
     halos_df_name += 'halo_cen_smoothed' if args.use_cen_smoothed else 'halo_c_v' # changed on Aug 30, after Cassi updated smoothed halo centers
 
     if os.path.exists(halos_df_name):
-        halos_df = pd.read_table(halos_df_name, sep='|')
-        halos_df.columns = halos_df.columns.str.strip() # trimming column names of extra whitespace
-        try:
-            halos_df['name'] = halos_df['name'].str.strip() # trimming column 'name' of extra whitespace
-        except:
-            halos_df['name'] = halos_df['snap'].str.strip() # trimming column 'name' of extra whitespace
-
-        if halos_df['name'].str.contains(args.output).any():
+        row = get_catalog_row(halos_df_name, args.output)
+        if row is not None:
             myprint('Pulling halo center from catalog file', args)
-            halo_ind = halos_df.index[halos_df['name'] == args.output][0]
-            if 'xc' in halos_df: args.halo_center = halos_df.loc[halo_ind, ['xc', 'yc', 'zc']].values # in kpc units
-            elif 'x_c' in halos_df: args.halo_center = halos_df.loc[halo_ind, ['x_c', 'y_c', 'z_c']].values # in kpc units
-            try:
-                args.halo_velocity = halos_df.loc[halo_ind, ['xv', 'yv', 'zv']].values # in km/s units
-            except:
-                try:
-                    args.halo_velocity = halos_df.loc[halo_ind, ['v_x', 'v_y', 'v_z']].values  # in km/s units
-                except:
-                    pass
+            args.halo_center = np.array([row['xc'], row['yc'], row['zc']]) # in kpc units
+            if 'xv' in row: args.halo_velocity = np.array([row['xv'], row['yv'], row['zv']]) # in km/s units
             calc_hc = False
         elif not fast:
             myprint('This snapshot is not in the halos_df file, calculating halo center...', args)
@@ -1838,6 +1975,10 @@ def parse_args(fast=False):
     # ------- args added for make_3D_FRB_electron_density.py ------------------------------
     parser.add_argument('--plot_3d', dest='plot_3d', action='store_true', default=False, help='Plot 3D FRB?, default is no')
     parser.add_argument('--do_only_plot', dest='do_only_plot', action='store_true', default=False, help='Only plot the FRB, without saving it?, default is no')
+    parser.add_argument('--slab_ncells', metavar='slab_ncells', type=int, action='store', default=None, help='deposit the 3D FRB in slabs of this many cells, streaming each slab to the fits file, to bound the memory use?, default is None, i.e. the whole box at once')
+    parser.add_argument('--check_slab_frb', dest='check_slab_frb', action='store_true', default=False, help='with --slab_ncells, first check that the slab wise 3D FRB matches the whole box one, on a small FRB?, default is no')
+    parser.add_argument('--frb_quants', metavar='frb_quants', type=str, action='store', default='el_density,density', help='comma separated quantities to make the FRBs of, all deposited in one pass (choose from el_density, density, temp, metal); default is el_density,density')
+    parser.add_argument('--yt_proj', dest='yt_proj', action='store_true', default=False, help='make the face on and edge on projections with yt OffAxisProjectionPlot, instead of from the 3D FRB?, default is no')
 
     # ------- args added for get_mass_sfr.py ------------------------------
     parser.add_argument('--plot_sfh', dest='plot_sfh', action='store_true', default=False, help='Plot the SFH of every halo?, default is no')
@@ -60,6 +60,7 @@ from scipy.interpolate import LinearNDInterpolator as LND
 from scipy.special import erf
 from scipy.optimize import curve_fit, fminbound
 from scipy.ndimage import gaussian_filter
+from scipy.ndimage import map_coordinates
 from scipy.stats import binned_statistic
 
 from astropy.io import ascii, fits
@@ -99,6 +100,13 @@ from foggie_craft_utils.yt_fields import *
 from foggie_craft_utils.foggie_load import *
 from foggie_craft_utils.get_proper_box_size import get_proper_box_size
 from foggie_craft_utils.util import *
+from foggie_craft_utils.mpi_scheduler import *
+from foggie_craft_utils.cost_model import record_cost, get_cost_func
+from foggie_craft_utils.snapshot_index import *
+from foggie_craft_utils.halo_catalog import get_catalog_row, read_halo_catalog
+from foggie_craft_utils.mass_profiles import get_snapshot_mass_profile, read_snapshot_mass_rows
+from foggie_craft_utils.sfr_history import get_sfr_df, get_sfr_at_redshifts, get_snapshot_sfr, get_nearest_index
+from foggie_craft_utils.catalog_writer import append_to_shard, merge_shards
 
 from datetime import timedelta, datetime
 
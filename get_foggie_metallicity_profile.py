@@ -13,7 +13,6 @@ from craft_header import *
 from craft_utils import *
 setup_plot_style()
 from foggie_header import *
-from make_3D_FRB_electron_density import get_AM_vector
 start_time = datetime.now()
 
 # --------------------------------------------------------------------------
@@ -133,18 +132,11 @@ def get_halo_coords(halo_c_v_filename, snap):
     Reads in a given halo_c_v file, and finds the central coordinate of a given snapshot
     Returns center as tuple
     '''
-    df = pd.read_csv(halo_c_v_filename, sep='|', skipinitialspace=True)
+    row = get_catalog_row(str(halo_c_v_filename), snap)
 
-    # We drop columns that are all NaN and strip the whitespace from headers
-    df = df.dropna(axis=1, how='all')
-    df.columns = df.columns.str.strip()
-    df['name'] = df['name'].str.strip()
-
-    row = df[df['name'] == snap]
-
-    if not row.empty:
+    if row is not None:
         # Return as a tuple (x_c, y_c, z_c)
-        return (row.iloc[0]['x_c'], row.iloc[0]['y_c'], row.iloc[0]['z_c'])
+        return (row['xc'], row['yc'], row['zc'])
     else:
         print(f"Output {snap} not found in {halo_c_v_filename}")
         return None
@@ -270,7 +262,7 @@ if __name__ == '__main__':
         box = ds.r[box_center[0] - box_width_kpc / 2.: box_center[0] + box_width_kpc / 2., box_center[1] - box_width_kpc / 2.: box_center[1] + box_width_kpc / 2., box_center[2] - box_width_kpc / 2.: box_center[2] + box_width_kpc / 2.]
 
         # ----------------making projection plots-------------------
-        norm_L = get_AM_vector(ds, radius_kpc=3., use_particles=False)
+        norm_L = get_AM_vector(ds, radius_kpc=3., use_particles=False, args=args)
         quant_arr = ['density', 'metal']
 
         plot_width = box_width/1.44
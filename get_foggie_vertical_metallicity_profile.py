@@ -13,7 +13,6 @@ from craft_header import *
 from craft_utils import *
 setup_plot_style()
 from foggie_header import *
-from make_3D_FRB_electron_density import get_AM_vector
 from get_foggie_metallicity_profile import get_halo_coords, my_foggie_load, get_projection_frb
 start_time = datetime.now()
 
@@ -72,7 +71,7 @@ def write_projected_frb(quant_arr, args):
     box = ds.r[box_center[0] - box_width_kpc / 2.: box_center[0] + box_width_kpc / 2., box_center[1] - box_width_kpc / 2.: box_center[1] + box_width_kpc / 2., box_center[2] - box_width_kpc / 2.: box_center[2] + box_width_kpc / 2.]
 
     # ----------------setting up FITS file-------------------
-    norm_L = get_AM_vector(ds, radius_kpc=3., use_particles=False)
+    norm_L = get_AM_vector(ds, radius_kpc=3., use_particles=False, args=args)
     img_hdu_list = []
     primary_hdu = fits.PrimaryHDU()
     img_hdu_list.append(primary_hdu)
@@ -4,7 +4,8 @@
 
     Title :      get_mass_sfr
     Notes :      Derive stellar masses and SFRs for a list of FOGGIE snapshots
-    Output :     Pandas dataframe
+    Output :     Pandas dataframe; its star_mass_method column records how log_star_mass_from_snap (and disk_rad) were derived: 'star_particles_in_refine_box' means from all star particles
+                 in the refine box, without the ISM gas density cut that get_stellar_mass() imposes (rows without it predate this, and used the gas density cut)
     Author :     Ayan Acharyya
     Started :    Jan 2026
     Examples :   run get_mass_sfr.py --system ayan_pleiades --do_all_halos
@@ -15,22 +16,6 @@ from foggie_header import *
 from craft_utils import annotate_axes, save_fig
 start_time = datetime.now()
 
-# -----------------------------------------------------------------------------
-def get_sfr_df(args):
-    '''
-    Reads in the dataframe that contains SFR of each snapshot of a given halo
-    Returns pandas dataframe
-    '''
-    sfr_filename = args.code_path + 'halo_infos/00' + args.halo + '/' + args.run + '/sfr'
-    if os.path.exists(sfr_filename):
-        print_master(f'Reading SFR history from {sfr_filename}', args)
-        sfr_df = pd.read_table(sfr_filename, names=('output', 'redshift', 'sfr'), comment='#', delim_whitespace=True)
-    else:
-        print_master(f'Did not find {sfr_filename}, therefore will not include SFR', args)
-        sfr_df = pd.DataFrame()
-
-    return sfr_df
-
 # -----------------------------------------------------------------------------
 def get_mass_profile(args):
     '''
@@ -39,19 +24,12 @@ def get_mass_profile(args):
     mass_filename = args.code_path + 'halo_infos/00' + args.halo + '/' + args.run + '/masses_z-less-2.hdf5'
 
     if os.path.exists(mass_filename):
-        print_mpi(f'Reading in {mass_filename}', args)
-        alldata = pd.read_hdf(mass_filename, key='all_data')
-        thisdata = alldata[alldata['snapshot'] == args.output]
-
-        if len(thisdata) == 0: # snapshot not found in masses less than z=2 file, so try greater than z=2 file
-            mass_filename = mass_filename.replace('less', 'gtr')
-            print_mpi(f'Could not find snapshot in previous file, now reading in {mass_filename}', args)
-            alldata = pd.read_hdf(mass_filename, key='all_data')
-            thisdata = alldata[alldata['snapshot'] == args.output]
+        print_mpi(f'Reading in mass profile of {args.output} from the mass files in {os.path.dirname(mass_filename)}', args)
+        thisdata = get_snapshot_mass_profile(args) # reads only this snapshot's rows, from whichever of the less/greater than z=2 files has it
 
-            if len(thisdata) == 0: # snapshot still not found in file
-                print_mpi('Snapshot not found in either file. Returning bogus mass', args)
-                return np.nan
+        if thisdata is None or len(thisdata) == 0: # snapshot not found in either file
+            print_mpi('Snapshot not found in either file. Returning bogus mass', args)
+            return np.nan
 
         mass_profile = thisdata[thisdata['radius'] <= args.diskrad]
         if len(mass_profile) == 0: # the smallest shell available in the mass profile is larger than the necessary radius within which we need the stellar mass
@@ -102,7 +80,8 @@ if __name__ == '__main__':
     
    # ---------initialising output dataframe-------------
     output_dfname = args.output_dir + 'data/lsm_sfr_masses_upto_disk.csv'
-    columns = ['halo', 'snap', 'redshift', 'sfr', f'sfr_{int(5 * smooth_over_snap)}Myr', 'disk_rad', 'log_star_mass_from_snap', 'log_star_mass_from_profile', 'log_gas_mass_from_profile', 'half_mass_rad']
+    columns = ['halo', 'snap', 'redshift', 'sfr', f'sfr_{int(5 * smooth_over_snap)}Myr', 'disk_rad', 'log_star_mass_from_snap', 'log_star_mass_from_profile', 'log_gas_mass_from_profile', 'half_mass_rad', 'star_mass_method']
+    star_mass_method = 'star_particles_in_refine_box' # i.e. get_stellar_mass_from_particles(), which does not impose the gas density cut
 
     # ----------getting list of snapshots-----------
     if args.do_all_halos:
@@ -132,25 +111,21 @@ if __name__ == '__main__':
     for index, thishalo in enumerate(halos):
         print_master(f'Starting halo {thishalo}..', args)
         args.halo = thishalo
-        sfr_df  = get_sfr_df(args) # reading SFR df
-        sfr_df[f'sfr_smooth{smooth_over_snap}'] = sfr_df['sfr'].rolling(window=smooth_over_snap, center=True).mean()
+        sfr_df  = get_sfr_df(args, smooth_over_nsnap_arr=np.unique([smooth_over_snap] + (smooth_over_nsnap_arr if args.plot_sfh else [])), print_func=lambda text: print_master(text, args)) # reading SFR df, with all smoothing windows at once
 
         # ---------make SFH plots-------------
         if args.plot_sfh:
-            sfr_df['time'] = cosmo.age(sfr_df['redshift']).value # in Gyr
+            sfr_time = cosmo.age(sfr_df['redshift']).value # in Gyr
 
-            # ------smoothing the sfh----------
+            # ------plotting the smoothed sfh----------
             for index2, smooth_over_snap in enumerate(smooth_over_nsnap_arr):
-                sfr_df[f'sfr_smooth{smooth_over_snap}'] = sfr_df['sfr'].rolling(window=smooth_over_snap, center=True).mean()
-                
-                # ---------plotting smoothed sfh---------
-                axes[index].plot(sfr_df['time'], sfr_df[f'sfr_smooth{smooth_over_snap}'], c=col_arr[index2], lw=0.5 + 0.1*index2, label=f'{int(smooth_over_snap * 5)} Myr scale')
+                axes[index].plot(sfr_time, sfr_df[f'sfr_smooth{smooth_over_snap}'], c=col_arr[index2], lw=0.5 + 0.1*index2, label=f'{int(smooth_over_snap * 5)} Myr scale')
                 
                 # -------annotating plots-----------
                 axes[index] = annotate_axes(axes[index], r'Time [Gyr]', r'SFR [M$_\odot$/yr]', fontsize=args.fontsize, label=f'{args.halo}: {halo_dict[args.halo]}', hide_xaxis=index < len(halos) - 1)
             
                 # -----plotting SFR at our redshifts----------
-                sfr_list = [sfr_df.loc[(sfr_df['redshift'] - this_redshift).abs().idxmin(), f'sfr_smooth{smooth_over_snap}'] for this_redshift in redshift_list]
+                sfr_list = get_sfr_at_redshifts(sfr_df, redshift_list, col=f'sfr_smooth{smooth_over_snap}')
                 axes2[index].plot(redshift_list, np.log10(sfr_list), 'o-', c=col_arr[index2], lw=0.5, label=f'{int(smooth_over_snap * 5)} Myr scale')
 
                 # -------annotating plots-----------
@@ -172,10 +147,7 @@ if __name__ == '__main__':
             # --------preparing to read in this halo-----------------
             df = pd.read_csv(args.code_dir + f'halo_infos/00{args.halo}/nref11c_nref9f/halo_cen_smoothed', sep=r'\s*\|\s*', engine='python')
             df = df.dropna(axis=1, how='all')[['snap', 'redshift']]
-            output_list = []
-            for redshift in redshift_list:
-                idx = (df['redshift'] - redshift).abs().idxmin()
-                output_list.append(df.loc[idx, 'snap'])
+            output_list = list(df['snap'].to_numpy()[get_nearest_index(df['redshift'], redshift_list)])
             
             outputs_existing = [snap for snap in output_list if (str(thishalo), str(snap)) in existing_combos]
             outputs_todo = list(set(output_list) - set(outputs_existing))
@@ -195,38 +167,26 @@ if __name__ == '__main__':
             print_master('Total number of MPI ranks = ' + str(ncores) + '. Starting at: {:%Y-%m-%d %H:%M:%S}'.format(datetime.now()), args)
             comm.Barrier() # wait till all cores reached here and then resume
 
-            split_at_cpu = total_snaps - ncores * int(total_snaps/ncores)
-            nper_cpu1 = int(total_snaps / ncores)
-            nper_cpu2 = nper_cpu1 + 1
-            if rank < split_at_cpu:
-                core_start = rank * nper_cpu2
-                core_end = (rank+1) * nper_cpu2 - 1
-            else:
-                core_start = split_at_cpu * nper_cpu2 + (rank - split_at_cpu) * nper_cpu1
-                core_end = split_at_cpu * nper_cpu2 + (rank - split_at_cpu + 1) * nper_cpu1 - 1
-
             # -------------loop over snapshots-----------------
-            #print_mpi('Operating on snapshots ' + str(core_start + 1) + ' to ' + str(core_end + 1) + ', i.e., ' + str(core_end - core_start + 1) + ' out of ' + str(total_snaps) + ' snapshots', args)
             print_mpi(f'halo {thishalo}: outputs_todo = {outputs_todo}', args) ##
-            print_mpi(f'Operating on snapshots {thishalo:} {outputs_todo[core_start : core_end + 1]} ' + str(core_start + 1) + ' to ' + str(core_end + 1) + ', i.e., ' + str(core_end - core_start + 1) + ' out of ' + str(total_snaps) + ' snapshots', args) ##
+            print_master(f'halo {thishalo}: handing out ' + str(total_snaps) + ' snapshots dynamically across MPI ranks, most expensive first', args)
             
-            for index in range(core_start + args.start_index, core_end + 1):
+            for index in mpi_snapshot_loop(outputs_todo, start_index=args.start_index):
                 start_time_this_snapshot = datetime.now()
                 args.output = outputs_todo[index]
                 args.halo = thishalo
-                print_mpi('Doing snapshot ' + args.output + ' of halo ' + args.halo + ' which is ' + str(index + 1 - core_start) + ' out of the total ' + str(core_end - core_start + 1) + ' snapshots...', args)
+                print_mpi('Doing snapshot ' + args.output + ' of halo ' + args.halo + ' which is ' + str(index + 1) + ' out of the total ' + str(total_snaps) + ' snapshots...', args)
 
                 # -----------determining SFR and redshift--------------------
-                if args.output in sfr_df['output'].values:
-                    sfr = sfr_df[sfr_df['output'] == args.output][f'sfr'].values[0]
-                    sfr_smooth = sfr_df[sfr_df['output'] == args.output][f'sfr_smooth{smooth_over_snap}'].values[0]
-                    args.current_redshift = sfr_df[sfr_df['output'] == args.output]['redshift'].values[0]
+                sfr_values = get_snapshot_sfr(sfr_df, args.output, cols=['sfr', f'sfr_smooth{smooth_over_snap}', 'redshift'])
+                if sfr_values is not None:
+                    sfr, sfr_smooth, args.current_redshift = sfr_values
                     df_row = pd.DataFrame([[args.halo, args.output, args.current_redshift, sfr, sfr_smooth]], columns=['halo', 'snap', 'z', 'sfr', 'sfr_smooth'])
                     print_mpi(f'{args.halo}, {args.output}, {args.current_redshift}, {sfr}, {sfr_smooth}', args) ##
                     
                     try:
                         # ------determining extent for computing mass--------
-                        args.diskrad, log_mstar_from_snap = get_stellar_mass(args)
+                        args.diskrad, log_mstar_from_snap = get_stellar_mass_from_particles(args)
                         if np.isnan(log_mstar_from_snap):
                             raise ValueError
 
@@ -236,7 +196,7 @@ if __name__ == '__main__':
                         log_mgas_from_profile = np.log10(mgas)
 
                         # ------appending to dataframe----------
-                        df_row = pd.DataFrame([[args.halo, args.output, args.current_redshift, sfr, sfr_smooth, args.diskrad, log_mstar_from_snap, log_mstar_from_profile, log_mgas_from_profile, half_mass_radius]], columns=columns)
+                        df_row = pd.DataFrame([[args.halo, args.output, args.current_redshift, sfr, sfr_smooth, args.diskrad, log_mstar_from_snap, log_mstar_from_profile, log_mgas_from_profile, half_mass_radius, star_mass_method]], columns=columns)
                     except Exception as e:
                         print_mpi(f'Snapshot {args.halo}:{args.output} failed due to {e}, therefore skipping, and not adding to dataframe', args)
                         continue
@@ -246,10 +206,12 @@ if __name__ == '__main__':
                     continue
 
                 # -----------saving dataframe---------------
-                file_exists = os.path.exists(output_dfname)
-                df_row.to_csv(output_dfname, index=False, mode='a' if file_exists else 'w', header=not file_exists)
+                append_to_shard(output_dfname, df_row, rank=rank) # each rank writes to its own shard; merged at the end
                 print_mpi(f'Completed snapshot {args.halo}:{args.output} in {timedelta(seconds=(datetime.now() - start_time_this_snapshot).seconds)}', args)
     
+    # --------merging the shards of all ranks---------
+    if not args.plot_sfh: df = merge_shards(output_dfname, key=['halo', 'snap'], sep=',', comm=MPI.COMM_WORLD)
+
     # --------saving final figure---------
     if args.plot_sfh:
         save_fig(fig, Path(args.output_dir) / 'plots', 'all_halos_sfh.png', args)
@@ -11,6 +11,8 @@ setup_plot_style()
 from globalpars import *
 from nefns import *
 from plotdm import *
+from foggie_craft_utils.mpi_scheduler import mpi_snapshot_loop
+from foggie_craft_utils.cost_model import record_cost, get_cost_func
 
 start_time = datetime.now()
 
@@ -63,6 +65,10 @@ def print_instructions():
     print(" Supported Modes are --- profile        (calculate electron density profiles)")
     print("                     --- plot_profile          (plot electron density profiles)")
     print("                     --- losdm          (calculate LoS DMs)")
+    print("                     --- axisdm         (calculate DMs of all axis aligned LoS, from prefix-sum indices)")
+    print("                     --- dmmap          (calculate parallel beam DM maps at the inclinations in globalpars.py)")
+    print("                     --- atlas          (build the DM atlas of each snapshot, if the cube has changed since)")
+    print("                     --- voxidx         (classify every voxel by radius, polar angle and inclination, for voxel binned profiles)")
     print("                     --- pltdm          (Plot LoS DMs)")
     print("                     --- dmscat         (Plot LoS DMs)")
     print("\n            Now let's try again!\n")
@@ -102,22 +108,15 @@ if __name__ == '__main__':
     print_master(f'Total number of MPI ranks = {ncores} for total {total_snaps} snaps. ' + 'Starting at: {:%Y-%m-%d %H:%M:%S}'.format(datetime.now()))
     comm.Barrier() # wait till all cores reached here and then resume
 
-    split_at_cpu = total_snaps - ncores * int(total_snaps/ncores)
-    nper_cpu1 = int(total_snaps / ncores)
-    nper_cpu2 = nper_cpu1 + 1
-    if rank < split_at_cpu:
-        core_start = rank * nper_cpu2
-        core_end = (rank+1) * nper_cpu2 - 1
-    else:
-        core_start = split_at_cpu * nper_cpu2 + (rank - split_at_cpu) * nper_cpu1
-        core_end = split_at_cpu * nper_cpu2 + (rank - split_at_cpu + 1) * nper_cpu1 - 1
-
     # -------------loop over snapshots-----------------
-    print_mpi('Operating on snapshots ' + str(core_start + 1) + ' to ' + str(core_end + 1) + ', i.e., ' + str(core_end - core_start + 1) + ' out of ' + str(total_snaps) + ' snapshots')
+    print_master('Handing out ' + str(total_snaps) + ' snapshots dynamically across MPI ranks, most expensive first')
     start_index = 0
 
-    for index in range(core_start + start_index, core_end + 1):
+    cost_key = lambda item: tuple(Path(item).stem.split('_')[:2][::-1]) # (halo, snapshot) from the fits filename
+    for index in mpi_snapshot_loop(list_of_fits, start_index=start_index, cost_func=get_cost_func('gethostdm_all', stage=exmode, key_func=cost_key)):
         start_time_this_snapshot = datetime.now()
+        necub = None
+        did_work = False # whether this snapshot's work was actually done, rather than skipped because its products exist
         thisfile = Path(list_of_fits[index])
         fitsname = thisfile.stem
 
@@ -125,15 +124,17 @@ if __name__ == '__main__':
         else: profsubdir = 'gas_density/'
         profdir = radialdir + profsubdir
         Path(profdir).mkdir(exist_ok=True, parents=True)
-        profile_pkl_filename = profdir + fitsname + '_radprof.pkl'
+        profile_pkl_filename = profdir + fitsname + '_radprof.pkl' # older pickled profiles, converted on first use
+        profile_filename = profdir + fitsname + '_radprof.h5'
         
         if fitsname[-3:] == str(nfixpts): fitsname = fitsname[:-4]
         this_sim = fitsname.split('_')[:2]
-        print_mpi('Doing snapshot ' + this_sim[0] + ' of halo ' + this_sim[1] + ' which is ' + str(index + 1 - core_start) + ' out of the total ' + str(core_end - core_start + 1) + ' snapshots...')
+        print_mpi('Doing snapshot ' + this_sim[0] + ' of halo ' + this_sim[1] + ' which is ' + str(index + 1) + ' out of the total ' + str(total_snaps) + ' snapshots...')
 
         #	-------------------------	Load the fits file	---------------------------
-        if exmode in ['losdm', 'profile']:
-            if not (exmode == 'profile' and os.path.exists(profile_pkl_filename)):
+        atlas_filename = losdir + fitsname + '_dmatlas.h5'
+        if exmode in ['losdm', 'axisdm', 'dmmap', 'atlas', 'voxidx', 'profile']:
+            if not (exmode == 'profile' and (os.path.exists(profile_filename) or os.path.exists(profile_pkl_filename))) and not (exmode == 'atlas' and is_atlas_current(atlas_filename, datadir + fitsname + '.fits')):
                 print_mpi("Reading "+fitsname)
                 necub,dkpc,theta0,phi0	=	fitld(fitsname,3.2)
                 print_mpi(f"Ne cube dimensions {necub.shape}")
@@ -143,18 +144,20 @@ if __name__ == '__main__':
         #	-------------------------	Execute tasks	-------------------------------
 
         if (exmode=='profile'):
-            if not os.path.exists(profile_pkl_filename):
+            if os.path.exists(profile_filename):
+                print_mpi(f"\nUsing existing radial electron density profile {profile_filename}\n")
+            elif os.path.exists(profile_pkl_filename):
+                print_mpi(f"\nConverting existing radial electron density profile {profile_pkl_filename}\n")
+                with open(profile_pkl_filename, 'rb') as file_obj:
+                    write_radial_profile(pkl.load(file_obj), profile_filename)
+            else:
                 print_mpi("\nGenerating radial electron density profiles...\n")
                 cubene	= neprofinc(necub,dkpc,1.0,theta0,phi0,1.0,1.0,1.0)
-                
-                with open(profile_pkl_filename, 'wb') as file_obj:
-                    pkl.dump(cubene, file_obj) # dump the pickle file
-            else:
-                print_mpi(f"\nUsing existing radial electron density profile {profile_pkl_filename}\n")
+                write_radial_profile(cubene, profile_filename)
+                did_work = True
             
             print_mpi("\nPlotting radial electron density profiles...\n")            
-            with open(profile_pkl_filename, 'rb') as file_obj:
-                cubene = pkl.load(file_obj) # load the pickle file
+            cubene = read_radial_profile(profile_filename)
             
             prof_figdir = plotradial + profsubdir
             Path(prof_figdir).mkdir(exist_ok=True, parents=True)
@@ -164,20 +167,47 @@ if __name__ == '__main__':
         elif (exmode=='losdm'):
             print_mpi("\nEstimating LoS DMs...\n")
             losdms(fitsname,necub,dkpc,theta0,phi0,nfixpts,1.0,1.0,1.0, los_extent_kpc) # last argument is extent of shooting LoS (in kpc), the value is in globalpars.py
+            did_work = True
+
+        elif (exmode=='axisdm'):
+            print_mpi("\nEstimating axis aligned LoS DMs...\n")
+            axislosdms(fitsname,necub,dkpc,theta0,phi0,los_extent_kpc)
+            did_work = True
+
+        elif (exmode=='dmmap'):
+            print_mpi("\nMaking parallel beam DM maps...\n")
+            dmmaps(fitsname,necub,dkpc,theta0,phi0,viewdirs(theta0,phi0,mapincs))
+            did_work = True
+
+        elif (exmode=='atlas'):
+            if not is_atlas_current(atlas_filename, datadir + fitsname + '.fits'):
+                print_mpi("\nBuilding DM atlas...\n")
+                dmatlas(fitsname,necub,dkpc,theta0,phi0)
+                did_work = True
+            else:
+                print_mpi(f"\nUsing existing DM atlas {atlas_filename}\n")
+
+        elif (exmode=='voxidx'):
+            print_mpi("\nBuilding voxel index...\n")
+            voxindex(fitsname,necub,dkpc,theta0,phi0)
+            did_work = True
 
         elif (exmode=='pltdm'):
             print_mpi("\nPloting LoS DMs...\n")
             plotdms(fitsname,nfixpts,1.0,1.0,1.0,scalekpc)
+            did_work = True
 
         elif (exmode=='dmscat'):
             print_mpi("\nPloting LoS DMs...\n")
             plotdm2d(fitsname,nfixpts,1.0,1.0,1.0,scalekpc)
+            did_work = True
 
         else:
             print_mpi("\nHmm...What mode is that again...?\n")
 
         plt.show(block=False)
         print_mpi('This snapshots completed in %s' % timedelta(seconds=(datetime.now() - start_time_this_snapshot).seconds))
+        if did_work: record_cost('gethostdm_all', this_sim[1], this_sim[0], (datetime.now() - start_time_this_snapshot).total_seconds(), stage=exmode, cube_ncells=necub.shape[0] if necub is not None else None, nfixpts=nfixpts)
 
     # -----------------------------------------------------------------------------------
     if ncores > 1: print_master('Parallely: time taken for ' + str(total_snaps) + ' snapshots with ' + str(ncores) + ' cores was %s' % timedelta(seconds=(datetime.now() - start_time).seconds))
@@ -15,6 +15,15 @@ plotdir     =   root_dir + "plots/"        #   Location of the LoS DMs
 plotradial  =   plotdir + "radial_profiles/"                   # 
 
 los_extent_kpc = 100        # this is the extent (in kpc) till which LoS sampling is done
+loschunk    =   1024                # Number of LoS integrated together in one vectorised chunk (bounds the memory use)
+losmethod   =   'nearest'           # LoS integrator: 'nearest' (nearest pixel stepping, as intnelos) or 'exact' (voxel traversal weighted by path length)
+losnproc    =   1                   # Number of processes sharing one ne cube (in shared memory) for LoS integration; 1 means serial
+cumslab     =   32                  # Number of cube planes read together while building the prefix-sum (axis DM) index
+mapslab     =   16                  # Number of planes along the beam resampled together for the DM maps
+mapincs     =   [0.0,15.0,30.0,45.0,60.0,75.0,90.0]                #   Viewing inclinations (deg) of the parallel beam DM maps
+atlasndirs  =   64                  # Number of viewing directions (Fibonacci grid over the hemisphere) in the per snapshot DM atlas
+profchunk   =   4096                # Number of radial directions gathered together in neprofinc (bounds the memory use)
+voxdinc     =   0.5                 # Inclination resolution (deg) of the uint8 inclination codes in the voxel index
 
 impbinegs   =   np.array([0,1,2,4,8,16,32,64,128])              #   Impact parameter bins
 maxdmcol    =   205.0                                             #   Maximum DM for colour scale
@@ -24,6 +33,7 @@ maximpa     =   100.0               #   Maximum value of impact factor in units
 incvals     =   [5.0,45.0,85.0]                                   #   Central values of inclination bins in deg
 dinc        =   10.0                                              #   Width of the inclination bins in deg
 radbins     =   [0, 1, 2, 4, 8, 16, 32, 64, 128]                #   Radial )bin edges (in kpc)
+neskedges   =   np.logspace(-12, 3, 1501)                         #   Fixed log bin edges (cm^-3, 0.01 dex wide) of the streaming ne percentile sketch
 dm_ticks    =   [1, 3, 10, 30, 100, 300]
 
 clist       =   ['b', 'r', 'k']
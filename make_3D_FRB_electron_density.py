@@ -11,6 +11,9 @@
                  run make_3D_FRB_electron_density.py --system ayan_hd --halo 4123 --res 1 --upto_kpc 10 --output RD0038 --clobber --plot_3d --use_cen_smoothed
                  run make_3D_FRB_electron_density.py --system ayan_hd --halo 8508 --res 1 --upto_kpc 200 --output RD0030,RD0042 --clobber --use_cen_smoothed
                  run make_3D_FRB_electron_density.py --system ayan_local --halo 8508 --res 0.5 --upto_kpc 100 --output RD0027 --clobber --use_cen_smoothed --do_only_plot
+                 run make_3D_FRB_electron_density.py --system ayan_pleiades --halo 8508 --res 0.5 --upto_kpc 200 --do_all_sims --use_cen_smoothed --slab_ncells 50 --check_slab_frb
+                 run make_3D_FRB_electron_density.py --system ayan_hd --halo 4123 --res 1 --upto_kpc 10 --output RD0038 --clobber --use_cen_smoothed --frb_quants el_density,density,temp,metal
+                 run make_3D_FRB_electron_density.py --system ayan_hd --halo 4123 --res 1 --upto_kpc 10 --output RD0038 --clobber --use_cen_smoothed --yt_proj
 """
 from foggie_header import *
 from yt.visualization.fits_image import FITSImageData
@@ -19,42 +22,194 @@ plt.rcParams['axes.linewidth'] = 1
 
 start_time = datetime.now()
 
-# -----------------------------------------------------------------------------
-def get_sfr_df(args):
+# --------------------------------------------------------------------------
+def xyz_to_fits_layout(data):
     '''
-    Reads in the dataframe that contains SFR of each snapshot of a given halo
-    Returns pandas dataframe
+    Function to lay out a 3D FRB indexed [x, y, z] (as yt arbitrary grids are) the way it is stored in the fits file, i.e. as FITSImageData writes yt arrays: transposed, so that fits axes 1, 2, 3 are x, y, z
+    The transpose is its own inverse, so this also takes the fits data back to [x, y, z]
+    Returns a view of the data
     '''
-    sfr_filename = args.code_path + 'halo_infos/00' + args.halo + '/' + args.run + '/sfr'
-    if os.path.exists(sfr_filename):
-        print('Reading SFR history from', sfr_filename)
-        sfr_df = pd.read_table(sfr_filename, names=('output', 'redshift', 'sfr'), comment='#', delim_whitespace=True)
-    else:
-        print('Did not find', sfr_filename, ', therefore will not include SFR')
-        sfr_df = pd.DataFrame()
+    return data.T
+
+# --------------------------------------------------------------------------
+def get_frb_header(data, quant, norm_L, sfr, log_mstar, args):
+    '''
+    Function to make the FITS header of the 3D FRB of a given quantity, given the FRB (or a slab of it)
+    Returns header, and the FITSImageData it belongs to
+    '''
+    img_hdu = FITSImageData(data, ('gas', quant_dict[quant][1]))
+    header = img_hdu[0].header     
+    
+    for ind in range(3):
+        header[f'CDELT{ind+1}'] = args.kpc_per_pix
+        header[f'CUNIT{ind+1}'] = 'kpc'
+        header[f'NORMAL_UNIT_VECTOR{ind+1}'] = norm_L[ind]
 
-    return sfr_df
+    header[f'SFR'] = 'NaN' if np.isnan(sfr) else sfr
+    header[f'SFRUNIT'] = 'Msun/yr'
 
-# -----------------------------------------------------------------------------
-def get_AM_vector(ds, radius_kpc=15., use_particles='young_stars'):
+    header[f'LOG_MSTAR'] = 'NaN' if np.isnan(log_mstar) else log_mstar
+    header[f'MSTARUNIT'] = 'Msun'
+
+    header[f'REDSHIFT'] = args.current_redshift
+
+    return header, img_hdu
+
+# --------------------------------------------------------------------------
+def deposit_frb_slabwise(ds, box, quant_arr, fitsname, norm_L, sfr, log_mstar, args):
     '''
-    Computes the orientation vector of angular momentum of the disk, in the given dataset, considering young star particles
-    Based on foggie_load()
-    Returns the unit vector as a list
+    Function to deposit the 3D FRBs of all given quantities in slabs of args.slab_ncells cells, reading the AMR cells of each slab once for all quantities
+    Slabs are along z, because the fits data is laid out as FITSImageData writes the whole box, i.e. the (x, y, z) yt array transposed, so that z is numpy axis 0 (the slowest varying)
+    and each transposed slab can be appended contiguously
+    Each quantity's slabs are streamed in to its own temporary file next to fitsname, to be copied in to the fits file by stream_frb_to_fits()
+    Peak memory is bounded by the slab, i.e. slab_ncells x ncells^2 cells per quantity, instead of ncells^3
+    Returns dictionary of, for each quantity, the temporary filename, fits header and the FRB summed along the last axis (i.e. what plot_proj_frb needs)
     '''
-    start_time = datetime.now()
+    cell_width = (box.right_edge[0] - box.left_edge[0]) / args.ncells
+    fields = [('gas', quant_dict[quant][0]) for quant in quant_arr]
+    frb_dict = {quant: {'tmpfile': fitsname + f'.{quant}.tmp', 'header': None, 'data_proj': np.zeros((args.ncells, args.ncells), dtype=np.float64)} for quant in quant_arr}
+    file_handles = {quant: open(frb_dict[quant]['tmpfile'], 'wb') for quant in quant_arr}
+
+    try:
+        for start in range(0, args.ncells, args.slab_ncells):
+            nslab = min(args.slab_ncells, args.ncells - start)
+            myprint(f'Depositing slab of {nslab} cells starting at cell {start} out of {args.ncells}, for {len(quant_arr)} quantities..', args)
+            slab_left_edge, slab_right_edge = box.left_edge.copy(), box.right_edge.copy()
+            slab_left_edge[2] = box.left_edge[2] + start * cell_width
+            slab_right_edge[2] = box.left_edge[2] + (start + nslab) * cell_width
+
+            slab_grid = ds.arbitrary_grid(left_edge=slab_left_edge, right_edge=slab_right_edge, dims=[args.ncells, args.ncells, nslab])
+            slab_grid.get_data(fields) # one pass over the AMR cells for all fields
+
+            for quant, field in zip(quant_arr, fields):
+                slab = slab_grid[field].in_units(quant_dict[quant][2]).astype(np.float32)
+                if frb_dict[quant]['header'] is None: frb_dict[quant]['header'], _ = get_frb_header(slab, quant, norm_L, sfr, log_mstar, args)
+                slab = np.asarray(slab)
+                np.ascontiguousarray(xyz_to_fits_layout(slab)).tofile(file_handles[quant])
+                frb_dict[quant]['data_proj'] += np.sum(slab, axis=2)
+            del slab_grid, slab
+    finally:
+        for file_handle in file_handles.values(): file_handle.close()
+
+    return frb_dict
 
-    print('Starting to derive angular momentum vector. This can take a while..')
-    sphere = ds.sphere(ds.halo_center_kpc, (radius_kpc, 'kpc'))
-    if use_particles == 'gas' or use_particles == False:
-        L = sphere.quantities.angular_momentum_vector(use_gas=True, use_particles=False)
-    else:
-        L = sphere.quantities.angular_momentum_vector(use_gas=False, use_particles=True, particle_type=use_particles)
-    print('Completed deriving angular momentum vector, in %s'% timedelta(seconds=(datetime.now() - start_time).seconds))
-    norm_L = L / np.sqrt((L ** 2).sum())
-    norm_L = np.array(norm_L.value)
+# --------------------------------------------------------------------------
+def get_full_frb_header(header, args):
+    '''
+    Function to turn the FITS header made from one slab of the 3D FRB (by get_frb_header) in to that of the full ncells^3 cube
+    The reference pixel and value of the axis along which the slabs were cut are taken from an axis that already spans the full cube, since the cube has equal cells along all axes
+    Returns header
+    '''
+    header = header.copy()
+    full_axis = [ind + 1 for ind in range(3) if header.get(f'NAXIS{ind + 1}') == args.ncells][0]
+    for ind in range(3):
+        header[f'NAXIS{ind + 1}'] = args.ncells
+        for key in ['CRPIX', 'CRVAL']:
+            if f'{key}{full_axis}' in header: header[f'{key}{ind + 1}'] = header[f'{key}{full_axis}']
+
+    return header
+
+# --------------------------------------------------------------------------
+def stream_frb_to_fits(frb_info, fitsname, args):
+    '''
+    Function to copy a 3D FRB deposited by deposit_frb_slabwise() from its temporary file in to the fits file, slab by slab, via a StreamingHDU
+    The FRB is added as a new HDU to fitsname (as the primary HDU if the file does not exist yet); the temporary file is then deleted
+    Returns nothing
+    '''
+    header_template = np.zeros((1, args.ncells, args.ncells), dtype=np.float32)
+    if os.path.exists(fitsname): header = fits.ImageHDU(data=header_template, header=get_full_frb_header(frb_info['header'], args)).header
+    else: header = fits.PrimaryHDU(data=header_template, header=get_full_frb_header(frb_info['header'], args)).header
+    header['NAXIS3'] = args.ncells # the template only has one plane along numpy axis 0, i.e. the last fits axis
+
+    streaming_hdu = fits.StreamingHDU(fitsname, header)
+    with open(frb_info['tmpfile'], 'rb') as file_handle:
+        for start in range(0, args.ncells, args.slab_ncells):
+            nslab = min(args.slab_ncells, args.ncells - start)
+            slab = np.fromfile(file_handle, dtype=np.float32, count=nslab * args.ncells * args.ncells).reshape((nslab, args.ncells, args.ncells))
+            streaming_hdu.write(slab)
+    streaming_hdu.close()
+    os.remove(frb_info['tmpfile'])
+
+    return
 
-    return norm_L
+# --------------------------------------------------------------------------
+def check_slab_frb(ds, box, quant_arr, fitsname, norm_L, sfr, log_mstar, args, ncells=16, slab_ncells=5):
+    '''
+    Function to check that the slab wise (streamed) 3D FRBs are identical to the whole box ones, data and WCS, on a small FRB of ncells^3 cells (the box is the same, only the resolution is coarser)
+    Raises ValueError if they are not
+    Returns nothing
+    '''
+    check_args = copy.copy(args)
+    check_args.ncells, check_args.slab_ncells = ncells, slab_ncells
+    check_args.kpc_per_pix = args.kpc_per_pix * args.ncells / ncells
+    checkname = fitsname + '.check'
+    if os.path.exists(checkname): os.remove(checkname)
+
+    all_data = ds.arbitrary_grid(left_edge=box.left_edge, right_edge=box.right_edge, dims=[ncells, ncells, ncells])
+    frb_dict = deposit_frb_slabwise(ds, box, quant_arr, checkname, norm_L, sfr, log_mstar, check_args)
+    try:
+        for quant in quant_arr:
+            FRB = all_data[('gas', quant_dict[quant][0])].in_units(quant_dict[quant][2]).astype(np.float32)
+            header, img_hdu = get_frb_header(FRB, quant, norm_L, sfr, log_mstar, check_args)
+            stream_frb_to_fits(frb_dict[quant], checkname, check_args)
+            with fits.open(checkname) as hdul:
+                if not np.allclose(hdul[-1].data, img_hdu[0].data, rtol=1e-5, equal_nan=True): raise ValueError(f'Slab wise 3D FRB of {quant} differs from the whole box one')
+                for key in [f'{key}{ind + 1}' for key in ['NAXIS', 'CRPIX', 'CRVAL', 'CDELT'] for ind in range(3)]:
+                    if hdul[-1].header.get(key) != img_hdu[0].header.get(key): raise ValueError(f'Slab wise 3D FRB of {quant} has {key} = {hdul[-1].header.get(key)}, but the whole box one has {img_hdu[0].header.get(key)}')
+            myprint(f'Slab wise 3D FRB of {quant} matches the whole box one, on {ncells}^3 cells', args)
+    finally:
+        for quant in quant_arr:
+            if os.path.exists(frb_dict[quant]['tmpfile']): os.remove(frb_dict[quant]['tmpfile'])
+        if os.path.exists(checkname): os.remove(checkname)
+
+    return
+
+# --------------------------------------------------------------------------
+def get_projections_from_frb(frb, quant, norm_L, plot_width, ncell_buff, ds, args, depth_chunk=8):
+    '''
+    Function to make the face on and edge on projected maps of a given quantity from its 3D FRB, by rotating and summing in numpy, instead of with yt
+    The orientations are the same as in plot_projection_diskrel(): face on looks along norm_L with x (made orthogonal to norm_L) as north, edge on looks along x with norm_L as north, and east = north x normal as in yt
+    The FRB is taken in its fits file layout (see xyz_to_fits_layout), whether it is the data about to be written or read back from the file, so that both paths share one axis convention
+    It can be in memory or memory mapped from the fits file, since only the part of it around each chunk of depth_chunk planes is read at a time
+    Returns face on and edge on maps, in the projection units of quant_dict, indexed as [north, east] like the yt FRBs
+    '''
+    frb = xyz_to_fits_layout(frb) # indexed [x, y, z] from here on, like norm_L
+    x = np.array([1., 0., 0.])  # take a random vector
+    x -= x.dot(norm_L) * norm_L  # make it orthogonal to L
+    x /= np.linalg.norm(x)  # normalize it
+
+    ncells = frb.shape[0]
+    cell_width = 2 * args.galrad / ncells # kpc
+    pix_width = plot_width / ncell_buff # kpc
+    ndepth = int(np.ceil(np.sqrt(3) * ncells)) # enough planes, one cell apart, to cross the whole box along any direction
+    unit_factor = ds.quan(cell_width, f'({quant_dict[quant][2]})*kpc').in_units(quant_dict[quant][8]).v
+    
+    offsets = (np.arange(ncell_buff) + 0.5 - ncell_buff / 2) * pix_width / cell_width # in cells
+    east_offsets, north_offsets = np.meshgrid(offsets, offsets, indexing='xy') # [north, east] ordering
+    centre_index = ncells / 2 - 0.5 # cell centres are at integer indices
+
+    data_proj_list = []
+    for normal, north in [(norm_L, x), (x, norm_L)]:
+        east = np.cross(north, normal)
+        data_proj = np.zeros((ncell_buff, ncell_buff), dtype=np.float64)
+
+        for start in range(0, ndepth, depth_chunk):
+            depths = np.arange(start, min(start + depth_chunk, ndepth)) - ndepth / 2 + 0.5 # in cells
+            coords = centre_index + east[:, None, None, None] * east_offsets + north[:, None, None, None] * north_offsets + normal[:, None, None, None] * depths[:, None, None]
+            
+            lower = np.clip(np.floor(coords.reshape(3, -1).min(axis=1)).astype(int), 0, ncells - 1)
+            upper = np.clip(np.ceil(coords.reshape(3, -1).max(axis=1)).astype(int) + 1, 1, ncells)
+            if np.any(upper <= lower): continue # this chunk of depth is entirely outside the box
+            
+            block = np.asarray(frb[lower[0]:upper[0], lower[1]:upper[1], lower[2]:upper[2]], dtype=np.float32)
+            samples = map_coordinates(block, coords - lower[:, None, None, None], order=1, mode='constant', cval=0.)
+            data_proj += np.sum(samples, axis=0)
+
+        data_proj_list.append(data_proj * unit_factor)
+
+    data_faceon, data_edgeon = data_proj_list
+
+    return data_faceon, data_edgeon
 
 # --------------------------------------------------------------------------
 def plot_3d_frb(data, ax, args, label=None, unit=None, clim=None,  cmap='viridis'):
@@ -231,6 +386,8 @@ def plot_projection_diskrel(box, field, box_width, norm_L, args, quant_label='de
 # ---------------global dictionary--------------------------
 quant_dict = {'density':['density', 'Gas density', 'Msun/pc**3', -2.5, 2.5, 'cornflowerblue', density_color_map, True, 'Msun/pc**2', r'Gas density [M$_\odot$ pc$^{-2}$]'], 
               'el_density':['El_number_density', 'Electron density', 'cm**-3', 0, 220, 'cornflowerblue', 'viridis', False, 'pc*cm**-3', r'DM [pc cm$^{-3}$]'],
+              'temp':['temperature', 'Gas temperature', 'K', 3, 7, 'cornflowerblue', temperature_color_map, True, 'K*kpc', r'Temperature [K kpc]'],
+              'metal':['metallicity', 'Gas metallicity', 'Zsun', -1.7, 0.7, 'cornflowerblue', metal_color_map, True, 'Zsun*kpc', r'Z/Z$_\odot$ [kpc]'],
               } # for each quantity: [yt field, label in plots, units, lower limit in log, upper limit in log, color for scatter plot, colormap, whether to take log, units for projection plot, units to display in projection plot]
 
 # -----main code-----------------
@@ -238,12 +395,12 @@ if __name__ == '__main__':
     args = parse_args()
     if not args.keep: plt.close('all')
 
-    quant_arr = ['el_density', 'density']
+    quant_arr = args.frb_quants.split(',')
+    if any([quant not in quant_dict for quant in quant_arr]): sys.exit(f'Only the quantities {list(quant_dict.keys())} are available for --frb_quants')
 
     # ------------reading SFR and mstar df-----------------
-    sfr_df  = get_sfr_df(args)
     smooth_over_snap = 20
-    sfr_df[f'sfr_smooth{smooth_over_snap}'] = sfr_df['sfr'].rolling(window=smooth_over_snap, center=True).mean()
+    sfr_df  = get_sfr_df(args, smooth_over_nsnap_arr=[smooth_over_snap])
 
     # --------domain decomposition; for mpi parallelisation-------------
     if args.do_all_sims: list_of_sims = get_all_sims_for_this_halo(args) # all snapshots of this particular halo
@@ -256,31 +413,21 @@ if __name__ == '__main__':
     print_master('Total number of MPI ranks = ' + str(ncores) + '. Starting at: {:%Y-%m-%d %H:%M:%S}'.format(datetime.now()), args)
     comm.Barrier() # wait till all cores reached here and then resume
 
-    split_at_cpu = total_snaps - ncores * int(total_snaps/ncores)
-    nper_cpu1 = int(total_snaps / ncores)
-    nper_cpu2 = nper_cpu1 + 1
-    if rank < split_at_cpu:
-        core_start = rank * nper_cpu2
-        core_end = (rank+1) * nper_cpu2 - 1
-    else:
-        core_start = split_at_cpu * nper_cpu2 + (rank - split_at_cpu) * nper_cpu1
-        core_end = split_at_cpu * nper_cpu2 + (rank - split_at_cpu + 1) * nper_cpu1 - 1
-
     # -------------loop over snapshots-----------------
-    print_mpi('Operating on snapshots ' + str(core_start + 1) + ' to ' + str(core_end + 1) + ', i.e., ' + str(core_end - core_start + 1) + ' out of ' + str(total_snaps) + ' snapshots', args)
+    print_master('Handing out ' + str(total_snaps) + ' snapshots dynamically across MPI ranks, most expensive first', args)
 
-    for index in range(core_start + args.start_index, core_end + 1):
+    for index in mpi_snapshot_loop(list_of_sims, start_index=args.start_index, cost_func=get_cost_func('make_3D_FRB_electron_density')):
         start_time_this_snapshot = datetime.now()
         this_sim = list_of_sims[index]
         args.output = this_sim[1]
-        print_mpi('Doing snapshot ' + this_sim[1] + ' of halo ' + this_sim[0] + ' which is ' + str(index + 1 - core_start) + ' out of the total ' + str(core_end - core_start + 1) + ' snapshots...', args)
+        print_mpi('Doing snapshot ' + this_sim[1] + ' of halo ' + this_sim[0] + ' which is ' + str(index + 1) + ' out of the total ' + str(total_snaps) + ' snapshots...', args)
 
         # -------loading in snapshot-------------------
         halos_df_name = args.code_path + 'halo_infos/00' + this_sim[0] + '/' + args.run + '/'
         halos_df_name += 'halo_cen_smoothed' if args.use_cen_smoothed else 'halo_c_v'
         ds, refine_box = load_sim(args, region='refine_box', do_filter_particles=True, disk_relative=False, halo_c_v_name=halos_df_name)
 
-        norm_L = get_AM_vector(ds) #computing disk orientation #
+        norm_L = get_AM_vector(ds, args=args) #computing disk orientation #
         #norm_L = np.array([-0.51443095, -0.62174905, -0.59058354]) # this is just for faster testing; this is for halo 8505 snap RD0027
 
         # --------assigning additional keyword args-------------
@@ -293,11 +440,11 @@ if __name__ == '__main__':
         args.fontsize = 15
 
         # -----------determining SFR amd stellar mass--------------------
-        try: sfr = sfr_df[sfr_df['output'] == args.output][f'sfr_smooth{smooth_over_snap}'].values[0]
-        except: sfr = -99
+        sfr_values = get_snapshot_sfr(sfr_df, args.output, cols=[f'sfr_smooth{smooth_over_snap}'])
+        sfr = -99 if sfr_values is None else sfr_values[0]
 
         if args.do_only_plot: args.diskrad, log_mstar = np.nan, np.nan
-        else: args.diskrad, log_mstar = get_stellar_mass(args, refine_box=refine_box)
+        else: args.diskrad, log_mstar = get_stellar_mass_from_particles(args, refine_box=refine_box)
         #else: args.diskrad, log_mstar = 5, 10.46  # this is just for faster testing; this is for halo 8505 snap RD0027
 
         # --------determining corresponding text suffixes and figname-------------
@@ -338,7 +485,18 @@ if __name__ == '__main__':
                     fig.subplots_adjust(top=0.88, bottom=0.12, left=0.07, right=0.92, wspace=0.4 if args.plot_3d else 0.02, hspace=0.)
 
                 # -------making and plotting the 3D FRBs--------------
-                all_data = ds.arbitrary_grid(left_edge=box.left_edge, right_edge=box.right_edge, dims=[args.ncells, args.ncells, args.ncells])
+                start_time_deposit = datetime.now()
+                if args.do_only_plot:
+                    myprint('Not making the 3D FRBs because --do_only_plot was used', args)
+                elif args.slab_ncells is None:
+                    all_data = ds.arbitrary_grid(left_edge=box.left_edge, right_edge=box.right_edge, dims=[args.ncells, args.ncells, args.ncells])
+                    all_data.get_data([('gas', quant_dict[quant][0]) for quant in quant_arr]) # one pass over the AMR cells for all quantities
+                else:
+                    if args.check_slab_frb: check_slab_frb(ds, box, quant_arr, fitsname, norm_L, sfr, log_mstar, args)
+                    partname = fitsname + '.part' # fits file being streamed in to; renamed once complete
+                    if os.path.exists(partname): os.remove(partname)
+                    frb_dict = deposit_frb_slabwise(ds, box, quant_arr, fitsname, norm_L, sfr, log_mstar, args)
+                time_deposit = (datetime.now() - start_time_deposit).total_seconds()
                 img_hdu_list = []
 
                 plot_width = box_width/5
@@ -349,40 +507,34 @@ if __name__ == '__main__':
                     myprint(f'Making and plotting FRB for {quant} which is {index+1} out of {len(quant_arr)} quantities..', args)
 
                     # --------making the projection plots------------
-                    fig_diskrel, data_faceon, data_edgeon = plot_projection_diskrel(box, quant_dict[quant][0], plot_width, norm_L, args, 
-                                                            quant_label=quant_dict[quant][0], 
-                                                            unit=quant_dict[quant][8], 
-                                                            clim=[quant_dict[quant][3], quant_dict[quant][4]] if quant_dict[quant][3] is not None else None,  
-                                                            cmap=quant_dict[quant][6], 
-                                                            takelog=quant_dict[quant][7], 
-                                                            clabel=quant_dict[quant][9],
-                                                            annotate_labels = [rf'SFR = {sfr:.1f} M$_\odot$/yr', rf'$\log$ (M$_*$/M$_\odot$) = {log_mstar:.1f}'],
-                                                            return_frb=True,
-                                                            do_plot=True,
-                                                            ncell_buff = ncell_buff,
-                                                            )
+                    if args.yt_proj or args.do_only_plot:
+                        fig_diskrel, data_faceon, data_edgeon = plot_projection_diskrel(box, quant_dict[quant][0], plot_width, norm_L, args, 
+                                                                quant_label=quant_dict[quant][0], 
+                                                                unit=quant_dict[quant][8], 
+                                                                clim=[quant_dict[quant][3], quant_dict[quant][4]] if quant_dict[quant][3] is not None else None,  
+                                                                cmap=quant_dict[quant][6], 
+                                                                takelog=quant_dict[quant][7], 
+                                                                clabel=quant_dict[quant][9],
+                                                                annotate_labels = [rf'SFR = {sfr:.1f} M$_\odot$/yr', rf'$\log$ (M$_*$/M$_\odot$) = {log_mstar:.1f}'],
+                                                                return_frb=True,
+                                                                do_plot=True,
+                                                                ncell_buff = ncell_buff,
+                                                                )
                     # --------making the 3D FRB------------
                     if not args.do_only_plot:
-                        FRB = all_data[('gas', quant_dict[quant][0])].in_units(quant_dict[quant][2]).astype(np.float32)
-
-                        # --------making the FITS ImageHDU for 3D FRB---------------
-                        img_hdu = FITSImageData(FRB, ('gas', quant_dict[quant][1]))
-                        header = img_hdu[0].header     
-                        
-                        for ind in range(3):
-                            header[f'CDELT{ind+1}'] = args.kpc_per_pix
-                            header[f'CUNIT{ind+1}'] = 'kpc'
-                            header[f'NORMAL_UNIT_VECTOR{ind+1}'] = norm_L[ind]
-
-                        header[f'SFR'] = 'NaN' if np.isnan(sfr) else sfr
-                        header[f'SFRUNIT'] = 'Msun/yr'
-
-                        header[f'LOG_MSTAR'] = 'NaN' if np.isnan(log_mstar) else log_mstar
-                        header[f'MSTARUNIT'] = 'Msun'
-
-                        header[f'REDSHIFT'] = args.current_redshift
-                        
-                        img_hdu_list.append(img_hdu[0])
+                        if args.slab_ncells is None:
+                            FRB = all_data[('gas', quant_dict[quant][0])].in_units(quant_dict[quant][2]).astype(np.float32)
+
+                            # --------making the FITS ImageHDU for 3D FRB---------------
+                            header, img_hdu = get_frb_header(FRB, quant, norm_L, sfr, log_mstar, args)
+                            img_hdu_list.append(img_hdu[0])
+                            if not args.yt_proj: data_faceon, data_edgeon = get_projections_from_frb(img_hdu[0].data, quant, norm_L, plot_width, ncell_buff, ds, args)
+                        else:
+                            # --------streaming the 3D FRB in to the fits file, slab by slab---------------
+                            stream_frb_to_fits(frb_dict[quant], partname, args)
+                            FRB_proj = frb_dict[quant]['data_proj']
+                            if not args.yt_proj:
+                                with fits.open(partname, memmap=True) as hdul: data_faceon, data_edgeon = get_projections_from_frb(hdul[-1].data, quant, norm_L, plot_width, ncell_buff, ds, args) # read back from disk, a chunk at a time
                         
                         # --------making the FITS ImageHDU for 2D projected FRB: face on---------------                    
                         hdu_faceon = FITSImageData(data_faceon, f'{quant_dict[quant][1]} FACE ON PROJ')
@@ -393,7 +545,8 @@ if __name__ == '__main__':
                             header[f'CDELT{ind+1}'] = kpc_per_pix_proj
                             header[f'CUNIT{ind+1}'] = 'kpc'
                         
-                        img_hdu_list.append(hdu_faceon[0])
+                        if args.slab_ncells is None: img_hdu_list.append(hdu_faceon[0])
+                        else: fits.append(partname, hdu_faceon[0].data, hdu_faceon[0].header)
 
                         # --------making the FITS ImageHDU for 2D projected FRB: face on---------------
                         hdu_edgeon = FITSImageData(data_edgeon, f'{quant_dict[quant][1]} EDGE ON PROJ')
@@ -404,20 +557,26 @@ if __name__ == '__main__':
                             header[f'CDELT{ind+1}'] = kpc_per_pix_proj
                             header[f'CUNIT{ind+1}'] = 'kpc'
                         
-                        img_hdu_list.append(hdu_edgeon[0])
+                        if args.slab_ncells is None: img_hdu_list.append(hdu_edgeon[0])
+                        else: fits.append(partname, hdu_edgeon[0].data, hdu_edgeon[0].header)
 
                         # ------making the plots-----------
                         if args.plot_3d or args.plot_proj:
                             ax = fig.add_subplot(1, len(quant_arr), index + 1, projection='3d' if args.plot_3d else None)
-                            if args.plot_3d: ax = plot_3d_frb(FRB, ax, args, label=quant_dict[quant][1], unit=quant_dict[quant][2], clim=[quant_dict[quant][3], quant_dict[quant][4]], cmap=quant_dict[quant][6])
+                            if args.slab_ncells is not None: FRB = FRB_proj[:, :, np.newaxis] # only the projection is kept in slab mode, which is what plot_proj_frb sums to
+                            if args.plot_3d and args.slab_ncells is None: ax = plot_3d_frb(FRB, ax, args, label=quant_dict[quant][1], unit=quant_dict[quant][2], clim=[quant_dict[quant][3], quant_dict[quant][4]], cmap=quant_dict[quant][6])
+                            elif args.plot_3d: myprint('Cannot make 3D plot with --slab_ncells, because the full 3D FRB is never in memory', args)
                             elif args.plot_proj: ax = plot_proj_frb(FRB, ax, args, label=quant_dict[quant][1], unit=quant_dict[quant][2], clim=[quant_dict[quant][3], quant_dict[quant][4]], cmap=quant_dict[quant][6], hidey=index > 0)
 
                 # ------saving fits file------------------
                 if not args.do_only_plot:
-                    primary = fits.PrimaryHDU(header=img_hdu_list[0].header, data=img_hdu_list[0].data)
-                    combined_img_hdu = fits.HDUList([primary] + [fits.ImageHDU(h.data, header=h.header) for h in img_hdu_list[1:]])
+                    if args.slab_ncells is None:
+                        primary = fits.PrimaryHDU(header=img_hdu_list[0].header, data=img_hdu_list[0].data)
+                        combined_img_hdu = fits.HDUList([primary] + [fits.ImageHDU(h.data, header=h.header) for h in img_hdu_list[1:]])
 
-                    combined_img_hdu.writeto(fitsname, overwrite=args.clobber)
+                        combined_img_hdu.writeto(fitsname, overwrite=args.clobber)
+                    else:
+                        os.replace(partname, fitsname)
                     myprint('Saved fits file as ' + fitsname, args)
 
                     # ------saving fig------------------
@@ -427,6 +586,12 @@ if __name__ == '__main__':
 
                 if not ('pleiades' in args.system or args.hide_plot): plt.show(block=False)
                 print_mpi('This snapshots completed in %s' % timedelta(seconds=(datetime.now() - start_time_this_snapshot).seconds), args)
+
+                # ------recording the cost of this snapshot, for the scheduler and submit_jobs.py------------------
+                if not args.do_only_plot:
+                    cost_features = dict(ncells_sim=int(ds.index.grid_dimensions.prod(axis=1).sum()), redshift=args.current_redshift, cube_ncells=args.ncells)
+                    record_cost('make_3D_FRB_electron_density', this_sim[0], this_sim[1], time_deposit, stage='deposit', **cost_features)
+                    record_cost('make_3D_FRB_electron_density', this_sim[0], this_sim[1], (datetime.now() - start_time_this_snapshot).total_seconds(), **cost_features)
             
             except Exception as e:
                 print_mpi('Skipping ' + this_sim[1] + ' because ' + str(e), args)
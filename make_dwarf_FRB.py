@@ -15,7 +15,7 @@
                  run make_dwarf_FRB.py --system ayan_pleiades --foggie_dir /nobackupp19/aachary2/LowZRuns/ --halo 5016 --run 2520_6 --output DD1995 --upto_kpc 50 --res 0.5
 """
 from foggie_header import *
-from make_3D_FRB_electron_density import plot_projection_diskrel, get_AM_vector, FITSImageData
+from make_3D_FRB_electron_density import plot_projection_diskrel, FITSImageData
 from get_foggie_metallicity_profile import my_foggie_load, get_halo_coords
 start_time = datetime.now()
 
@@ -84,7 +84,7 @@ if __name__ == '__main__':
         box = ds.r[box_center[0] - box_width_kpc / 2.: box_center[0] + box_width_kpc / 2., box_center[1] - box_width_kpc / 2.: box_center[1] + box_width_kpc / 2., box_center[2] - box_width_kpc / 2.: box_center[2] + box_width_kpc / 2.]
 
         # ----------------making projection plots-------------------
-        norm_L = get_AM_vector(ds, radius_kpc=3., use_particles=False)
+        norm_L = get_AM_vector(ds, radius_kpc=3., use_particles=False, args=args)
 
         # -------making and plotting the 3D FRBs--------------
         all_data = ds.arbitrary_grid(left_edge=box.left_edge, right_edge=box.right_edge, dims=[args.ncells, args.ncells, args.ncells])
@@ -58,20 +58,10 @@ if __name__ == '__main__':
     print_master('Total number of MPI ranks = ' + str(ncores) + '. Starting at: {:%Y-%m-%d %H:%M:%S}'.format(datetime.datetime.now()), dummy_args)
     comm.Barrier() # wait till all cores reached here and then resume
 
-    split_at_cpu = total_snaps - ncores * int(total_snaps/ncores)
-    nper_cpu1 = int(total_snaps / ncores)
-    nper_cpu2 = nper_cpu1 + 1
-    if rank < split_at_cpu:
-        core_start = rank * nper_cpu2
-        core_end = (rank+1) * nper_cpu2 - 1
-    else:
-        core_start = split_at_cpu * nper_cpu2 + (rank - split_at_cpu) * nper_cpu1
-        core_end = split_at_cpu * nper_cpu2 + (rank - split_at_cpu + 1) * nper_cpu1 - 1
-
     # ---------------starting loop over snapshots-----------------------------------------------
-    print_mpi('Operating on snapshots ' + str(core_start + 1) + ' to ' + str(core_end + 1) + ', i.e., ' + str(core_end - core_start + 1) + ' out of ' + str(total_snaps) + ' snapshots', dummy_args)
+    print_master('Handing out ' + str(total_snaps) + ' snapshots dynamically across MPI ranks, most expensive first', dummy_args)
 
-    for index in range(core_start + dummy_args.start_index, core_end + 1):
+    for index in mpi_snapshot_loop(list_of_sims, start_index=dummy_args.start_index):
         this_sim = list_of_sims[index]
         if 'existing_halo_outputs' in locals() and this_sim[0] + '-' + this_sim[1] in existing_halo_outputs.values:
             print_mpi('Skipping ' + this_sim[0] + '-' + this_sim[1] + ' because it already exists in file', dummy_args)
@@ -79,7 +69,7 @@ if __name__ == '__main__':
 
         # -------reading in snapshot--------
         start_time_this_snapshot = time.time()
-        print_mpi('Doing snapshot ' + this_sim[1] + ' of halo ' + this_sim[0] + ' which is ' + str(index + 1 - core_start) + ' out of the total ' + str(core_end - core_start + 1) + ' snapshots...', dummy_args)
+        print_mpi('Doing snapshot ' + this_sim[1] + ' of halo ' + this_sim[0] + ' which is ' + str(index + 1) + ' out of the total ' + str(total_snaps) + ' snapshots...', dummy_args)
         halos_df_name = dummy_args.code_path + 'halo_infos/00' + this_sim[0] + '/' + dummy_args.run + '/'
         halos_df_name += 'halo_cen_smoothed' if dummy_args.use_cen_smoothed else 'halo_c_v'
         try:
@@ -120,16 +110,8 @@ if __name__ == '__main__':
         box = ds.sphere(box_center, ds.arr(args.galrad, 'kpc'))
 
         # -------read in sfr---------------
-        sfr_filename = args.code_path + 'halo_infos/00' + args.halo + '/' + args.run + '/sfr'
-        if os.path.exists(sfr_filename):
-            print('Reading SFR history from', sfr_filename)
-        else:
-            print(sfr_filename, 'not found')
-            sfr_filename = sfr_filename.replace(args.run, args.run[:14])
-            print('Instead, reading SFR history from', sfr_filename)
-
-        sfr_df = pd.read_table(sfr_filename, names=('output', 'redshift', 'sfr'), comment='#', delim_whitespace=True)
-        log_sfr = np.log10(sfr_df[sfr_df['output'] == args.output]['sfr'].values[0])
+        sfr_df = get_sfr_df(args, fallback=True) # read once per halo in this process, however many snapshots
+        log_sfr = np.log10(get_snapshot_sfr(sfr_df, args.output, cols=['sfr'])[0])
 
         # --------computing masses----------------------
         stellar_masses = box[('stars', 'particle_mass')].in_units('Msun').ndarray_view()
@@ -147,16 +129,12 @@ if __name__ == '__main__':
 
         # ---------writing df to txt file------------------
         if args.write_file:
-            if not os.path.isfile(outfilename):
-                this_df.to_csv(outfilename, sep='\t', index=None, header='column_names')
-                print(f'Written baryon masses df at {outfilename}')
-            else:
-                this_df.to_csv(outfilename, sep='\t', mode='a', index=False, header=False)
-                print('Appended baryon masses to file', outfilename)
+            append_to_shard(outfilename, this_df, rank=rank) # each rank writes to its own shard; merged at the end
+            print('Appended baryon masses to shard of', outfilename)
 
         print_mpi('This snapshots completed in %s mins' % ((time.time() - start_time_this_snapshot) / 60), dummy_args)
 
-    df = pd.read_table(outfilename)
+    if dummy_args.write_file: df = merge_shards(outfilename, key=['halo', 'output'], comm=comm)
 
     if ncores > 1: print_master('Parallely: time taken for ' + str(total_snaps) + ' snapshots with ' + str(ncores) + ' cores was %s mins' % ((time.time() - start_time) / 60), dummy_args)
     else: print_master('Serially: time taken for ' + str(total_snaps) + ' snapshots with ' + str(ncores) + ' core was %s mins' % ((time.time() - start_time) / 60), dummy_args)
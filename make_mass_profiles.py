@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+
+"""
+
+    Title :      make_mass_profiles
+    Notes :      Compute the enclosed mass profiles (as used by get_re_from_stars()) of all (or the given) snapshots of a halo in one job, instead of lazily one at a time
+    Output :     mass_profiles/<run>/<output>_masses.hdf5
+    Author :     Ayan Acharyya
+    Started :    Jan 2026
+    Examples :   run make_mass_profiles.py --system ayan_pleiades --halo 8508 --do_all_sims --use_cen_smoothed
+                 run make_mass_profiles.py --system ayan_hd --halo 4123 --output RD0030,RD0038 --use_cen_smoothed --get_gasmass --clobber
+"""
+from foggie_header import *
+
+start_time = datetime.now()
+
+# -----main code-----------------
+if __name__ == '__main__':
+    args = parse_args()
+
+    if args.do_all_sims: list_of_outputs = [item[1] for item in get_all_sims_for_this_halo(args)] # all snapshots of this particular halo
+    else: list_of_outputs = args.output_arr
+    print_master('Computing mass profiles of ' + str(len(list_of_outputs)) + ' snapshots of halo ' + args.halo, args)
+
+    tablenames = calc_masses_for_snapshots(args, list_of_outputs)
+
+    print_master('Time taken for ' + str(len(list_of_outputs)) + ' snapshots was %s' % timedelta(seconds=(datetime.now() - start_time).seconds), args)
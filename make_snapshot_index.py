@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+"""
+
+    Title :      make_snapshot_index
+    Notes :      Scan all (or the given) snapshots of a halo once, and store their metadata (redshift, time, halo centre and velocity, refine box, disk AM vector, file path)
+                 in the SQLite snapshot index, so that pull_halo_redshift(), pull_halo_center() etc. do not have to load the simulation later
+    Output :     halo_infos/00<halo>/<run>/snapshot_index.db
+    Author :     Ayan Acharyya
+    Started :    Jan 2026
+    Examples :   run make_snapshot_index.py --system ayan_pleiades --halo 8508 --do_all_sims --use_cen_smoothed
+                 run make_snapshot_index.py --system ayan_hd --halo 4123 --output RD0038 --use_cen_smoothed --clobber
+"""
+from foggie_header import *
+
+start_time = datetime.now()
+
+# -----main code-----------------
+if __name__ == '__main__':
+    args = parse_args()
+
+    if args.do_all_sims: list_of_sims = get_all_sims_for_this_halo(args) # all snapshots of this particular halo
+    else: list_of_sims = list(itertools.product([args.halo], args.output_arr))
+    total_snaps = len(list_of_sims)
+
+    # -------------loop over snapshots; serially, since the index is a single sqlite file-----------------
+    for index, this_sim in enumerate(list_of_sims):
+        start_time_this_snapshot = datetime.now()
+        args.halo, args.output = this_sim[0], this_sim[1]
+
+        if read_snapshot_meta(args) is not None and not args.clobber:
+            print('Skipping snapshot %s as it is already in %s. Use --clobber to rescan.' %(args.output, get_snapshot_index_name(args)))
+            continue
+
+        print('Doing snapshot ' + this_sim[1] + ' of halo ' + this_sim[0] + ' which is ' + str(index + 1) + ' out of the total ' + str(total_snaps) + ' snapshots...')
+        try:
+            halos_df_name = args.code_path + 'halo_infos/00' + this_sim[0] + '/' + args.run + '/'
+            halos_df_name += 'halo_cen_smoothed' if args.use_cen_smoothed else 'halo_c_v'
+            ds, refine_box = load_sim(args, region='refine_box', do_filter_particles=True, disk_relative=False, halo_c_v_name=halos_df_name)
+            norm_L = get_AM_vector(ds, args=args)
+
+            write_snapshot_meta(args, ds, refine_box, norm_L=norm_L)
+            print('Indexed snapshot ' + this_sim[1] + ' in %s' % timedelta(seconds=(datetime.now() - start_time_this_snapshot).seconds))
+
+        except Exception as e:
+            print('Skipping ' + this_sim[1] + ' because ' + str(e))
+            continue
+
+    print('Time taken for indexing ' + str(total_snaps) + ' snapshots was %s' % timedelta(seconds=(datetime.now() - start_time).seconds))
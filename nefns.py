@@ -5,11 +5,38 @@
 #
 #	Function list
 #
-#	def fitld(fitsname):
-#		Reads a FITS cube and returns a 3D numpy array and the spatial resolutions in kpc			
+#	def fitld(fitsname,fsize,doplot):
+#		Reads a FITS cube and returns a memory mapped 3D numpy array and the spatial resolutions in kpc			
+#
+#	def fitplot(necube,fsize):
+#		Plots the projections of an ne cube along each axis
 #
 #	def neprofile(necube,dkpc,theta,phi):
 #		Calculate electron density profiles along theta, phi
+#
+#	def losdmbatch(necube,dkpc,theta0,phi0,pt1s,pt2s,chunksize,method):
+#		Calculate inclination, impact factor, distance from major axis and DM of many LoS in vectorised chunks
+#
+#	def intnelosexact(necube,dkpc,xyz1,xyz2):
+#		Integrate ne along many LoS by exact voxel traversal, weighting each voxel by its path length
+#
+#	def losdmshm(necube,dkpc,theta0,phi0,pt1s,pt2s,nproc,chunksize,method):
+#		Same as losdmbatch, split across a pool of processes sharing the ne cube in shared memory
+#
+#	def necumsum(fitsname,necube,axis):
+#		Prefix-sum index of the ne cube along one axis, for constant time axis aligned DMs (axisdmseg, axisdmmap)
+#
+#	def axislosdms(fitsname,necube,dkpc,theta0,phi0,extent_kpc):
+#		Calculate DMs of all axis aligned LoS from the prefix-sum index
+#
+#	def dmmaps(fitsname,necube,dkpc,theta0,phi0,losvecs):
+#		Whole cube parallel beam DM maps along many viewing directions, each pixel tagged with its LoS geometry
+#
+#	def dmatlas(fitsname,necube,dkpc,theta0,phi0,ndirs):
+#		DM atlas of a snapshot, DM maps over a quasi uniform grid of viewing directions stored in one HDF5 file
+#
+#	def voxindex(fitsname,necube,dkpc,theta0,phi0):
+#		Radius, polar angle and inclination bin codes of every voxel, for profiles in any binning
 #	
 #	--------------------------	Import modules	---------------------------
 
@@ -20,10 +47,12 @@ from auxfns import *
 from plotdm import *
 
 #	----------------------------------------------------------------------------------------------------------
-def fitld(fitsname, fsize):	
-#	Reads a FITS cube and returns a 3D numpy array and the spatial resolutions in kpc
+def fitld(fitsname, fsize=3.2, doplot=False):	
+#	Reads a FITS cube and returns a memory mapped 3D numpy array and the spatial resolutions in kpc
+#	The cube is not read into memory; only the pixels touched later are paged in from disk
+#	Set doplot to also show the projections of the cube along each axis (fitplot)
 	
-	fitsfile	=	fits.open(datadir+fitsname+".fits")
+	fitsfile	=	fits.open(datadir+fitsname+".fits", memmap=True)
 	fitshdr		=	fitsfile[0].header
 	dxkpc		=	fitshdr['CDELT1']
 	dykpc		=	fitshdr['CDELT2']
@@ -31,13 +60,23 @@ def fitld(fitsname, fsize):
 	nvecx		=	fitshdr['HIERARCH NORMAL_UNIT_VECTOR1']
 	nvecy		=	fitshdr['HIERARCH NORMAL_UNIT_VECTOR2']
 	nvecz		=	fitshdr['HIERARCH NORMAL_UNIT_VECTOR3']
-	necube		=	fitsfile[0].data
+	necube		=	fitsfile[0].data			#	Memory map stays valid after close, as long as necube is referenced
 	fitsfile.close()
 
 	reskpc		=	(dxkpc,dykpc,dzkpc)
 	theta0		=	np.arctan2(nvecz, np.sqrt(nvecx*nvecx + nvecy*nvecy))
 	phi0		=	np.arctan2(nvecy, nvecx)
 	
+	if doplot: fitplot(necube, fsize)
+	
+	return (necube,reskpc,theta0,phi0)
+#	----------------------------------------------------------------------------------------------------------
+
+
+
+def fitplot(necube, fsize):	
+#	Plots the projections of an ne cube along each of the three axes
+
 	fig 	= plt.figure(figsize=(3*fsize, fsize))
 	ax0 		= fig.add_axes([0.05,0.10,0.31,0.88])
 	ax0.tick_params(axis="both",direction="in",bottom=True,right=True,top=True,left=True)
@@ -55,13 +94,14 @@ def fitld(fitsname, fsize):
 
 	plt.show(block=False)
 	
-	return (necube,reskpc,theta0,phi0)
+	return (fig)
 #	----------------------------------------------------------------------------------------------------------
 
 
 
-def neprofinc(necube,dkpc,dangdeg,theta0,phi0,logsm,logsfr,redshift):	
+def neprofinc(necube,dkpc,dangdeg,theta0,phi0,logsm,logsfr,redshift,chunksize=profchunk):	
 #	Calculate radial electron density profile and inclinations along many radial directions 
+#	The profiles are gathered from the cube chunksize directions at a time (neprofiles)
 	
 	dangrad	= np.deg2rad(dangdeg)
 	cenpx	= np.array(necube.shape)/2
@@ -72,14 +112,13 @@ def neprofinc(necube,dkpc,dangdeg,theta0,phi0,logsm,logsfr,redshift):
 		phis	= np.arange(0.0, 2*np.pi*np.abs(np.cos(theta))+dangrad/2.0, dangrad, dtype=np.float32)
 		incs	= np.arccos(np.sin(theta)*np.sin(theta0) + np.cos(theta)*np.cos(theta0)*np.cos(phis-phi0))
 		incs	= np.arcsin(np.sin(incs))
-		for i in range(0,len(phis)):
-			angls.append([theta,phis[i],incs[i]])			
-	angls	= np.array(angls)
+		angls.append(np.array([np.full(len(phis), theta), phis, incs], dtype=float).T)
+	angls	= np.concatenate(angls)
 	
 	nepros	= np.zeros((len(angls), len(radius)), dtype=np.float32)
 	
-	for i in range(0,len(angls)):
-		nepros[i]	= neprofile(necube,dkpc,angls[i,0],angls[i,1],cenpx,radius)	
+	for i0 in range(0, len(angls), chunksize):
+		nepros[i0:i0+chunksize]	= neprofiles(necube,dkpc,angls[i0:i0+chunksize,0],angls[i0:i0+chunksize,1],cenpx,radius)
 	
 	neres	= neradial(logsm,logsfr,redshift,theta0,phi0,radius,angls[:,0],angls[:,1],angls[:,2],nepros)
 		
@@ -88,6 +127,45 @@ def neprofinc(necube,dkpc,dangdeg,theta0,phi0,logsm,logsfr,redshift):
 
 
 
+def voxindex(fitsname,necube,dkpc,theta0,phi0,slabsize=cumslab):	
+#	Classify every voxel of the cube once by its radius, polar angle and inclination, as seen from the centre
+#	Stored as compact bin codes in fitsname_voxidx.npz, next to the FITS file:
+#		rcode	int16, radius in units of the smallest cell size (rres)
+#		thcode	uint8, polar angle theta + 90, in degrees
+#		inccode	uint8, inclination (as in neprofinc), in units of voxdinc degrees
+#	Profiles in any radius and inclination binning then follow from craft_utils.get_voxel_profiles, without resampling the cube
+
+	cenpx	= np.array(necube.shape)/2
+	rres	= np.amin(dkpc)
+	normvec	= np.array([np.cos(theta0)*np.cos(phi0), np.cos(theta0)*np.sin(phi0), np.sin(theta0)])
+
+	rcode	= np.zeros(necube.shape, dtype=np.int16)
+	thcode	= np.zeros(necube.shape, dtype=np.uint8)
+	inccode	= np.zeros(necube.shape, dtype=np.uint8)
+
+	ypos	= (np.arange(necube.shape[1]) - cenpx[1]) * dkpc[1]
+	zpos	= (np.arange(necube.shape[2]) - cenpx[2]) * dkpc[2]
+	for i0 in range(0, necube.shape[0], slabsize):
+		xpos	= (np.arange(i0, min(i0+slabsize, necube.shape[0])) - cenpx[0]) * dkpc[0]
+		x, y, z	= np.meshgrid(xpos, ypos, zpos, indexing='ij')
+		rkpc	= np.sqrt(x**2 + y**2 + z**2)
+		theta	= np.arctan2(z, np.sqrt(x**2 + y**2))
+		with np.errstate(invalid='ignore', divide='ignore'):
+			cosinc	= (x*normvec[0] + y*normvec[1] + z*normvec[2]) / rkpc
+		incs	= np.nan_to_num(np.arcsin(np.sqrt(np.clip(1.0 - cosinc**2, 0.0, 1.0))))
+
+		rcode[i0:i0+slabsize]	= np.floor(rkpc / rres).astype(np.int16)
+		thcode[i0:i0+slabsize]	= np.floor(np.rad2deg(theta) + 90.0).astype(np.uint8)
+		inccode[i0:i0+slabsize]	= np.floor(np.rad2deg(incs) / voxdinc).astype(np.uint8)
+
+	print("Saving voxel index of ",fitsname)
+	np.savez(datadir+fitsname+"_voxidx.npz", rcode=rcode, thcode=thcode, inccode=inccode, rres=rres, dinc=voxdinc, theta0=theta0, phi0=phi0)
+
+	return(0)
+#	------------------------------------------------------------------------------------------------------
+
+
+
 def intnelos(necube,dkpc,xyz1,xyz2):	
 #	Integrate ne along a given LoS
 #	Arguments:	ne cube
@@ -110,13 +188,236 @@ def intnelos(necube,dkpc,xyz1,xyz2):
 
 
 
-def losdms(fitsname,necube,dkpc,theta0,phi0,nfixpts,logsm,logsfr,redshift, extent_kpc):	
-#	Calculate DMs integrating over LoS
+def intnelosbatch(necube,dkpc,xyz1,xyz2):	
+#	Integrate ne along many LoS at once, stepping through the cube exactly like intnelos
+#	Arguments:	ne cube
+#				cell/pixel size in kpc
+#				(N,3) arrays of the two end points of each LoS
+#	
+	vec		= xyz2 - xyz1
+	lenlos	= np.sqrt(np.sum(vec**2, axis=1))
+	dtlos	= 1.0/lenlos
+	#	Same number of steps as np.arange(0.0, 1.0, 1.0/lenlos) for each LoS; shorter LoS are padded and masked
+	nsteps	= np.ceil(1.0/dtlos).astype(int)
+	steps	= np.arange(np.amax(nsteps))
+	tarr	= steps[None,:] * dtlos[:,None]
+	inlos	= steps[None,:] < nsteps[:,None]
+
+	xarr	= np.rint(vec[:,0,None]*tarr + xyz1[:,0,None] + necube.shape[0]/2).astype(int) % necube.shape[0]
+	yarr	= np.rint(vec[:,1,None]*tarr + xyz1[:,1,None] + necube.shape[1]/2).astype(int) % necube.shape[1]
+	zarr	= np.rint(vec[:,2,None]*tarr + xyz1[:,2,None] + necube.shape[2]/2).astype(int) % necube.shape[2]
+
+	nelos	= np.where(inlos, necube[xarr, yarr, zarr], np.nan)
+	dmlos	= np.nansum(nelos, axis=1)*np.mean(dkpc)*1.0e3
+
+	return (dmlos)
+#	------------------------------------------------------------------------------------------------------
+
+
+
+def intnelosexact(necube,dkpc,xyz1,xyz2):	
+#	Integrate ne along many LoS at once by exact voxel traversal (Amanatides & Woo 1987)
+#	Each LoS is clipped at the cube boundary (no wrapping), and every voxel it crosses is weighted by the length of the LoS inside that voxel
+#	The crossings of all grid planes are sorted along each LoS, so that consecutive crossings bound one voxel, which gives the same voxel sequence as stepping cell by cell
+#	Arguments:	ne cube
+#				cell/pixel size in kpc
+#				(N,3) arrays of the two end points of each LoS
+#	
+	shape	= np.array(necube.shape)
+	vec		= xyz2 - xyz1
+	#	Grid coordinates in which voxel i spans [i, i+1); consistent with the np.rint() pixel assignment of intnelos
+	gxyz1	= xyz1 + shape/2 + 0.5
+
+	#	Parametric range of each LoS lying within the cube, clipped to the segment between the end points
+	with np.errstate(divide='ignore', invalid='ignore'):
+		tlo		= (0.0 - gxyz1)/vec
+		thi		= (shape - gxyz1)/vec
+	inbox	= (gxyz1 >= 0) & (gxyz1 <= shape)
+	tin		= np.where(vec != 0, np.minimum(tlo, thi), np.where(inbox, -np.inf, np.inf))
+	tout	= np.where(vec != 0, np.maximum(tlo, thi), np.where(inbox, np.inf, -np.inf))
+	tenter	= np.clip(np.amax(tin, axis=1), 0.0, 1.0)
+	texit	= np.maximum(np.clip(np.amin(tout, axis=1), 0.0, 1.0), tenter)		#	LoS missing the cube have zero length
+
+	#	Crossings of the interior grid planes; those outside the clipped range are parked at texit, i.e. zero-length segments
+	tcross	= [tenter[:,None], texit[:,None]]
+	for ax in range(3):
+		planes	= np.arange(1, shape[ax])
+		with np.errstate(divide='ignore', invalid='ignore'):
+			tplane	= (planes[None,:] - gxyz1[:,ax,None])/vec[:,ax,None]
+		tcross.append(np.where((tplane > tenter[:,None]) & (tplane < texit[:,None]), tplane, texit[:,None]))
+	tcross	= np.sort(np.concatenate(tcross, axis=1), axis=1)
+
+	#	Voxel containing each segment, from its mid-point, and the segment length
+	dtseg	= np.diff(tcross, axis=1)
+	tmid	= 0.5*(tcross[:,1:] + tcross[:,:-1])
+	ijk		= [np.clip(np.floor(gxyz1[:,ax,None] + tmid*vec[:,ax,None]).astype(int), 0, shape[ax]-1) for ax in range(3)]
+	lenkpc	= np.sqrt(np.sum((vec*np.asarray(dkpc))**2, axis=1))
+
+	dmlos	= np.nansum(necube[ijk[0], ijk[1], ijk[2]]*dtseg, axis=1)*lenkpc*1.0e3
+
+	return (dmlos)
+#	------------------------------------------------------------------------------------------------------
+
+
+
+def lospairs(ptslist):	
+#	Pair up the fixed points on every two faces of the cube
+#	Arguments:	list of (nfixpts,3) arrays of fixed points, one per face
+#	Returns two (N,3) arrays of LoS end points, in the same order as looping over pt1 in one face and pt2 in the other
+	
+	pt1s	= []
+	pt2s	= []
+	for ac in combinations(ptslist, 2):
+		pt1s.append(np.repeat(ac[0], len(ac[1]), axis=0))
+		pt2s.append(np.tile(ac[1], (len(ac[0]), 1)))
+
+	return (np.concatenate(pt1s), np.concatenate(pt2s))
+#	------------------------------------------------------------------------------------------------------
+
+
+
+def losdmbatch(necube,dkpc,theta0,phi0,pt1s,pt2s,chunksize=loschunk,method=losmethod):	
+#	Calculate inclination, impact factor, distance from major axis and DM of many LoS
+#	Arguments:	ne cube
+#				cell/pixel size in kpc
+#				orientation of the galaxy
+#				(N,3) arrays of the two end points of each LoS
+#				number of LoS handled together; memory use scales with chunksize x LoS length
+#				LoS integrator, 'nearest' (intnelosbatch) or 'exact' (intnelosexact)
+#	Returns an (N,4) array of [inclination, impact factor, distance from major axis, DM] for each LoS
+
+	dmarr	= np.zeros((len(pt1s), 4), dtype=float)
+
+	for i0 in range(0, len(pt1s), chunksize):
+		pt1		= pt1s[i0:i0+chunksize]
+		pt2		= pt2s[i0:i0+chunksize]
+		dmarr[i0:i0+chunksize, 0]	= inclinvecs(pt2 - pt1, theta0, phi0)
+		dmarr[i0:i0+chunksize, 1]	= impactfacs(pt1, pt2)*np.mean(dkpc)
+		dmarr[i0:i0+chunksize, 2]	= distfrmajoraxs(theta0, phi0, pt1, pt2)*np.mean(dkpc)
+		if method == 'exact':
+			dmarr[i0:i0+chunksize, 3]	= intnelosexact(necube,dkpc,pt1,pt2)
+		else:
+			dmarr[i0:i0+chunksize, 3]	= intnelosbatch(necube,dkpc,pt1,pt2)
+
+	return (dmarr)
+#	------------------------------------------------------------------------------------------------------
+
+
+
+#	Shared memory arrays attached to a LoS worker process, as name -> (SharedMemory, numpy view)
+losshm	= {}
+
+def losshminit(shmspec):	
+#	Attach a LoS worker process to the shared ne cube, LoS end points and output array
+#	Arguments:	dict of array name -> (shared memory name, shape, dtype)
+
+	for key, (shmname, shape, dtype) in shmspec.items():
+		try:
+			shm			= shared_memory.SharedMemory(name=shmname, track=False)
+		except TypeError:
+			#	Before python 3.13 attaching also registers the block with the (shared) resource tracker; the parent's unlink balances that, and the tracker still cleans up if the parent dies
+			shm			= shared_memory.SharedMemory(name=shmname)
+		losshm[key]		= (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
 
-	dmarr	= []
+	#	Detach again when the worker exits (the pool is closed and joined, not terminated, so that this runs)
+	mproc.util.Finalize(None, losshmclose, exitpriority=10)
+
+	return (0)
+#	------------------------------------------------------------------------------------------------------
+
+
+
+def losshmclose():	
+#	Detach a LoS worker process from the shared memory arrays; the parent process unlinks them
+
+	for key in list(losshm):
+		shm, shmarr	= losshm.pop(key)
+		del shmarr
+		shm.close()
+
+	return (0)
+#	------------------------------------------------------------------------------------------------------
+
+
+
+def losshmwork(task):	
+#	Calculate one block of LoS in a worker process, writing straight into the shared output array
+#	Arguments:	(first LoS, last LoS + 1, cell size in kpc, theta0, phi0, chunksize, LoS integrator)
+
+	i0, i1, dkpc, theta0, phi0, chunksize, method = task
+	necube	= losshm['necube'][1]
+	pt1s	= losshm['pt1s'][1]
+	pt2s	= losshm['pt2s'][1]
+
+	losshm['dmarr'][1][i0:i1]	= losdmbatch(necube,dkpc,theta0,phi0,pt1s[i0:i1],pt2s[i0:i1],chunksize,method)
+
+	return (i1 - i0)
+#	------------------------------------------------------------------------------------------------------
+
+
+
+def losmpcontext():	
+#	Multiprocessing context for the LoS process pool
+#	Forking inside an MPI rank copies the MPI library's state (network endpoints, pinned memory) into the children, which many MPI implementations do not survive,
+#	so under an initialised MPI the workers are spawned instead (the calling script then needs its if __name__ == '__main__' guard, as gethostdm_all.py and dmplot.py have)
+
+	mpi	= sys.modules.get('mpi4py.MPI')
+	if mpi is not None and mpi.Is_initialized() and not mpi.Is_finalized():
+		return (mproc.get_context('spawn'))
+
+	return (mproc.get_context())
+#	------------------------------------------------------------------------------------------------------
+
+
+
+def losdmshm(necube,dkpc,theta0,phi0,pt1s,pt2s,nproc,chunksize=loschunk,method=losmethod):	
+#	Same as losdmbatch, but with the LoS split across nproc processes
+#	The ne cube is copied once into POSIX shared memory, and every worker reads it (and writes its results) without copying
+#	Arguments:	as losdmbatch, plus the number of processes
+#	Returns an (N,4) array of [inclination, impact factor, distance from major axis, DM] for each LoS
+
+	arrays	= {'necube': necube, 'pt1s': pt1s, 'pt2s': pt2s, 'dmarr': None}
+	shapes	= {'necube': necube.shape, 'pt1s': pt1s.shape, 'pt2s': pt2s.shape, 'dmarr': (len(pt1s), 4)}
+	dtypes	= {'necube': necube.dtype, 'pt1s': pt1s.dtype, 'pt2s': pt2s.dtype, 'dmarr': np.dtype(float)}
+	shms	= {}
+
+	try:
+		for key in arrays:
+			nbytes		= int(np.prod(shapes[key])) * dtypes[key].itemsize
+			shms[key]	= shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+			shmarr		= np.ndarray(shapes[key], dtype=dtypes[key], buffer=shms[key].buf)
+			if arrays[key] is None:	shmarr[...] = 0.0
+			else:					shmarr[...] = arrays[key]
+			del shmarr
+
+		#	A few blocks per process, so that faster workers pick up the slack
+		nblocks	= max(1, min(4*nproc, int(np.ceil(len(pt1s)/chunksize))))
+		edges	= np.linspace(0, len(pt1s), nblocks+1).astype(int)
+		tasks	= [(edges[i], edges[i+1], dkpc, theta0, phi0, chunksize, method) for i in range(nblocks)]
+		shmspec	= {key: (shms[key].name, shapes[key], dtypes[key]) for key in shms}
+
+		print(f"Integrating {len(pt1s)} LoS in {nblocks} blocks over {nproc} processes sharing the ne cube")
+		with losmpcontext().Pool(nproc, initializer=losshminit, initargs=(shmspec,)) as pool:
+			pool.map(losshmwork, tasks)
+			pool.close()
+			pool.join()
+
+		dmarr	= np.ndarray(shapes['dmarr'], dtype=dtypes['dmarr'], buffer=shms['dmarr'].buf).copy()
+	finally:
+		for shm in shms.values():
+			shm.close()
+			shm.unlink()
+
+	return (dmarr)
+#	------------------------------------------------------------------------------------------------------
+
+
+
+def losdms(fitsname,necube,dkpc,theta0,phi0,nfixpts,logsm,logsfr,redshift, extent_kpc, chunksize=loschunk, method=losmethod, nproc=losnproc):	
+#	Calculate DMs integrating over LoS
 
 	extent_pixel = int(min(extent_kpc / dkpc[0], necube.shape[0]/2))
-	print(f'Computing LoS up to +/- {extent_pixel} pixels')
+	print(f'Computing LoS up to +/- {extent_pixel} pixels, with the {method} integrator')
 
 	ptpairs	= np.random.triangular(-extent_pixel, 0.0, extent_pixel, size=(6,2,nfixpts))
 	
@@ -128,20 +429,12 @@ def losdms(fitsname,necube,dkpc,theta0,phi0,nfixpts,logsm,logsfr,redshift, exten
 	ptszr	= np.array([ptpairs[5,0], ptpairs[5,1],  (necube.shape[0]/2)*np.ones(nfixpts,dtype=int)]).T
 	
 	ptslist	= [ptsxl, ptsxr, ptsyl, ptsyr, ptszl, ptszr]
-	plcom	= combinations(ptslist, 2)
-	
-	for ac in plcom:
-		for pt1 in ac[0]:
-			for pt2 in ac[1]:
-				vec		= pt2 - pt1
-				incdeg	= inclinvec(vec, theta0, phi0)
-				impf 	= impactfac(pt1, pt2)*np.mean(dkpc)
-				mindmaj = distfrmajorax (theta0, phi0, pt1, pt2)*np.mean(dkpc)
-				dmlos	= intnelos(necube,dkpc,pt1,pt2)
-				#print(vec, incdeg, impf, dmlos)
-				dmarr.append([incdeg, impf, mindmaj, dmlos])
-    
-	dmarr	= np.array(dmarr)
+	pt1s, pt2s	= lospairs(ptslist)
+
+	if nproc > 1:
+		dmarr	= losdmshm(necube,dkpc,theta0,phi0,pt1s,pt2s,nproc,chunksize,method)
+	else:
+		dmarr	= losdmbatch(necube,dkpc,theta0,phi0,pt1s,pt2s,chunksize,method)
 	
 	print("Total number of LoS = ",dmarr.shape[0])
 	print("Saving LoS DMs to ",fitsname)
@@ -152,6 +445,273 @@ def losdms(fitsname,necube,dkpc,theta0,phi0,nfixpts,logsm,logsfr,redshift, exten
 
 
 
+def necumsum(fitsname,necube,axis,slabsize=cumslab):	
+#	Prefix-sum (summed-area) index of the ne cube along one axis, kept next to the FITS file as fitsname_cumsum<x|y|z>.npy
+#	cumsum[k] along the axis is the sum of ne over cells 0..k-1 (NaNs count as 0), so it is one cell longer than the cube
+#	Built once, a few planes at a time, and memory mapped afterwards; rebuilt if older than the FITS file
+#	Arguments:	FITS name, ne cube, axis (0, 1, 2), number of planes read together while building
+
+	cumfile	= datadir+fitsname+"_cumsum"+"xyz"[axis]+".npy"
+	shape	= list(necube.shape)
+	shape[axis]	+= 1
+	shape	= tuple(shape)
+
+	if os.path.exists(cumfile) and os.path.getmtime(cumfile) >= os.path.getmtime(datadir+fitsname+".fits"):
+		cumsum	= np.load(cumfile, mmap_mode='r')
+		if cumsum.shape == shape: return (cumsum)
+
+	print("Building the "+"xyz"[axis]+" prefix-sum index of "+fitsname)
+	tmpfile	= cumfile+".tmp"
+	cumsum	= np.lib.format.open_memmap(tmpfile, mode='w+', dtype=np.float64, shape=shape)
+	slabax	= 1 if axis == 0 else 0
+
+	for s0 in range(0, necube.shape[slabax], slabsize):
+		insl			= [slice(None)]*3
+		insl[slabax]	= slice(s0, s0+slabsize)
+		slab			= np.nan_to_num(np.asarray(necube[tuple(insl)], dtype=np.float64))
+		outsl			= list(insl)
+		outsl[axis]		= slice(0, 1)
+		cumsum[tuple(outsl)]	= 0.0
+		outsl[axis]		= slice(1, None)
+		cumsum[tuple(outsl)]	= np.cumsum(slab, axis=axis)
+
+	cumsum.flush()
+	del cumsum
+	os.replace(tmpfile, cumfile)
+
+	return (np.load(cumfile, mmap_mode='r'))
+#	------------------------------------------------------------------------------------------------------
+
+
+
+def axisdmseg(cumsum,dkpc,axis,ij,k1,k2):	
+#	DM of axis aligned LoS segments from the prefix-sum index, at a constant cost per segment
+#	Arguments:	prefix-sum index along axis (necumsum)
+#				cell/pixel size in kpc
+#				axis of the LoS
+#				(N,2) array of cube indices across the LoS, in increasing axis order
+#				first cell and last cell + 1 of each segment along the LoS
+#	Returns the DM of each segment
+
+	ij		= np.atleast_2d(ij).astype(int)
+	k1		= np.broadcast_to(np.asarray(k1, dtype=int), (len(ij),))
+	k2		= np.broadcast_to(np.asarray(k2, dtype=int), (len(ij),))
+	cols	= [ij[:,0], ij[:,1]]
+	idx1	= tuple(cols[:axis] + [k1] + cols[axis:])
+	idx2	= tuple(cols[:axis] + [k2] + cols[axis:])
+
+	return ((cumsum[idx2] - cumsum[idx1]) * dkpc[axis] * 1e3)
+#	------------------------------------------------------------------------------------------------------
+
+
+
+def axisdmmap(cumsum,dkpc,axis,k1=0,k2=None):	
+#	DM map for LoS along one axis, between cells k1 and k2 - 1 (the whole cube by default), from one subtraction
+#	Returns a 2D map over the other two axes, in increasing axis order
+
+	if k2 is None: k2 = cumsum.shape[axis] - 1
+
+	return ((np.take(cumsum, k2, axis=axis) - np.take(cumsum, k1, axis=axis)) * dkpc[axis] * 1e3)
+#	------------------------------------------------------------------------------------------------------
+
+
+
+def axislosdms(fitsname,necube,dkpc,theta0,phi0,extent_kpc):	
+#	Calculate DMs of all axis aligned LoS through the cube, one per pixel column along each axis, from the prefix-sum index
+#	Columns are kept within extent_kpc of the centre, as the end points in losdms
+#	Saved as an (N,4) array of [inclination, impact factor, distance from major axis, DM], like losdms, to fitsname_axis.npy
+
+	dmarrs	= []
+	for axis in range(3):
+		cumsum	= necumsum(fitsname,necube,axis)
+		dmmap	= axisdmmap(cumsum,dkpc,axis)
+		others	= [ax for ax in range(3) if ax != axis]
+		
+		pix		= [np.arange(necube.shape[ax]) - necube.shape[ax]/2 for ax in others]
+		pi, pj	= np.meshgrid(pix[0], pix[1], indexing='ij')
+		extent_pixel	= min(extent_kpc / dkpc[axis], necube.shape[axis]/2)
+		inext	= (np.abs(pi) <= extent_pixel) & (np.abs(pj) <= extent_pixel)
+
+		pt1s	= np.zeros((inext.sum(), 3))
+		pt1s[:,others[0]]	= pi[inext]
+		pt1s[:,others[1]]	= pj[inext]
+		pt2s	= pt1s.copy()
+		pt1s[:,axis]	= -necube.shape[axis]/2
+		pt2s[:,axis]	=  necube.shape[axis]/2
+
+		dmarr	= np.zeros((len(pt1s), 4), dtype=float)
+		dmarr[:,0]	= inclinvecs(pt2s - pt1s, theta0, phi0)
+		dmarr[:,1]	= impactfacs(pt1s, pt2s)*np.mean(dkpc)
+		dmarr[:,2]	= distfrmajoraxs(theta0, phi0, pt1s, pt2s)*np.mean(dkpc)
+		dmarr[:,3]	= dmmap[inext]
+		dmarrs.append(dmarr)
+
+	dmarr	= np.concatenate(dmarrs)
+	print("Total number of axis aligned LoS = ",dmarr.shape[0])
+	print("Saving axis aligned LoS DMs to ",fitsname)
+	np.save(losdir+fitsname+"_axis.npy",dmarr)
+
+	return(0)
+#	------------------------------------------------------------------------------------------------------
+
+
+
+def viewdirs(theta0,phi0,incdegs,azdeg=0.0):	
+#	Unit viewing directions at the given inclinations (deg) from the galaxy normal, turned towards azimuth azdeg about it
+#	Returns an (M,3) array of directions, in cube pixel coordinates
+
+	normvec	= np.array([np.sin(theta0) * np.cos(phi0), np.sin(theta0) * np.sin(phi0), np.cos(theta0)])
+	refvec	= np.array([0.0, 0.0, 1.0]) if np.abs(normvec[2]) < 0.9 else np.array([1.0, 0.0, 0.0])
+	perpa	= np.cross(normvec, refvec)
+	perpa	= perpa / np.linalg.norm(perpa)
+	perpb	= np.cross(normvec, perpa)
+	azrad	= np.deg2rad(azdeg)
+	perpvec	= np.cos(azrad)*perpa + np.sin(azrad)*perpb
+
+	incrads	= np.deg2rad(np.atleast_1d(incdegs))[:,None]
+
+	return (np.cos(incrads)*normvec + np.sin(incrads)*perpvec)
+#	------------------------------------------------------------------------------------------------------
+
+
+
+def beammap(necube,dkpc,theta0,phi0,losvec,slabsize=mapslab):	
+#	DM map of the whole cube seen along losvec, from one parallel beam resampling of the cube
+#	The cube is linearly resampled on a grid aligned with losvec, a few planes at a time, and summed along the beam
+#	Arguments:	ne cube, with NaNs already set to 0 (as a float32 array)
+#				cell/pixel size in kpc
+#				orientation of the galaxy
+#				viewing direction, in cube pixel coordinates
+#				number of planes along the beam resampled together
+#	Returns square maps of [inclination, impact factor, distance from major axis, DM] over the sky plane
+#	Pixels whose LoS do not cross the sphere inscribed in the cube are set to NaN
+
+	losvec	= np.asarray(losvec, dtype=float) / np.linalg.norm(losvec)
+	refvec	= np.array([0.0, 0.0, 1.0]) if np.abs(losvec[2]) < 0.9 else np.array([1.0, 0.0, 0.0])
+	skyvec1	= np.cross(losvec, refvec)
+	skyvec1	= skyvec1 / np.linalg.norm(skyvec1)
+	skyvec2	= np.cross(losvec, skyvec1)
+
+	cenpx	= np.array(necube.shape)/2
+	hsky	= int(np.amin(cenpx))
+	nsky	= 2*hsky + 1
+	hdep	= int(np.ceil(np.linalg.norm(cenpx)))
+	ndep	= 2*hdep + 1
+
+	#	output pixel (i,j,k) sits at (i-hsky)*skyvec1 + (j-hsky)*skyvec2 + (k-hdep)*losvec from the centre
+	rotmat	= np.array([skyvec1, skyvec2, losvec]).T
+	dmmap	= np.zeros((nsky, nsky), dtype=np.float64)
+	for k0 in range(0, ndep, slabsize):
+		nk		= min(slabsize, ndep - k0)
+		offset	= cenpx - hsky*skyvec1 - hsky*skyvec2 + (k0 - hdep)*losvec
+		slab	= affine_transform(necube, rotmat, offset=offset, output_shape=(nsky, nsky, nk), order=1, mode='constant', cval=0.0, prefilter=False)
+		dmmap	+= np.sum(slab, axis=2, dtype=np.float64)
+
+	usky, vsky	= np.meshgrid(np.arange(nsky) - hsky, np.arange(nsky) - hsky, indexing='ij')
+	skypts	= usky.reshape(-1,1)*skyvec1 + vsky.reshape(-1,1)*skyvec2
+	pt1s	= skypts - hdep*losvec
+	pt2s	= skypts + hdep*losvec
+	outside	= (usky**2 + vsky**2) > hsky**2
+	
+	maps	= np.zeros((4, nsky, nsky), dtype=np.float32)
+	maps[0]	= inclinvecs(losvec[None,:], theta0, phi0)[0]
+	maps[1]	= np.sqrt(usky**2 + vsky**2)*np.mean(dkpc)
+	maps[2]	= (distfrmajoraxs(theta0, phi0, pt1s, pt2s)*np.mean(dkpc)).reshape(nsky, nsky)
+	maps[3]	= dmmap * np.mean(dkpc) * 1e3
+	maps[:, outside]	= np.nan
+
+	return (maps)
+#	------------------------------------------------------------------------------------------------------
+
+
+
+def dmmaps(fitsname,necube,dkpc,theta0,phi0,losvecs,slabsize=mapslab):	
+#	Parallel beam DM maps of the whole cube along many viewing directions
+#	Each map gives one LoS per sky pixel, tagged with its inclination, impact factor and distance from major axis
+#	Saved to fitsname_dmmaps.npz, with the viewing directions and the (M,4,n,n) maps of [inclination, impact factor, distance from major axis, DM]
+
+	cube	= np.nan_to_num(np.asarray(necube, dtype=np.float32))
+
+	maps	= []
+	for i, losvec in enumerate(losvecs):
+		print(f"DM map {i+1} of {len(losvecs)}, along ({losvec[0]:.3f}, {losvec[1]:.3f}, {losvec[2]:.3f})")
+		maps.append(beammap(cube,dkpc,theta0,phi0,losvec,slabsize))
+	maps	= np.array(maps)
+
+	print("Saving DM maps of ",fitsname)
+	np.savez(losdir+fitsname+"_dmmaps.npz", losvecs=np.asarray(losvecs), maps=maps)
+
+	return(0)
+#	------------------------------------------------------------------------------------------------------
+
+
+
+def dmmaprows(mapfile):	
+#	Read saved DM maps and flatten them into an (N,4) array of [inclination, impact factor, distance from major axis, DM], like losdms
+
+	maps	= np.load(mapfile)['maps']
+	rows	= maps.transpose(0,2,3,1).reshape(-1, 4)
+
+	return (rows[np.isfinite(rows[:,3])])
+#	------------------------------------------------------------------------------------------------------
+
+
+
+def fibdirs(ndirs):	
+#	Quasi uniform viewing directions over the hemisphere (a Fibonacci grid); the opposite directions give the same DMs
+#	Returns an (ndirs,3) array of unit vectors, in cube pixel coordinates
+
+	goldang	= np.pi * (3.0 - np.sqrt(5.0))
+	zdir	= (np.arange(ndirs) + 0.5) / ndirs
+	rdir	= np.sqrt(1.0 - zdir**2)
+	phidir	= np.arange(ndirs) * goldang
+
+	return (np.array([rdir*np.cos(phidir), rdir*np.sin(phidir), zdir]).T)
+#	------------------------------------------------------------------------------------------------------
+
+
+
+def dmatlas(fitsname,necube,dkpc,theta0,phi0,ndirs=atlasndirs,slabsize=mapslab):	
+#	DM atlas of a snapshot: parallel beam DM maps (beammap) on a Fibonacci grid of viewing directions over the hemisphere
+#	Stored in one chunked HDF5 file, fitsname_dmatlas.h5, tagged with the hash, size and time of the FITS cube it came from
+#	The impact factor map is the same for every direction and is stored once; each map has a single inclination
+#	Query with craft_utils.read_dm_atlas, check with craft_utils.is_atlas_current
+
+	fitsfile	= datadir+fitsname+".fits"
+	atlasfile	= losdir+fitsname+"_dmatlas.h5"
+	losvecs		= fibdirs(ndirs)
+	cube		= np.nan_to_num(np.asarray(necube, dtype=np.float32))
+
+	print("Building DM atlas of "+fitsname+" over "+str(ndirs)+" viewing directions")
+	with h5py.File(atlasfile+".tmp", 'w') as hf:
+		for i, losvec in enumerate(losvecs):
+			maps	= beammap(cube,dkpc,theta0,phi0,losvec,slabsize)
+			if i == 0:
+				nsky	= maps.shape[1]
+				hf.create_dataset('losvecs', data=losvecs)
+				hf.create_dataset('inc', shape=(ndirs,), dtype=np.float32)
+				hf.create_dataset('impf', data=maps[1])
+				hf.create_dataset('distmaj', shape=(ndirs, nsky, nsky), dtype=np.float32, chunks=(1, nsky, nsky))
+				hf.create_dataset('dm', shape=(ndirs, nsky, nsky), dtype=np.float32, chunks=(1, nsky, nsky))
+			hf['inc'][i]		= np.nanmax(maps[0])
+			hf['distmaj'][i]	= maps[2]
+			hf['dm'][i]			= maps[3]
+
+		hf.attrs['cubehash']	= get_file_hash(fitsfile)
+		hf.attrs['cubesize']	= os.path.getsize(fitsfile)
+		hf.attrs['cubemtime']	= os.path.getmtime(fitsfile)
+		hf.attrs['theta0']		= theta0
+		hf.attrs['phi0']		= phi0
+		hf.attrs['dkpc']		= dkpc
+
+	os.replace(atlasfile+".tmp", atlasfile)
+	print("Saved DM atlas to "+atlasfile)
+
+	return(0)
+#	------------------------------------------------------------------------------------------------------
+
+
+
 def plotdms(fitsname,nfixpts,logsm,logsfr,redshift,scalekpc):	
 #	Plots maximum DMs along different LoSs
 	
@@ -11,7 +11,7 @@
                  run plot_projected_gas_density.py --system ayan_local --halo 8508 --upto_kpc 200 --output RD0027 --docomoving
 """
 from foggie_header import *
-from make_3D_FRB_electron_density import get_AM_vector, plot_projection_diskrel
+from make_3D_FRB_electron_density import plot_projection_diskrel
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 
 plt.rcParams['axes.linewidth'] = 1
@@ -40,23 +40,13 @@ if __name__ == '__main__':
     print_master('Total number of MPI ranks = ' + str(ncores) + '. Starting at: {:%Y-%m-%d %H:%M:%S}'.format(datetime.now()), args)
     comm.Barrier() # wait till all cores reached here and then resume
 
-    split_at_cpu = total_snaps - ncores * int(total_snaps/ncores)
-    nper_cpu1 = int(total_snaps / ncores)
-    nper_cpu2 = nper_cpu1 + 1
-    if rank < split_at_cpu:
-        core_start = rank * nper_cpu2
-        core_end = (rank+1) * nper_cpu2 - 1
-    else:
-        core_start = split_at_cpu * nper_cpu2 + (rank - split_at_cpu) * nper_cpu1
-        core_end = split_at_cpu * nper_cpu2 + (rank - split_at_cpu + 1) * nper_cpu1 - 1
-
     # -------------loop over snapshots-----------------
-    print_mpi('Operating on snapshots ' + str(core_start + 1) + ' to ' + str(core_end + 1) + ', i.e., ' + str(core_end - core_start + 1) + ' out of ' + str(total_snaps) + ' snapshots', args)
+    print_master('Handing out ' + str(total_snaps) + ' snapshots dynamically across MPI ranks, most expensive first', args)
 
-    for index in range(core_start + args.start_index, core_end + 1):
+    for index in mpi_snapshot_loop(list_of_sims, start_index=args.start_index):
         start_time_this_snapshot = datetime.now()
         this_sim = list_of_sims[index]
-        print_mpi('Doing snapshot ' + this_sim[1] + ' of halo ' + this_sim[0] + ' which is ' + str(index + 1 - core_start) + ' out of the total ' + str(core_end - core_start + 1) + ' snapshots...', args)
+        print_mpi('Doing snapshot ' + this_sim[1] + ' of halo ' + this_sim[0] + ' which is ' + str(index + 1) + ' out of the total ' + str(total_snaps) + ' snapshots...', args)
 
         try:
             # -------loading in snapshot-------------------
@@ -66,7 +56,7 @@ if __name__ == '__main__':
             if type(args) is tuple: args, ds, refine_box = args  # if the sim has already been loaded in, in order to compute the box center (via utils.pull_halo_center()), then no need to do it again
             else: ds, refine_box = load_sim(args, region='refine_box', do_filter_particles=True, disk_relative=False, halo_c_v_name=halos_df_name)
 
-            norm_L = get_AM_vector(ds) #np.array([-0.64498829, -0.5786498 , -0.49915379]) #computing disk orientation #
+            norm_L = get_AM_vector(ds, args=args) #np.array([-0.64498829, -0.5786498 , -0.49915379]) #computing disk orientation #
 
             # --------assigning additional keyword args-------------
             args.current_redshift = ds.current_redshift
@@ -11,8 +11,9 @@ from craft_utils import *
 setup_plot_style()
 
 #	----------------------------------------------------------------------------------------------------------
-def plot_nerad(cubes, inc_ranges, title, outfile, fig_size, hide=False, subtitle='', given_ax=None, fortalk=False):
+def plot_nerad(cubes, inc_ranges, title, outfile, fig_size, hide=False, subtitle='', given_ax=None, fortalk=False, binned_nes=None):
     #	Plot Radial profile of ne within the inclination range
+    #	binned_nes (e.g. from get_voxel_profiles), if given, are plotted instead of binning the ray sampled profiles in cubes
 
     if given_ax is None:
         fig 	= plt.figure(figsize=(1.2 * fig_size, fig_size))
@@ -22,21 +23,24 @@ def plot_nerad(cubes, inc_ranges, title, outfile, fig_size, hide=False, subtitle
     
     # ------------loop over inclination ranges-----------------
     for i, inc_range in enumerate(inc_ranges):
-        binned_ne	= np.zeros((len(radbins)-1, 6), dtype=np.float32)		
-        binrelnes	= []
+        if binned_nes is not None:
+            binned_ne	= binned_nes[i]
+        else:
+            binned_ne	= np.zeros((len(radbins)-1, 6), dtype=np.float32)		
+            binrelnes	= []
 
-        for cube in cubes:
-            relinds	= np.where((cube.inclination - np.deg2rad(inc_range[0]))*(cube.inclination - np.deg2rad(inc_range[1])) <= 0.0)	
-            relne	= cube.neincrad[relinds]
-            binrelnes.append(relne)				
+            for cube in cubes:
+                relinds	= np.where((cube.inclination - np.deg2rad(inc_range[0]))*(cube.inclination - np.deg2rad(inc_range[1])) <= 0.0)	
+                relne	= cube.neincrad[relinds]
+                binrelnes.append(relne)				
 
-        binrelne	= np.concatenate(binrelnes, axis=0)
+            binrelne	= np.concatenate(binrelnes, axis=0)
 
-        #	The ugly binning in radius
-        for k in range (0,len(radbins)-1):
-            rel2inds		= np.where((cubes[0].radkpc - radbins[k]) * (cubes[0].radkpc - radbins[k+1]) <= 0.0)
-            binned_ne[k,0]	= (radbins[k]+radbins[k+1])/2.0
-            binned_ne[k,1:6]= np.percentile(binrelne[:,rel2inds], (16, 25, 50, 75, 84))
+            #	The ugly binning in radius
+            for k in range (0,len(radbins)-1):
+                rel2inds		= np.where((cubes[0].radkpc - radbins[k]) * (cubes[0].radkpc - radbins[k+1]) <= 0.0)
+                binned_ne[k,0]	= (radbins[k]+radbins[k+1])/2.0
+                binned_ne[k,1:6]= np.percentile(binrelne[:,rel2inds], (16, 25, 50, 75, 84))
 
         ax.fill_between(binned_ne[:,0], binned_ne[:,1], binned_ne[:,5], color=shlist[i],alpha=0.1)
         #ax.plot(binned_ne[:,0], binned_ne[:,1], colist[i]+'--', lw=0.5)
@@ -17,6 +17,8 @@
   run radialplot.py --quant electron --mode lsmzsfr --lsm all --multi_panel
   run radialplot.py --quant gas --mode lsmzsfr --lsm all
   run radialplot.py --quant gas --mode lsmzsfr --lsm all --multi_panel
+  run radialplot.py --quant electron --mode lsmzsfr --lsm all --use_voxel_index
+  run radialplot.py --quant electron --mode lsmzsfr --lsm all --stream_profiles
 '''
 #	--------------------------	Import modules	---------------------------
 from craft_utils import *
@@ -42,6 +44,32 @@ def print_instructions ():
 	
 	return(0)
 
+# -----------------------------------------------------------------------------
+def read_radprof(snap, incranges, args):
+    '''
+    Function to read the radial profile of a given snapshot, only within the given inclination ranges
+    Reads the columnar HDF5 profile (see craft_utils.write_radial_profile), falling back to the older pickled profile
+    Returns neradial namedtuple
+    '''
+    file_prefix = args.radial_data_dir / f'{snap["snap"]}_{snap["halo"]}_FRB{args.quant_text}_density_upto{args.rangekpc}kpc_res{args.reskpc}kpc_radprof'
+    if Path(f'{file_prefix}.h5').exists():
+        cube = read_radial_profile(f'{file_prefix}.h5', inc_ranges=incranges)
+    else:
+        with open(f'{file_prefix}.pkl', 'rb') as file_obj: cube	= pkl.load(file_obj)
+
+    return cube
+
+# -----------------------------------------------------------------------------
+def get_voxel_binned_nes(df_snap, incranges, args):
+    '''
+    Function to bin every voxel of the given snapshots' cubes via their voxel indices (see nefns.voxindex), stacking all snapshots together
+    Returns list of binned ne arrays, one per inclination range, as accepted by pfns.plot_nerad
+    '''
+    file_prefixes = [args.data_dir / f'{snap["snap"]}_{snap["halo"]}_FRB{args.quant_text}_density_upto{args.rangekpc}kpc_res{args.reskpc}kpc' for _, snap in df_snap.iterrows()]
+    binned_nes = get_voxel_profiles([(f'{prefix}.fits', f'{prefix}_voxidx.npz') for prefix in file_prefixes], incranges, radbins)
+
+    return binned_nes
+
 # -----------------------------------------------------------------------------
 def execute_mode_indi(df_snap, incranges, args):
     '''
@@ -56,12 +84,15 @@ def execute_mode_indi(df_snap, incranges, args):
         fig.subplots_adjust(left=0.07, bottom=0.07, right=0.98, top=0.98, wspace=0.01, hspace=0.01)
 
     for i, snap in df_snap.iterrows():
-        thisfile = args.radial_data_dir / f'{snap["snap"]}_{snap["halo"]}_FRB{args.quant_text}_density_upto{args.rangekpc}kpc_res{args.reskpc}kpc_radprof.pkl'
-        with open(thisfile, 'rb') as file_obj: cube	= pkl.load(file_obj)
+        if args.use_voxel_index:
+            cubes, binned_nes = [], get_voxel_binned_nes(df_snap.loc[[i]], incranges, args)
+        else:
+            cube = read_radprof(snap, incranges, args)
+            cubes, binned_nes = [cube], None
 
         title	= r"log ($M_* / M_{\odot}$) = %.2f, SFR = %.2f $M_{\odot} yr^{-1}$"%(snap["lsm"], snap["sfr"])
         outfile = args.radial_plot_dir / f'{args.mode}_{snap["halo"]}_{snap["snap"]}_{args.quant}_density_radprof.pdf'
-        ax = pfns.plot_nerad([cube], incranges, title, outfile, 3.0, hide=args.hide, given_ax=axes[i // ncols][i % ncols] if args.multi_panel else None, fortalk=args.fortalk)
+        ax = pfns.plot_nerad(cubes, incranges, title, outfile, 3.0, hide=args.hide, given_ax=axes[i // ncols][i % ncols] if args.multi_panel else None, fortalk=args.fortalk, binned_nes=binned_nes)
 
         if args.multi_panel:
             if i // ncols < nrows - 1:
@@ -91,12 +122,15 @@ def execute_mode_halo(df_snap, incranges, args):
         fig.subplots_adjust(left=0.07, bottom=0.07, right=0.98, top=0.98, wspace=0.01, hspace=0.01)
 
     for i, snap in df_snap.iterrows():
-        thisfile = args.radial_data_dir / f'{snap["snap"]}_{snap["halo"]}_FRB{args.quant_text}_density_upto{args.rangekpc}kpc_res{args.reskpc}kpc_radprof.pkl'
-        with open(thisfile, 'rb') as file_obj: cube	= pkl.load(file_obj)
+        if args.use_voxel_index:
+            cubes, binned_nes = [], get_voxel_binned_nes(df_snap.loc[[i]], incranges, args)
+        else:
+            cube = read_radprof(snap, incranges, args)
+            cubes, binned_nes = [cube], None
 
         title	= r"log ($M_* / M_{\odot}$) = %.2f, SFR = %.2f $M_{\odot} yr^{-1}$"%(snap["lsm"], snap["sfr"])
         outfile = args.radial_plot_dir / f'{args.mode}_{snap["halo"]}_{snap["snap"]}_{args.quant}_density_radprof.pdf'
-        ax = pfns.plot_nerad([cube], incranges, title, outfile, 3.0, hide=args.hide, given_ax=axes[i // ncols][i % ncols] if args.multi_panel else None, fortalk=args.fortalk)
+        ax = pfns.plot_nerad(cubes, incranges, title, outfile, 3.0, hide=args.hide, given_ax=axes[i // ncols][i % ncols] if args.multi_panel else None, fortalk=args.fortalk, binned_nes=binned_nes)
 
         if args.multi_panel:
             if i // ncols < nrows - 1:
@@ -113,18 +147,33 @@ def execute_mode_halo(df_snap, incranges, args):
 def execute_mode_lsmzsfr(df_snap, incranges, args, given_ax=None):
     '''
     Function to execute mode lsmzsfr
-    Returns nothing
+    Returns the axis plotted on, or None on MPI ranks other than 0 with --stream_profiles (which only contribute to the merged sketch)
     '''
     print(f"\nCombining all within lsm range {args.lsm_range} and z range {args.z_range} \n")
 
     cubes = []
-
-    for i, snap in df_snap.iterrows():
-        thisfile = args.radial_data_dir / f'{snap["snap"]}_{snap["halo"]}_FRB{args.quant_text}_density_upto{args.rangekpc}kpc_res{args.reskpc}kpc_radprof.pkl'
-        with open(thisfile, 'rb') as file_obj: cube	= pkl.load(file_obj)
-        cubes.append(cube)
-
-    print(f"Total number of cubes = {len(cubes)}")	
+    binned_nes = None
+    last_snap = df_snap.iloc[-1] # names the output file, whichever way the profiles are stacked
+
+    if args.use_voxel_index:
+        binned_nes = get_voxel_binned_nes(df_snap, incranges, args)
+        print(f"Total number of cubes = {len(df_snap)}")	
+    elif args.stream_profiles:
+        comm = MPI.COMM_WORLD
+        sketch = make_ne_sketch(len(incranges), len(radbins) - 1)
+        for i, (_, snap) in enumerate(df_snap.iterrows()):
+            if i % comm.size != comm.rank: continue # each MPI rank sketches its own share of the cubes
+            sketch = update_ne_sketch(sketch, read_radprof(snap, incranges, args), incranges, radbins)
+        sketch = merge_ne_sketch(sketch)
+        if comm.rank > 0: return None # only rank 0 plots and saves the merged profiles
+        binned_nes = get_sketch_binned_nes(sketch, radbins)
+        print(f"Total number of cubes = {len(df_snap)}")	
+    else:
+        for i, snap in df_snap.iterrows():
+            cube = read_radprof(snap, incranges, args)
+            cubes.append(cube)
+
+        print(f"Total number of cubes = {len(cubes)}")	
 
     median_lsm	= np.nanmedian(df_snap["log_star_mass"]) 
     median_sfr	= np.nanmedian(df_snap["sfr"])
@@ -132,9 +181,9 @@ def execute_mode_lsmzsfr(df_snap, incranges, args, given_ax=None):
     #title	= "log ($M_* / M_{\odot}$) = %.2f, SFR = %.2f $M_{\odot} yr^{-1}$"%(median_lsm, median_sfr)
     title	= "%.1f < log ($M_* / M_{\odot}$) < %.1f"%(args.lsm_range[0], args.lsm_range[1])
     subtitle	= "%.1f < log (SFR / $M_{\odot} yr^{-1}$) < %.1f"%(args.lsfr_range[0], args.lsfr_range[1])
-    outfile = args.radial_plot_dir / f'{args.mode}_{snap["halo"]}_{snap["snap"]}_radprof.pdf'
+    outfile = args.radial_plot_dir / f'{args.mode}_{last_snap["halo"]}_{last_snap["snap"]}_radprof.pdf'
 
-    ax = pfns.plot_nerad(cubes, incranges, title, outfile, 2.8, hide=args.hide, subtitle=subtitle, given_ax=given_ax, fortalk=args.fortalk)
+    ax = pfns.plot_nerad(cubes, incranges, title, outfile, 2.8, hide=args.hide, subtitle=subtitle, given_ax=given_ax, fortalk=args.fortalk, binned_nes=binned_nes)
 
     return ax
 
@@ -183,7 +232,7 @@ if __name__ == '__main__':
                 # ---------------make the plots-----------------
                 ax = execute_mode_lsmzsfr(df_snap, incranges, args, given_ax=axes[nrow][ncol] if args.multi_panel else None)
 
-                if args.multi_panel:
+                if args.multi_panel and ax is not None:
                     if nrow < nrows - 1:
                         ax.tick_params(axis='x', which='major', labelsize=0, labelbottom=False)
                         ax.set_xlabel('')
@@ -193,7 +242,7 @@ if __name__ == '__main__':
             else:
                 print("\n\t\tHmm...What mode is that again...?\n")
 
-    if args.mode == 'lsmzsfr' and args.multi_panel:
+    if args.mode == 'lsmzsfr' and args.multi_panel and (not args.stream_profiles or MPI.COMM_WORLD.rank == 0):
         save_fig(fig, args.fig_dir, f'{args.mode}_inc_{args.inc_range[0]}_{args.inc_range[1]}_{args.quant}_density_multipanel_radprof.pdf', args)
 
     print('Completed in %s' % timedelta(seconds=(datetime.now() - start_time).seconds))
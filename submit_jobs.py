@@ -9,10 +9,13 @@
     Example :    run submit_jobs.py --call filter_star_properties --nnodes 50 --ncores 4 --prefix fsp --halo 8508 --dryrun --opt_args "--do_sll_sims"
     OR :         run /nobackupp19/aachary2/ayan_codes/foggie_craft/submit_jobs.py --call make_3D_FRB_electron_density --system ayan_pleiades --halo 8508 --queue ldan --mem 1500GB --prefix frb --opt_args "--res 1 --upto_kpc 10 --output RD0027 --docomoving --clobber --plot_3d --use_cen_smoothed"
                  run /nobackupp19/aachary2/ayan_codes/foggie_craft/submit_jobs.py --call make_3D_FRB_electron_density --system ayan_pleiades --do_all_halos --queue ldan --mem 1500GB --prefix frb --opt_args "--res 1 --upto_kpc 10 --output RD0027,RD0042 --docomoving --use_cen_smoothed"
+                 run /nobackupp19/aachary2/ayan_codes/foggie_craft/submit_jobs.py --call make_3D_FRB_electron_density --system ayan_pleiades --halo 8508 --queue long --prefix frb --use_cost_model --dryrun --opt_args "--res 1 --upto_kpc 10 --do_all_sims --use_cen_smoothed"
+                 run /nobackupp19/aachary2/ayan_codes/foggie_craft/submit_jobs.py --call gethostdm_all --system ayan_pleiades --halo 8508 --queue long --prefix dm --use_cost_model --dryrun --opt_args "losdm"
 """
-import subprocess, argparse, datetime, os
+import subprocess, argparse, datetime, os, re
 from collections import defaultdict
 from util import get_all_sims_for_this_halo
+from foggie_craft_utils.cost_model import estimate_job_resources
 import numpy as np
 
 # ------------------------------------------------------
@@ -28,6 +31,23 @@ def execute_command(command, is_dry_run=False):
         job = subprocess.check_output([command], shell=True)[:-1]
         return job
 
+# ---------------------------------------------------------
+def get_resources(nnodes, ncores, memory, args):
+    '''
+    Function to make the PBS resource request string, based on queues, procs, etc.
+    '''
+    resources = 'select=' + str(nnodes) + ':ncpus=' + str(ncores)
+
+    if args.queue[:2] == 'e_': resources += ':mem=' + memory # for submitting to endeavour
+    else: resources += ':mpiprocs=' + str(ncores)
+
+    if args.queue == 'ldan': resources += ':mem=' + memory # may specify mem per node for jobs on LDAN (for other procs it is by default the max available node mem)
+    else: resources += ':model=' + args.proc # need to specify the proc (but not necessarily the mem if I'm using the full node memory) if not an LDAN job
+
+    if args.aoe is not None: resources += ':aoe=' + args.aoe
+
+    return resources
+
 # ---------------------------------------------------------
 def parse_args():
     '''
@@ -58,6 +78,9 @@ def parse_args():
     parser.add_argument('--snapstart', metavar='snapstart', type=int, action='store', default=30)
     parser.add_argument('--snapstop', metavar='snapstop', type=int, action='store', default=30)
     parser.add_argument('--opt_args', metavar='opt_args', type=str, action='store', default='')
+    parser.add_argument('--use_cost_model', dest='use_cost_model', action='store_true', default=False, help='size walltime (and, if needed, nodes) from the runtime ledger of previous runs?, default is no')
+    parser.add_argument('--cost_safety', metavar='cost_safety', type=float, action='store', default=1.5, help='factor by which to pad the walltime predicted by the cost model; default is 1.5')
+    parser.add_argument('--cost_stage', metavar='cost_stage', type=str, action='store', default=None, help='stage of the runtime ledger to size the job from; default is the execution mode (first word of opt_args) for gethostdm_all, which records per mode, and total otherwise')
     args, leftovers = parser.parse_known_args()
 
     return args
@@ -105,15 +128,7 @@ if __name__ == '__main__':
     nhours = args.nhours if args.nhours is not None else '01' if args.dryrun or args.queue == 'devel' else '%02d' % (max_hours_dict[args.queue])
     ncpus = nnodes * ncores if args.ncpus is None else args.ncpus
 
-    resources = 'select=' + str(nnodes) + ':ncpus=' + str(ncores)
-
-    if args.queue[:2] == 'e_': resources += ':mem=' + memory # for submitting to endeavour
-    else: resources += ':mpiprocs=' + str(ncores)
-
-    if args.queue == 'ldan': resources += ':mem=' + memory # may specify mem per node for jobs on LDAN (for other procs it is by default the max available node mem)
-    else: resources += ':model=' + args.proc # need to specify the proc (but not necessarily the mem if I'm using the full node memory) if not an LDAN job
-
-    if args.aoe is not None: resources += ':aoe=' + args.aoe
+    resources = get_resources(nnodes, ncores, memory, args)
 
     #----------looping over and creating + submitting job files--------
     halos = ['8508', '5036', '5016', '4123', '2392', '2878']
@@ -126,12 +141,32 @@ if __name__ == '__main__':
         if jobname[:3] != args.proc: jobname = args.proc + '_' + jobname
         if args.nevery > 1: jobname += '_ne' + str(args.nevery)
 
+        # ----------sizing the job from the runtime ledger, if asked for---------
+        job_nhours, job_ncpus, job_resources = nhours, ncpus, resources
+        if args.use_cost_model and args.nhours is None:
+            if args.cost_stage is None: args.cost_stage = args.opt_args.split()[0] if args.callfunc == 'gethostdm_all' and len(args.opt_args.split()) > 0 else 'total'
+            output_arg = re.search(r'--output\s+(\S+)', args.opt_args)
+            outputs = None if output_arg is None or '--do_all_sims' in args.opt_args else output_arg.group(1).split(',') # None means all outputs of this halo in the ledger
+            est_nhours, min_nranks = estimate_job_resources(args.callfunc, thishalo, outputs, max_hours=max_hours_dict[args.queue], stage=args.cost_stage, safety=args.cost_safety)
+            if est_nhours is None:
+                print('No runtime ledger entries for ' + args.callfunc + ' stage ' + args.cost_stage + ' halo ' + thishalo + ', therefore using the default walltime')
+            else:
+                job_nnodes = nnodes
+                if min_nranks > ncpus and args.queue != 'ldan':
+                    job_nnodes = int(np.ceil(min_nranks / ncores))
+                    job_ncpus = job_nnodes * ncores
+                    job_resources = get_resources(job_nnodes, ncores, memory, args)
+                    print('Increasing nodes to ' + str(job_nnodes) + ' so that halo ' + thishalo + ' fits within the ' + args.queue + ' queue walltime limit')
+                est_nhours, _ = estimate_job_resources(args.callfunc, thishalo, outputs, nranks=job_ncpus, max_hours=max_hours_dict[args.queue], stage=args.cost_stage, safety=args.cost_safety)
+                job_nhours = '%02d' % est_nhours
+                print('Cost model predicts ' + job_nhours + ' h on ' + str(job_ncpus) + ' cores for halo ' + thishalo)
+
         # ----------replacing keywords in jobscript template to make the actual jobscript---------
         out_jobscript = workdir + '/' + jobarray_or_jobscript + '_' + jobname + '.sh'
 
-        replacements = {'PROJ_CODE': args.proj, 'RUN_NAME': jobname, 'NHOURS': nhours, 'NMINS': args.nmins, 'CALLFILE': callfile, 'WORKDIR': workdir, \
-                        'JOBSCRIPT_PATH': jobscript_path, 'QNAME': qname, 'RESOURCES': resources, 'RUNSIMFLAG': runsimflag,\
-                        'SYSTEMFLAG': systemflag, 'NCPUS': str(ncpus), 'HALOFLAG': haloflag, 'NSECONDS':str(int(nhours) * 3600), 'OPT_ARGS': args.opt_args} # keywords to be replaced in template jobscript
+        replacements = {'PROJ_CODE': args.proj, 'RUN_NAME': jobname, 'NHOURS': job_nhours, 'NMINS': args.nmins, 'CALLFILE': callfile, 'WORKDIR': workdir, \
+                        'JOBSCRIPT_PATH': jobscript_path, 'QNAME': qname, 'RESOURCES': job_resources, 'RUNSIMFLAG': runsimflag,\
+                        'SYSTEMFLAG': systemflag, 'NCPUS': str(job_ncpus), 'HALOFLAG': haloflag, 'NSECONDS':str(int(job_nhours) * 3600), 'OPT_ARGS': args.opt_args} # keywords to be replaced in template jobscript
 
         with open(jobscript_path + jobscript_template) as infile, open(out_jobscript, 'w') as outfile:
             for line in infile: